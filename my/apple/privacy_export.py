@@ -16,7 +16,6 @@ class config(user_config.privacy_export):
     gdpr_dir: PathIsh
 
 
-import os
 import json
 from datetime import datetime, timezone
 from pathlib import Path
@@ -30,6 +29,7 @@ Element = Union[_Element, None]
 
 from my.core import Stats, Res, make_logger
 from my.core.common import mcachew
+from my.utils.dispatch import PrefixDispatch
 
 
 logger = make_logger(__name__)
@@ -99,25 +99,13 @@ def events() -> Results:
         "Other data/Apple Features Using iCloud/Mail": None,  # probably better to just do an IMAP sync and get all the data
         "Other data/": None,  # ignore anything else in this directory
     }
-    for f in gdpr_dir.rglob("*"):
-        handler: Any
-        for prefix, h in handler_map.items():
-            if not str(f).startswith(os.path.join(gdpr_dir, prefix)):
-                continue
-            handler = h
-            break
-        else:
-            if f.is_dir():
-                # rglob("*") matches directories, ignore those
-                continue
-            else:
-                e = RuntimeError(f"Unhandled file: {f}")
-                logger.debug(str(e))
-                yield e
-                continue
-
+    # explicitly ignored files aren't returned, and directories with only those aren't walked
+    dispatch: PrefixDispatch[Any] = PrefixDispatch(handler_map)
+    for f, handler in dispatch.files(gdpr_dir):
         if handler is None:
-            # explicitly ignored
+            e = RuntimeError(f"Unhandled file: {f}")
+            logger.debug(str(e))
+            yield e
             continue
 
         yield from handler(f)
@@ -26,17 +26,19 @@ which ls
 from my.config import bash as user_config  # type: ignore[attr-defined]
 
 from pathlib import Path
-from typing import Sequence, List
-from datetime import datetime
-from typing import NamedTuple, Iterator, Optional
-from itertools import chain
-
-from more_itertools import unique_everseen
+from typing import Sequence, List, Tuple
+from datetime import datetime, timezone
+from typing import NamedTuple, Iterator, Optional, Union
 
 from my.core import get_files, Stats, make_logger, Paths, dataclass
 from my.core.common import mcachew
-from my.utils.time import parse_datetime_sec
 from my.utils.input_source import InputSource
+from my.utils.parallel import parse_files
+from my.utils.file_cache import file_cache_path, file_depends_on
+from my.utils.snapshots import remove_prefix_snapshots
+from my.utils.merge import merge_unique
+from my.utils.columnar import HistoryColumns, ColumnsBuilder, cached_columns
+from my.utils.lazy_dt import LazyDtRecord
 
 
 @dataclass
@@ -53,8 +55,21 @@ def inputs() -> Sequence[Path]:
 
 
 # represents one history entry (command)
-class Entry(NamedTuple):
-    dt: datetime
+# this only creates the datetime when dt is accessed, see my.utils.lazy_dt
+class Entry(LazyDtRecord):
+    __slots__ = ("command",)
+    _fields = ("dt", "command")
+
+    command: str
+
+    def __init__(self, dt: Union[datetime, int], command: str) -> None:
+        self._set_dt(dt)
+        self.command = command
+
+
+# cachew can only store NamedTuples/dataclasses, so the caches store these
+class _CachedEntry(NamedTuple):
+    epoch: int
     command: str
 
 
@@ -65,45 +80,113 @@ def _cachew_depends_on(for_paths: InputSource = inputs) -> List[float]:
     return [p.stat().st_mtime for p in for_paths()]
 
 
-@mcachew(depends_on=_cachew_depends_on, logger=logger)
 def history(from_paths: InputSource = inputs) -> Results:
-    yield from unique_everseen(
-        chain(*map(_parse_file, from_paths())),
+    for r in _history(from_paths):
+        yield Entry(*r)
+
+
+@mcachew(depends_on=_cachew_depends_on, logger=logger)
+def _history(from_paths: InputSource) -> Iterator[_CachedEntry]:
+    yield from merge_unique(
+        # backups which are a prefix of a later backup wouldn't add any new entries
+        *parse_files(_parse_file_cached, remove_prefix_snapshots(from_paths())),
         key=lambda h: (
-            h.dt,
+            h.epoch,
             h.command,
         ),
+        dt=lambda h: h.epoch,
     )
 
 
+# cache each file separately, so a new backup only means parsing that file
+@mcachew(
+    cache_path=file_cache_path("my.bash._parse_file_cached"),
+    depends_on=file_depends_on,
+    logger=logger,
+)
+def _parse_file_cached(histfile: Path) -> Iterator[_CachedEntry]:
+    for row in _parse_file_rows(histfile):
+        yield _CachedEntry(*row)
+
+
 def _parse_file(histfile: Path) -> Results:
-    dt: Optional[datetime] = None
-    command_buf = ""  # current command
-    for line in histfile.open(encoding="latin-1"):
-        if line.startswith("#"):
-            # parse lines like '#1620931766'
-            # possible string datetime
-            sdt = line[1:].strip()  # remove newline
-            try:
-                newdt = parse_datetime_sec(sdt)
-            except Exception as e:
-                logger.debug(f"Error while parsing datetime {e}")
-            else:
-                # this case happens when we successfully parse a datetime line
-                # yield old data, then set newly parsed data to next items datetime
-                if dt is not None:
-                    # rstrip \n gets rid of the last newline for each command
-                    yield Entry(dt=dt, command=command_buf.rstrip("\n"))
-                # set new datetime for next entry
-                dt = newdt
-                # overwrite command buffer
-                command_buf = ""
-                continue
-        # otherwise, append. this already includes newline
-        command_buf += line
+    for epoch, command in _parse_file_rows(histfile):
+        yield Entry(dt=epoch, command=command)
+
+
+# (epoch, command)
+Row = Tuple[int, str]
+
+# the largest timestamp a datetime can be created for
+_MAX_EPOCH = int(datetime.max.replace(tzinfo=timezone.utc).timestamp())
+
+
+def _parse_epoch(line: str) -> Optional[int]:
+    # parse lines like '#1620931766'
+    # possible string datetime
+    sdt = line[1:].strip()  # remove newline
+    # cheap check, so comments in multi-line commands don't go through int()
+    if not (sdt.isdigit() and sdt.isascii()):
+        return None
+    epoch = int(sdt)
+    if epoch <= _MAX_EPOCH:
+        return epoch
+    logger.debug(f"Timestamp out of range: {sdt}")
+    return None
+
+
+def _parse_file_rows(histfile: Path) -> Iterator[Row]:
+    epoch: Optional[int] = None
+    # lines of the current command, joined once when the entry is done
+    lines: List[str] = []
+    with histfile.open(encoding="latin-1") as f:
+        for line in f:
+            if line[0] == "#":
+                new_epoch = _parse_epoch(line)
+                if new_epoch is not None:
+                    # this case happens when we successfully parse a datetime line
+                    # yield old data, then set newly parsed data to next items datetime
+                    if epoch is not None:
+                        # rstrip \n gets rid of the last newline for each command
+                        yield epoch, "".join(lines).rstrip("\n")
+                    # set new datetime for next entry
+                    epoch = new_epoch
+                    lines = []
+                    continue
+            # otherwise, append. this already includes newline
+            lines.append(line)
     # yield final command
-    if dt is not None and command_buf.strip():
-        yield Entry(dt=dt, command=command_buf.rstrip("\n"))
+    if epoch is not None:
+        command = "".join(lines)
+        if command.strip():
+            yield epoch, command.rstrip("\n")
+
+
+def history_columns(from_paths: InputSource = inputs) -> HistoryColumns:
+    """
+    The same entries as history(), stored column-wise. This doesn't create a
+    datetime/Entry for each entry, and the columns are cached to disk.
+    See my.utils.columnar
+    """
+
+    def _build() -> HistoryColumns:
+        builder = ColumnsBuilder()
+        for epoch, command in merge_unique(
+            *parse_files(_parse_file_rows, remove_prefix_snapshots(from_paths())),
+            key=lambda r: r,
+            dt=lambda r: r[0],
+        ):
+            builder.add(epoch, command)
+        return builder.columns
+
+    # if user has specified some other function as input
+    if hash(from_paths) != hash(inputs):
+        return _build()
+    return cached_columns(
+        "my.bash.history_columns",
+        str([file_depends_on(p) for p in from_paths()]),
+        _build,
+    )
 
 
 def stats() -> Stats:
@@ -20,6 +20,7 @@ from more_itertools import unique_everseen
 from my.core import get_files, Stats, make_logger, Paths, dataclass
 from my.core.common import mcachew
 from my.utils.input_source import InputSource
+from my.utils.parallel import parse_files
 
 
 @dataclass
@@ -56,7 +57,7 @@ def _parse_export_file(p: Path) -> Results:
 @mcachew(depends_on=_cachew_depends_on, logger=logger)
 def history(from_paths: InputSource = inputs) -> Results:
     yield from unique_everseen(
-        chain(*(_parse_export_file(p) for p in from_paths())), key=lambda g: g.end_time
+        chain(*parse_files(_parse_export_file, from_paths())), key=lambda g: g.end_time
     )
 
 
@@ -12,16 +12,15 @@ class config(user_config.gdpr):
     gdpr_dir: PathIsh  # path to unpacked GDPR archive
 
 
-import os
 import json
 from datetime import datetime
 from pathlib import Path
-from itertools import chain
 from typing import Iterator, Dict, Any, NamedTuple, Union, Optional, List
 
 
-from my.core import get_files, Stats, Res, Json, make_logger
+from my.core import Stats, Res, Json, make_logger
 from my.utils.time import parse_datetime_sec
+from my.utils.dispatch import PrefixDispatch
 
 
 logger = make_logger(__name__)
@@ -119,9 +118,6 @@ Results = Iterator[Res[Event]]
 
 
 def events() -> Results:
-    # get files 2 levels deep into the export
-    gdpr_dir = str(Path(config.gdpr_dir).expanduser().absolute())  # expand path
-    files = chain(*map(lambda f: f.rglob("*"), get_files(config.gdpr_dir)))
     handler_map = {
         "about_you/face_recog": None,
         "about_you/friend_peer": None,
@@ -169,27 +165,17 @@ def events() -> Results:
         "security_and_login_information/datr_cookie": None,
         "posts/other_people's_posts_to_your_timeline": None,  # maybe implement this? OtherComment NamedTuple? Comment should just be mine
     }
-    for f in files:
-        handler: Any
-        for prefix, h in handler_map.items():
-            if not str(f).startswith(os.path.join(gdpr_dir, prefix)):
-                continue
-            handler = h
-            break
-        else:
-            if f.is_dir():
-                # rglob("*") matches directories, as well as any subredirectories/json files in those
-                # this is here exclusively for the messages dir, which has a larger structure
-                # json files from inside the dirs are still picked up by rglob
-                continue
-            else:
-                e = RuntimeError(f"Unhandled file: {f}")
-                logger.debug(str(e))
-                yield e
-                continue
-
+    # explicitly ignored files aren't returned, and directories with only those aren't walked
+    gdpr_dir = Path(config.gdpr_dir).expanduser().absolute()  # expand path
+    dispatch: PrefixDispatch[Any] = PrefixDispatch(handler_map)
+    for f, handler in dispatch.files(gdpr_dir):
+        if f.parent == gdpr_dir:
+            # files at the top of the export (e.g. index.html) aren't data
+            continue
         if handler is None:
-            # explicitly ignored
+            e = RuntimeError(f"Unhandled file: {f}")
+            logger.debug(str(e))
+            yield e
             continue
 
         if f.suffix != ".json":
@@ -18,6 +18,7 @@ from more_itertools import unique_everseen
 
 from my.core import get_files, Stats, make_logger, Paths, dataclass
 from my.utils.input_source import InputSource
+from my.utils.parallel import parse_files
 
 
 @dataclass
@@ -44,7 +45,7 @@ def _parse_export_file(p: Path) -> Results:
 
 def history(from_paths: InputSource = inputs) -> Results:
     yield from unique_everseen(
-        chain(*(_parse_export_file(p) for p in from_paths())),
+        chain(*parse_files(_parse_export_file, from_paths())),
         key=lambda lst: lst.listened_at,
     )
 
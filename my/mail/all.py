@@ -1,4 +1,4 @@
-from typing import Iterator
+from typing import Iterator, Optional, Collection
 from itertools import chain
 
 from my.core import Stats
@@ -13,36 +13,54 @@ src_mbox = import_source(module_name="my.mail.mbox", help_url=MAIL_HELP)
 
 
 # top-level import -- this whole module requires mail-parser/dateparser
-from .common import Email, unique_mail, MessagePart
+from .common import unique_mail, MessagePart
+from .dedup import HeaderPrecheck
+from .index import AnyEmail
 
 
 @src_imap
-def _mail_imap() -> Iterator[Email]:
+def _mail_imap(precheck: HeaderPrecheck) -> Iterator[AnyEmail]:
     from . import imap
 
-    return imap.mail()
+    return imap.raw_mail(precheck)
 
 
 @src_mbox
-def _mail_mbox() -> Iterator[Email]:
+def _mail_mbox(precheck: HeaderPrecheck) -> Iterator[AnyEmail]:
     from . import mbox
 
-    return mbox.mail()
+    return mbox.raw_mail(precheck)
 
 
 # NOTE: you can comment out the sources you don't want
-def mail() -> Iterator[Email]:
-    yield from unique_mail(
-        chain(
-            _mail_mbox(),
-            _mail_imap(),
+def mail() -> Iterator[AnyEmail]:
+    # messages with the same raw Message-ID/Date/Subject headers as one
+    # we've already seen (e.g. in both the mbox and IMAP folders) aren't
+    # parsed, unique_mail removes the rest of the duplicates
+    precheck = HeaderPrecheck()
+    try:
+        yield from unique_mail(
+            chain(
+                _mail_mbox(precheck),
+                _mail_imap(precheck),
+            )
         )
-    )
+    finally:
+        precheck.close()
 
 
-def mail_subparts() -> Iterator[MessagePart]:
+def mail_subparts(
+    content_types: Optional[Collection[str]] = None,
+) -> Iterator[MessagePart]:
+    """
+    if content_types is given (e.g. {'text/plain', 'text/html'}), only returns parts
+    with those content types, with their payloads decoded. see filter_message_subparts
+    """
     for m in mail():
-        yield from m.subparts
+        if content_types is None:
+            yield from m.subparts
+        else:
+            yield from m.filtered_subparts(content_types)
 
 
 def stats() -> Stats:
@@ -1,3 +1,5 @@
+import re
+import email
 import logging
 from pathlib import Path
 from email.message import Message
@@ -5,24 +7,33 @@ from typing import (
     List,
     Tuple,
     TextIO,
+    BinaryIO,
     Iterator,
     Optional,
     Union,
     Dict,
     Any,
     cast,
+    Protocol,
+    TypeVar,
+    Callable,
+    Collection,
 )
 from datetime import datetime
 from dataclasses import dataclass
 
-import dateparser
 from mailparser import MailParser  # type: ignore[import]
 from mailparser.exceptions import MailParserReceivedParsingError  # type: ignore[import]
-from more_itertools import unique_everseen
 
 from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
 
-from .parse_parts import tag_message_subparts
+from .dedup import SeenKeys, mail_key, MAX_IN_MEMORY
+from .parse_date import parse_mail_date
+from .parse_parts import (
+    tag_message_subparts,
+    filter_message_subparts,
+    TEXT_CONTENT_TYPES,
+)
 
 REQUIRES = ["mail-parser", "dateparser"]
 
@@ -41,7 +52,8 @@ logger = make_logger(__name__)
 class MessagePart:
     content_type: str
     payload: Any
-    _email: "Email"
+    # the Email (or my.mail.index.IndexedEmail) this is from
+    _email: Any
 
 
 class Email(MailParser):
@@ -57,6 +69,8 @@ class Email(MailParser):
     def __init__(self, message: Message) -> None:
         super().__init__(message=message)
         self.filepath: Optional[Path] = None
+        # (start, stop) offsets of the message, if its from an mbox file
+        self.mbox_range: Optional[Tuple[int, int]] = None
         self._dt: Optional[datetime] = None  # property to cache datetime result
         self._dateparser_failed: bool = False  # if dateparser previously failed
 
@@ -74,14 +88,16 @@ class Email(MailParser):
         if isinstance(d, datetime):
             self._dt = d
             return self._dt
-        if "Date" in self.headers:
-            dateparser_res: Optional[datetime] = dateparser.parse(self.headers["Date"])
+        # from the message, since the headers property decodes every header
+        date = self._message.get("Date")
+        if date is not None:
+            parsed = parse_mail_date(str(date))
             # if this failed to parse, save it on the object
-            if dateparser_res is None:
+            if parsed is None:
                 self._dateparser_failed = True
                 return None
             else:
-                self._dt = dateparser_res
+                self._dt = parsed
                 return self._dt
         return None
 
@@ -125,7 +141,7 @@ Subject: {self.subject}"""
     ) -> Optional["Email"]:
         try:
             if isinstance(fp, bytes):
-                m = cls.from_bytes(fp)
+                m = cls.from_string(message_string(fp))
             elif isinstance(fp, str):
                 m = cls.from_string(fp)
             elif isinstance(fp, Message):
@@ -158,9 +174,13 @@ Subject: {self.subject}"""
         return None
 
     @classmethod
-    def safe_parse_path(cls, path: Path) -> Optional["Email"]:
+    def safe_parse_path(
+        cls, path: Path, header_only: bool = False
+    ) -> Optional["Email"]:
+        if header_only:
+            return LazyEmail.parse_path_headers(path)
         with path.open("rb") as bf:
-            m = cls.safe_parse(try_decode_buf(bf.read()), display_filename=path)
+            m = cls.safe_parse(bf.read(), display_filename=path)
         if m is None:
             return None
         m.filepath = path
@@ -175,31 +195,295 @@ Subject: {self.subject}"""
                 _email=self,
             )
 
+    def filtered_subparts(
+        self,
+        content_types: Optional[Collection[str]] = TEXT_CONTENT_TYPES,
+        decode: bool = True,
+    ) -> Iterator[MessagePart]:
+        """
+        only the parts with these content types, see filter_message_subparts
+        """
+        for payload, content_type in filter_message_subparts(
+            self.message, content_types, decode
+        ):
+            yield MessagePart(
+                content_type=content_type,
+                payload=payload,
+                _email=self,
+            )
 
-def unique_mail(emails: Iterator[Email]) -> Iterator[Email]:
-    # remove duplicates (from a file being
-    # in multiple boxes and the 'default' inbox)
-    # some formats won't have a message id,
-    # but hopefully the date/subject creates a unique
-    # key in that case
-    yield from unique_everseen(
-        emails,
-        key=lambda m: (
-            m.subject_json,
-            m.message_id_json,
-            m.dt,
-        ),
-    )
 
+class _MailKey(Protocol):
+    @property
+    def subject(self) -> str:
+        pass
+
+    @property
+    def message_id(self) -> str:
+        pass
+
+    @property
+    def dt(self) -> Optional[datetime]:
+        pass
+
+
+M = TypeVar("M", bound=_MailKey)
+
+
+def message_from_path(path: Path) -> Message:
+    """
+    parses the file with the stdlib email module, without mailparser
+    """
+    with path.open("rb") as bf:
+        return email.message_from_string(message_string(bf.read()))
+
+
+def _header_end(buf: Union[str, bytes]) -> Optional[int]:
+    """
+    index right after the first blank line, where the headers end
+    """
+    if isinstance(buf, str):
+        sm = _HEADER_END_STR.search(buf)
+        return None if sm is None else sm.end()
+    bm = _HEADER_END_BYTES.search(buf)
+    return None if bm is None else bm.end()
+
+
+_HEADER_END_STR = re.compile("\r?\n\r?\n")
+_HEADER_END_BYTES = re.compile(b"\r?\n\r?\n")
+
+# read this much of the file at a time while looking for the end of the headers
+HEADER_CHUNK = 16 * 1024
+
+
+def _read_header_bytes(bf: BinaryIO) -> Tuple[bytes, Optional[int]]:
+    """
+    reads the file till the first blank line (or the end of the file),
+    returns what it read and where the headers end, if it found that
+    """
+    buf = b""
+    while True:
+        chunk = bf.read(HEADER_CHUNK)
+        buf += chunk
+        end = _header_end(buf)
+        if end is not None or not chunk:
+            return buf, end
+
+
+def read_header_bytes(path: Path) -> bytes:
+    """
+    the raw headers of the file, till the first blank line
+    """
+    with path.open("rb") as bf:
+        buf, end = _read_header_bytes(bf)
+    return buf if end is None else buf[:end]
+
+
+def _read_headers(path: Path) -> str:
+    """
+    reads the file up to the first blank line, and decodes
+    it the same way message_string decodes the headers
+    """
+    return decode_headers(read_header_bytes(path))
+
+
+class LazyEmail(Email):
+    """
+    An Email which only parses the headers up front. The first time the body,
+    attachments, subparts (or anything else which needs the rest of the message)
+    is accessed, this calls 'load' to get the whole message and parses it
+
+    Useful if you're only using the headers (subject, from, date etc.), since
+    that skips decoding/parsing every body and attachment
+    """
+
+    _message: Message
+
+    def __init__(
+        self, message: Message, load: Optional[Callable[[], Message]] = None
+    ) -> None:
+        # set before parsing, since parsing accesses self.message
+        self._load: Optional[Callable[[], Message]] = None
+        # while this is set, self.message is whatever has been parsed so far
+        self._reading_headers = False
+        super().__init__(message=message)
+        self._load = load
+
+    @property
+    def headers(self) -> Dict[str, Any]:
+        """
+        the headers, from the headers we've already parsed
+        """
+        self._reading_headers = True
+        try:
+            headers: Dict[str, Any] = super().headers
+            return headers
+        finally:
+            self._reading_headers = False
+
+    def _parse_body(self) -> None:
+        load = self._load
+        if load is None:
+            return
+        self._load = None
+        headers: Message = self._message
+        try:
+            self._message = load()
+            self.parse()
+        except Exception as e:
+            logger.warning(
+                f"While parsing the body of {self.filepath}: {e}, only using headers",
+                exc_info=e,
+            )
+            self._message = headers
+            self.parse()
+
+    @classmethod
+    def parse_path_headers(cls, path: Path) -> Optional["LazyEmail"]:
+        def _load() -> Message:
+            return message_from_path(path)
+
+        try:
+            headers = email.message_from_string(_read_headers(path))
+        except OSError as e:
+            logger.debug(f"While reading {path}: {e}")
+            return None
+        m = cls.safe_parse(headers, display_filename=path)
+        if m is None:
+            return None
+        m = cast(LazyEmail, m)
+        m._load = _load
+        m.filepath = path
+        return m
+
+    @classmethod
+    def parse_string_headers(
+        cls,
+        s: str,
+        display_filename: Path,
+        message_factory: Callable[[str], Message] = email.message_from_string,
+    ) -> Optional["LazyEmail"]:
+        end = _header_end(s)
+        m = cls.safe_parse(
+            message_factory(s if end is None else s[:end]),
+            display_filename=display_filename,
+        )
+        if m is None:
+            return None
+        m = cast(LazyEmail, m)
+        m._load = lambda: message_factory(s)
+        return m
+
+
+def _needs_body(name: str) -> property:
+    prop = getattr(Email, name)
+    assert isinstance(prop, property) and prop.fget is not None, name
+    fget = prop.fget
+
+    def _get(self: LazyEmail) -> Any:
+        if not self._reading_headers:
+            self._parse_body()
+        return fget(self)
+
+    return property(_get, doc=prop.__doc__)
 
-def try_decode_buf(buf: bytes) -> str:
+
+# anything on MailParser/Email which uses more than the headers
+for _name in (
+    "message",
+    "message_as_string",
+    "body",
+    "attachments",
+    "text_plain",
+    "text_html",
+    "text_not_managed",
+    "mail",
+    "mail_json",
+    "mail_partial",
+    "mail_partial_json",
+    "defects",
+    "defects_categories",
+    "has_defects",
+    "subparts",
+):
+    setattr(LazyEmail, _name, _needs_body(_name))
+
+
+def unique_mail(
+    emails: Iterator[M], max_in_memory: Optional[int] = MAX_IN_MEMORY
+) -> Iterator[M]:
+    """
+    remove duplicates (from a file being in multiple boxes and
+    the 'default' inbox). some formats won't have a message id,
+    but hopefully the date/subject creates a unique key in that case
+
+    this only keeps a 16-byte digest of each key. once there are more than
+    max_in_memory, they're moved to a temporary file, see my.mail.dedup
+    """
+    seen = SeenKeys(max_in_memory)
+    try:
+        for m in emails:
+            if seen.add(mail_key(m.subject, m.message_id, m.dt)):
+                yield m
+    finally:
+        seen.close()
+
+
+# the header can be folded, so charset= may be on a continuation line
+_CHARSET = re.compile(
+    rb"^content-type:(?:[^\n]|\n[ \t])*?charset=\"?([\w.:-]+)", re.I | re.M
+)
+
+
+def declared_charset(headers: bytes) -> Optional[str]:
+    """
+    the charset from the Content-Type header, if there is one
+    """
+    m = _CHARSET.search(headers)
+    return None if m is None else m.group(1).decode("ascii")
+
+
+def try_decode_buf(buf: bytes, charset: Optional[str] = None) -> str:
+    """
+    decodes the buffer as utf-8, then the declared charset (if given),
+    and if neither of those work, latin-1 (which can decode anything)
+    """
+    if buf.isascii():
+        return buf.decode("ascii")
     try:
         return buf.decode("utf-8")
     except UnicodeDecodeError:
+        pass
+    if charset is not None:
         try:
-            return buf.decode("iso-8859-1")
-        except UnicodeDecodeError:
-            return buf.decode("latin-1")
+            return buf.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return buf.decode("latin-1")
+
+
+def decode_headers(headers: bytes) -> str:
+    """
+    decodes raw headers with try_decode_buf. Some clients write non-ascii
+    headers in the charset of the message, so that's tried after utf-8
+    """
+    if headers.isascii():
+        return headers.decode("ascii")
+    return try_decode_buf(headers, declared_charset(headers))
+
+
+def message_string(buf: bytes) -> str:
+    """
+    converts a raw message to a str for the email module to parse, without
+    decoding the body. The headers are decoded with decode_headers, and the
+    body is kept as bytes, like email.message_from_bytes does (by decoding it
+    as ascii with surrogateescape), so each part is decoded using its own
+    charset, only if its accessed. Attachments are only copied, not decoded
+    """
+    end = _header_end(buf)
+    if end is None:
+        return decode_headers(buf)
+    return decode_headers(buf[:end]) + buf[end:].decode("ascii", "surrogateescape")
 
 
 def describe_person(p: Tuple[str, str]) -> str:
@@ -0,0 +1,190 @@
+"""
+Helpers to remove duplicate mail (e.g. the same message synced to multiple
+boxes, or both an mbox and an IMAP folder) without keeping a large key in
+memory for every message
+
+Each message is keyed on a 16-byte digest of its subject, message id and
+date. Once there are more than max_in_memory keys, they're moved to a
+temporary sqlite database, so memory stays flat for very large mailboxes
+
+HeaderPrecheck does the same with the raw Message-ID/Date/Subject headers,
+so copies of a message we've already seen can be skipped before parsing them
+"""
+
+import sqlite3
+import hashlib
+import tempfile
+from pathlib import Path
+from datetime import datetime
+from typing import Optional, Set, List
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+
+logger = make_logger(__name__)
+
+DIGEST_SIZE = 16
+
+# each key takes roughly 100 bytes in a set, so this is about 50MB
+MAX_IN_MEMORY = 500_000
+
+
+def _dt_key(dt: Optional[datetime]) -> str:
+    if dt is None:
+        return ""
+    # aware datetimes for the same time in different timezones are
+    # equal, so use the timestamp. naive datetimes never equal aware ones
+    if dt.tzinfo is not None:
+        return repr(dt.timestamp())
+    return "n" + dt.isoformat()
+
+
+def mail_key(subject: str, message_id: str, dt: Optional[datetime]) -> bytes:
+    """
+    a fixed-size key for a message, two messages have the same
+    key if their subject, message id and date are equal
+
+    whitespace in the subject is collapsed, so a folded Subject header
+    matches whether it was unfolded or not (or folded with CRLF or LF)
+    """
+    subject = " ".join(subject.split())
+    return hashlib.blake2b(
+        f"{subject}\0{message_id}\0{_dt_key(dt)}".encode("utf-8", "surrogatepass"),
+        digest_size=DIGEST_SIZE,
+    ).digest()
+
+
+def _tmp_dir() -> Optional[str]:
+    try:
+        from my.core.core_config import config
+
+        return str(config.get_tmp_dir())
+    except Exception:
+        return None
+
+
+class SeenKeys:
+    """
+    A set of keys, which moves them to a temporary sqlite
+    database once there are more than max_in_memory of them
+
+    If max_in_memory is None, this is just a set
+    """
+
+    def __init__(self, max_in_memory: Optional[int] = MAX_IN_MEMORY) -> None:
+        self.max_in_memory = max_in_memory
+        self._keys: Set[bytes] = set()
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None  # type: ignore[type-arg]
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def add(self, key: bytes) -> bool:
+        """
+        adds the key, returns False if it was already seen
+        """
+        if self._conn is not None:
+            cur = self._conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (key,))
+            return cur.rowcount == 1
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        if self.max_in_memory is not None and len(self._keys) > self.max_in_memory:
+            self._spill()
+        return True
+
+    def _spill(self) -> None:
+        self._tmp = tempfile.TemporaryDirectory(prefix="seen-mail-", dir=_tmp_dir())
+        path = Path(self._tmp.name) / "seen.sqlite"
+        logger.debug(f"Seen more than {self.max_in_memory} messages, moving to {path}")
+        self._conn = sqlite3.connect(str(path))
+        # its temporary, so we don't care if its lost
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute("CREATE TABLE seen (key BLOB PRIMARY KEY) WITHOUT ROWID")
+        self._conn.executemany(
+            "INSERT INTO seen VALUES (?)", ((k,) for k in self._keys)
+        )
+        self._keys = set()
+
+    def __len__(self) -> int:
+        if self._conn is not None:
+            return int(self._conn.execute("SELECT COUNT(*) FROM seen").fetchone()[0])
+        return len(self._keys)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._tmp is not None:
+            self._tmp.cleanup()
+            self._tmp = None
+        self._keys = set()
+
+
+# which index in the key each header goes in
+_KEY_HEADERS = {b"message-id": 0, b"date": 1, b"subject": 2}
+
+
+def header_key(headers: bytes) -> Optional[bytes]:
+    """
+    a digest of the raw Message-ID, Date and Subject headers (the first of
+    each), None if the message has none of them. headers can be the whole
+    message, this stops at the first blank line
+    """
+    # only split the headers, not every line of the body/attachments
+    end = headers.find(b"\n\n")
+    crlf = headers.find(b"\n\r\n", 0, len(headers) if end == -1 else end)
+    if crlf != -1:
+        end = crlf
+    if end != -1:
+        headers = headers[: end + 1]
+    values: List[Optional[bytes]] = [None, None, None]
+    current: Optional[int] = None
+    for line in headers.splitlines():
+        if not line.strip():
+            break
+        if line[:1] in (b" ", b"\t"):
+            # a folded header, continued from the previous line
+            if current is not None:
+                values[current] += b" " + line.strip()  # type: ignore[operator]
+            continue
+        current = None
+        name, sep, value = line.partition(b":")
+        if not sep:
+            continue
+        i = _KEY_HEADERS.get(name.strip().lower())
+        if i is not None and values[i] is None:
+            values[i] = value.strip()
+            current = i
+    if values == [None, None, None]:
+        return None
+    return hashlib.blake2b(
+        # prefix with '=', so a missing header is different from an empty one
+        b"\0".join(b"" if v is None else b"=" + v for v in values),
+        digest_size=DIGEST_SIZE,
+    ).digest()
+
+
+class HeaderPrecheck:
+    """
+    Remembers the header_key of each message, so we can skip parsing messages
+    with the same raw Message-ID/Date/Subject as one we've already seen
+
+    Parsing those would give the same subject, message id and date,
+    so unique_mail would just remove them afterwards anyways
+    """
+
+    def __init__(self, max_in_memory: Optional[int] = MAX_IN_MEMORY) -> None:
+        self._seen = SeenKeys(max_in_memory)
+        self.skipped = 0
+
+    def seen(self, key: Optional[bytes]) -> bool:
+        """
+        adds the key, returns True if it was already seen (so the message can be skipped)
+        """
+        if key is None or self._seen.add(key):
+            return False
+        self.skipped += 1
+        return True
+
+    def close(self) -> None:
+        logger.debug(f"Skipped parsing {self.skipped} duplicate messages")
+        self._seen.close()
@@ -10,6 +10,7 @@ REQUIRES = ["mail-parser", "dateparser"]
 from my.config import mail as user_config  # type: ignore[attr-defined]
 
 from pathlib import Path
+from functools import partial
 from typing import (
     Iterator,
     Callable,
@@ -19,7 +20,23 @@ from typing import (
 
 
 from my.core import Stats, Paths, dataclass, get_files, make_config
+from my.utils.parallel import get_pool, map_ordered
+from my.utils.file_cache import cache_file
+from my.utils.walk import DirSnapshot, walk
 from .common import Email, unique_mail
+from .stdlib_email import StdlibEmail, use_stdlib
+from .dedup import HeaderPrecheck
+from .index import (
+    AnyEmail,
+    indexed_mail,
+    file_header_key,
+    parse_encoded,
+    decode_email,
+    parser_key,
+    ParsedEmail,
+    MIN_PARALLEL,
+    CHUNKSIZE,
+)
 
 
 @dataclass
@@ -30,6 +47,32 @@ class imap_conf(user_config.imap):
     # filter function which filters the input paths
     filter_path: Optional[Callable[[Path], bool]] = None
 
+    # save parsed mail to an index in the cache directory, so only
+    # new/changed files are parsed on the next run. see my.mail.index
+    use_index: bool = True
+
+    # only parse the headers up front, the body/attachments are parsed
+    # if they're accessed. Since the index saves the body as well, this
+    # only makes a difference if use_index is False
+    header_only: bool = False
+
+    # what to parse mail with, 'mailparser' or 'stdlib'. stdlib only uses the
+    # email module, and computes each field when its accessed, see my.mail.stdlib_email
+    backend: str = "mailparser"
+
+    # include the attachment payloads (base64) when serializing mail (e.g. in
+    # hpi query). The index doesn't save those, so this parses messages with
+    # attachments again. Set to False to leave the payloads out, which is faster
+    attachment_payloads: bool = True
+
+    # number of processes to parse mail with. If None, uses the HPI_CPU_POOL
+    # process pool if that's set. 0 or 1 parses everything in this process
+    workers: Optional[int] = None
+
+    # save the listing of each directory in the cache directory, so directories
+    # which haven't changed (going by their mtime) aren't listed again
+    snapshot_dirs: bool = True
+
 
 config = make_config(imap_conf)
 
@@ -38,14 +81,30 @@ def mailboxes() -> List[Path]:
     return list(get_files(config.mailboxes))
 
 
+# directories which don't have mail in them, e.g. the notmuch database
+IGNORED_DIRS = {".notmuch", ".git", "courierimapkeywords"}
+
+
+def _snapshot_path() -> Optional[Path]:
+    return cache_file("my.mail.imap.dirs.json")
+
+
 def _files() -> Iterator[Path]:
+    # if caching is disabled, every directory is listed
+    snapshot_path = _snapshot_path() if config.snapshot_dirs else None
+    snapshot = DirSnapshot(snapshot_path) if snapshot_path is not None else None
     for box in mailboxes():
-        for path in box.rglob("*"):
-            if not path.is_file():
-                continue
-            if path.stem.startswith("."):
-                continue
-            yield path
+        for dirpath, dirs, filenames in walk(box, snapshot):
+            # tmp/ in a maildir has messages which are still being written.
+            # not all dot-directories, those are folders in Maildir++
+            ignored = IGNORED_DIRS | {"tmp"} if "cur" in dirs else IGNORED_DIRS
+            dirs[:] = [d for d in dirs if d not in ignored]
+            for name in filenames:
+                # e.g. .uidvalidity, .mbsyncstate
+                if not name.startswith("."):
+                    yield Path(dirpath, name)
+    if snapshot is not None:
+        snapshot.save()
 
 
 def files() -> Iterator[Path]:
@@ -56,13 +115,60 @@ def files() -> Iterator[Path]:
         yield from filter(config.filter_path, _files())
 
 
-def raw_mail() -> Iterator[Email]:
-    for m in map(Email.safe_parse_path, files()):
+def _index_path() -> Optional[Path]:
+    return cache_file("my.mail.imap.index.sqlite")
+
+
+def _parse(path: Path) -> Optional[ParsedEmail]:
+    if use_stdlib(config.backend):
+        return StdlibEmail.safe_parse_path(path)
+    return Email.safe_parse_path(path, header_only=config.header_only)
+
+
+def raw_mail(precheck: Optional[HeaderPrecheck] = None) -> Iterator[AnyEmail]:
+    """
+    if precheck is given, files with the same raw Message-ID/Date/Subject
+    headers as a message it's already seen aren't parsed
+    """
+    # if caching is disabled, this doesn't use the index
+    index_path = _index_path() if config.use_index else None
+    if index_path is not None:
+        yield from indexed_mail(
+            files(),
+            index_path,
+            parse=_parse,
+            workers=config.workers,
+            precheck=precheck,
+            parser=parser_key(config.backend, config.header_only),
+            attachment_payloads=config.attachment_payloads,
+        )
+        return
+    paths = list(files())
+    if precheck is not None:
+        paths = [p for p in paths if not precheck.seen(file_header_key(p))]
+    # parsing only the headers is cheap, so not worth sending everything to other processes
+    lazy = config.header_only or use_stdlib(config.backend)
+    if not lazy and len(paths) >= MIN_PARALLEL and get_pool(config.workers) is not None:
+        parsed = map_ordered(
+            partial(parse_encoded, _parse),
+            paths,
+            workers=config.workers,
+            chunksize=CHUNKSIZE,
+        )
+        for path, data in zip(paths, parsed):
+            if data is not None:
+                yield decode_email(
+                    data,
+                    load=partial(_parse, path),
+                    attachment_payloads=config.attachment_payloads,
+                )
+        return
+    for m in map(_parse, paths):
         if m is not None:
             yield m
 
 
-def mail() -> Iterator[Email]:
+def mail() -> Iterator[AnyEmail]:
     yield from unique_mail(raw_mail())
 
 
@@ -0,0 +1,533 @@
+"""
+An on-disk index of parsed mail, so files which haven't changed since
+the last run don't have to be parsed again
+
+Each file is keyed on its path, inode, mtime and size, and the index stores
+the fields from Email._serialize (without attachment payloads). Those are loaded
+back as IndexedEmail objects, which only parse the file if you access something
+else (e.g. subparts, or the attachments)
+
+Since the payloads aren't saved, serializing an IndexedEmail (e.g. in hpi query)
+parses messages with attachments again to include them. Pass
+attachment_payloads=False (the attachment_payloads option in my.mail.imap and
+my.mail.mbox) to leave them out instead, which is a lot faster
+
+The index is rebuilt if VERSION or how mail is parsed (see parser_key) changes
+
+The index also stores the header_key of each message, so if given a
+HeaderPrecheck (see my.mail.dedup), messages loaded from the index count
+as seen, and new copies of those aren't parsed
+"""
+
+import json
+import sqlite3
+from functools import partial
+from pathlib import Path
+from datetime import datetime
+from typing import (
+    Iterator,
+    Iterable,
+    Callable,
+    Optional,
+    Union,
+    Dict,
+    List,
+    Tuple,
+    Any,
+    TypeVar,
+    Collection,
+)
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+from my.utils import checkpoint
+from my.utils.parallel import map_ordered
+
+from .common import (
+    Email,
+    MessagePart,
+    describe_persons,
+    read_header_bytes,
+    message_from_path,
+)
+from .parse_parts import filter_message_subparts, TEXT_CONTENT_TYPES
+from .stdlib_email import StdlibEmail
+from .dedup import HeaderPrecheck, header_key
+from .mbox_index import Range, iter_headers
+
+logger = make_logger(__name__)
+
+T = TypeVar("T")
+
+# bump this if Email._serialize or how mail is parsed changes,
+# so everything gets parsed again
+VERSION = 6
+
+# commit every so often, so the work done isn't lost if this is interrupted
+COMMIT_EVERY = 1000
+
+# when parsing in parallel, each worker is sent this many files at a time
+CHUNKSIZE = 32
+
+# don't bother with a process pool for fewer files than this
+MIN_PARALLEL = 50
+
+# (inode, mtime_ns, size)
+FileKey = Tuple[int, int, int]
+
+
+def parser_key(backend: str, header_only: bool) -> str:
+    """
+    identifies the config mail was parsed with, so switching the
+    backend or header_only mode doesn't reuse what the other one saved
+    """
+    return f"{backend}:header_only={header_only}"
+
+
+def _file_key(path: Path) -> FileKey:
+    st = path.stat()
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _encode(fields: Dict[str, Any]) -> str:
+    datetimes = [k for k, v in fields.items() if isinstance(v, datetime)]
+
+    def _default(o: Any) -> Any:
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return str(o)
+
+    return json.dumps({"fields": fields, "datetimes": datetimes}, default=_default)
+
+
+def _decode(data: str) -> Dict[str, Any]:
+    d = json.loads(data)
+    fields: Dict[str, Any] = d["fields"]
+    for k in d["datetimes"]:
+        fields[k] = datetime.fromisoformat(fields[k])
+    if fields["filepath"] is not None:
+        fields["filepath"] = Path(fields["filepath"])
+    return fields
+
+
+# a message parsed by either backend, see my.mail.stdlib_email
+ParsedEmail = Union[Email, StdlibEmail]
+
+
+def _index_fields(m: ParsedEmail) -> Dict[str, Any]:
+    """
+    the fields from _serialize which the index saves. Attachment payloads (base64)
+    are most of the size of a message with attachments, so those are left out,
+    IndexedEmail.attachments parses the message again to get them
+    """
+    fields = m._serialize()
+    fields["attachments"] = [
+        {k: v for k, v in a.items() if k != "payload"} for a in fields["attachments"]
+    ]
+    return fields
+
+
+def parse_encoded(
+    parse: Callable[[T], Optional[ParsedEmail]], item: T
+) -> Optional[str]:
+    """
+    parses the mail and returns the encoded fields the index saves, which is a lot
+    smaller than the Email object. This is what worker processes send back when
+    parsing in parallel
+    """
+    m = parse(item)
+    return None if m is None else _encode(_index_fields(m))
+
+
+class IndexedEmail:
+    """
+    An email loaded from its serialized fields (from the index, or parsed in a worker
+    process). Has the same fields as Email._serialize as attributes (e.g. .subject,
+    .from_, .dt), and serializes the same way. If attachment_payloads is False,
+    the attachments are serialized without their payloads
+
+    Accessing anything else (e.g. .subparts, .message, .headers) parses the
+    file with the same parser that built it (or calls 'load', if given), and gets
+    it from that Email instead
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        load: Optional[Callable[[], Optional[ParsedEmail]]] = None,
+        mbox_range: Optional[Range] = None,
+        attachment_payloads: bool = True,
+    ) -> None:
+        self._fields = fields
+        self._load = load
+        self.mbox_range = mbox_range
+        self.attachment_payloads = attachment_payloads
+        self._email: Optional[ParsedEmail] = None
+        self._parsed = False
+        self.filepath: Optional[Path] = fields["filepath"]
+        self.dt: Optional[datetime] = fields["date"]
+        self.subject: str = fields["subject"]
+        self.message_id: str = fields["message_id"]
+        self.from_: List[Tuple[str, str]] = fields["from"]
+        self.to: List[Tuple[str, str]] = fields["to"]
+
+    @property
+    def subject_json(self) -> str:
+        return json.dumps(self.subject, ensure_ascii=False)
+
+    @property
+    def message_id_json(self) -> str:
+        return json.dumps(self.message_id, ensure_ascii=False)
+
+    @property
+    def description(self) -> str:
+        return f"""From: {describe_persons(self.from_)}
+To: {describe_persons(self.to)}
+Subject: {self.subject}"""
+
+    @property
+    def email(self) -> Optional[ParsedEmail]:
+        """
+        The fully parsed email, None if the file can't be parsed anymore
+        """
+        if not self._parsed:
+            self._parsed = True
+            if self._load is not None:
+                self._email = self._load()
+            elif self.filepath is not None:
+                self._email = Email.safe_parse_path(self.filepath)
+        return self._email
+
+    @property
+    def attachments(self) -> List[Dict[str, Any]]:
+        """
+        the attachments, with their payloads. The index doesn't save
+        the payloads, so this parses the message if it has any
+        """
+        if not self._fields["attachments"]:
+            return []
+        email = self.email
+        return [] if email is None else email.attachments
+
+    @property
+    def subparts(self) -> Iterator[MessagePart]:
+        if self.email is not None:
+            yield from self.email.subparts
+
+    def filtered_subparts(
+        self,
+        content_types: Optional[Collection[str]] = TEXT_CONTENT_TYPES,
+        decode: bool = True,
+    ) -> Iterator[MessagePart]:
+        """
+        only the parts with these content types, see filter_message_subparts
+
+        If this is from a maildir file, this only parses it with the stdlib email
+        module, instead of parsing the whole Email (and every attachment)
+        """
+        if self.mbox_range is not None or self.filepath is None or self._parsed:
+            if self.email is not None:
+                yield from self.email.filtered_subparts(content_types, decode)
+            return
+        try:
+            msg = message_from_path(self.filepath)
+        except OSError as e:
+            logger.debug(f"Could not read {self.filepath}: {e}")
+            return
+        for payload, content_type in filter_message_subparts(
+            msg, content_types, decode
+        ):
+            yield MessagePart(content_type=content_type, payload=payload, _email=self)
+
+    def _serialize(self) -> Dict[str, Any]:
+        if not self.attachment_payloads or not self._fields["attachments"]:
+            return self._fields
+        return {**self._fields, "attachments": self.attachments}
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if name in self._fields:
+            return self._fields[name]
+        email = self.email
+        if email is None:
+            raise AttributeError(
+                f"{name}: could not parse {self.filepath} to get this attribute"
+            )
+        return getattr(email, name)
+
+
+AnyEmail = Union[Email, StdlibEmail, IndexedEmail]
+
+
+def decode_email(
+    data: str,
+    load: Optional[Callable[[], Optional[ParsedEmail]]] = None,
+    mbox_range: Optional[Range] = None,
+    attachment_payloads: bool = True,
+) -> IndexedEmail:
+    return IndexedEmail(
+        _decode(data),
+        load=load,
+        mbox_range=mbox_range,
+        attachment_payloads=attachment_payloads,
+    )
+
+
+def _connect(index_path: Path, parser: str = "") -> sqlite3.Connection:
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(index_path))
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.execute("CREATE TABLE IF NOT EXISTS parser (key TEXT NOT NULL)")
+    row = conn.execute("SELECT key FROM parser").fetchone()
+    saved_parser = None if row is None else row[0]
+    if version != VERSION or saved_parser != parser:
+        logger.debug(
+            f"Index version/parser changed ({version}, {saved_parser}) -> ({VERSION}, {parser}), recreating"
+        )
+        for table in ("mail", "mbox", "mbox_checkpoint"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute("DELETE FROM parser")
+        conn.execute("INSERT INTO parser VALUES (?)", (parser,))
+        conn.execute(f"PRAGMA user_version = {VERSION}")
+    # fields is NULL for files which failed to parse, so we don't retry those either
+    conn.execute("""CREATE TABLE IF NOT EXISTS mail (
+            path TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            fields TEXT,
+            key BLOB
+        )""")
+    # messages from mbox files, keyed on the mbox and the offset the message starts at.
+    # skipped is set for messages which weren't parsed since they were a duplicate
+    conn.execute("""CREATE TABLE IF NOT EXISTS mbox (
+            path TEXT NOT NULL,
+            start INTEGER NOT NULL,
+            stop INTEGER NOT NULL,
+            fields TEXT,
+            key BLOB,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (path, start)
+        )""")
+    # how far into each mbox we've parsed, see my.utils.checkpoint
+    conn.execute("""CREATE TABLE IF NOT EXISTS mbox_checkpoint (
+            path TEXT PRIMARY KEY,
+            checkpoint TEXT NOT NULL
+        )""")
+    conn.commit()
+    return conn
+
+
+def file_header_key(path: Path) -> Optional[bytes]:
+    try:
+        return header_key(read_header_bytes(path))
+    except OSError as e:
+        logger.debug(f"Could not read headers from {path}: {e}")
+        return None
+
+
+def indexed_mail(
+    paths: Iterable[Path],
+    index_path: Path,
+    parse: Callable[[Path], Optional[ParsedEmail]] = Email.safe_parse_path,
+    workers: Optional[int] = None,
+    precheck: Optional[HeaderPrecheck] = None,
+    parser: str = "",
+    attachment_payloads: bool = True,
+) -> Iterator[AnyEmail]:
+    """
+    Parses any new/changed files and saves them to the index,
+    and loads everything else from the index
+
+    New/changed files are parsed in a process pool if there is one,
+    see my.utils.parallel. The output is in the same order as paths either way
+
+    If precheck is given, new/changed files with the same raw headers as a
+    message it's already seen are skipped (and not saved to the index)
+
+    Once all the paths have been processed, entries for files
+    which don't exist anymore are removed from the index
+
+    parser identifies how parse parses mail (see parser_key), if it
+    changed since the index was saved everything is parsed again
+    """
+    conn = _connect(index_path, parser)
+    decode = partial(decode_email, attachment_payloads=attachment_payloads)
+    try:
+        known: Dict[str, Tuple[FileKey, Optional[bytes]]] = {
+            path: ((inode, mtime_ns, size), hkey)
+            for path, inode, mtime_ns, size, hkey in conn.execute(
+                "SELECT path, inode, mtime_ns, size, key FROM mail"
+            )
+        }
+        # (path, key, header key, whether its already in the index) for each file
+        files: List[Tuple[Path, FileKey, Optional[bytes], bool]] = []
+        skipped: List[str] = []
+        for path in paths:
+            try:
+                key = _file_key(path)
+            except OSError as e:
+                logger.debug(f"Could not stat {path}, skipping: {e}")
+                continue
+            saved = known.get(str(path))
+            indexed = saved is not None and saved[0] == key
+            hkey = saved[1] if saved is not None and indexed else file_header_key(path)
+            if precheck is not None and precheck.seen(hkey) and not indexed:
+                skipped.append(str(path))
+                continue
+            files.append((path, key, hkey, indexed))
+        to_parse = [path for path, _, _, indexed in files if not indexed]
+        logger.debug(
+            f"Parsing {len(to_parse)} new/changed files, skipped {len(skipped)} duplicates"
+        )
+        parsed = map_ordered(
+            partial(parse_encoded, parse),
+            to_parse,
+            workers=workers,
+            min_items=MIN_PARALLEL,
+            chunksize=CHUNKSIZE,
+        )
+
+        pending = 0
+        for path, key, hkey, indexed in files:
+            spath = str(path)
+            if indexed:
+                row = conn.execute(
+                    "SELECT fields FROM mail WHERE path = ?", (spath,)
+                ).fetchone()
+                if row[0] is not None:
+                    yield decode(row[0], load=partial(parse, path))
+                continue
+            data = next(parsed)
+            conn.execute(
+                "INSERT OR REPLACE INTO mail VALUES (?, ?, ?, ?, ?, ?)",
+                (spath, *key, data, hkey),
+            )
+            pending += 1
+            if pending >= COMMIT_EVERY:
+                conn.commit()
+                pending = 0
+            if data is not None:
+                yield decode(data, load=partial(parse, path))
+        seen = {str(path) for path, _, _, _ in files}
+        seen.update(skipped)
+        removed = [(p,) for p in known if p not in seen]
+        conn.executemany("DELETE FROM mail WHERE path = ?", removed)
+        conn.commit()
+        logger.debug(f"Removed {len(removed)} files from {index_path}")
+    finally:
+        conn.commit()
+        conn.close()
+
+
+def _mbox_offset(conn: sqlite3.Connection, file: Path) -> int:
+    """
+    returns the offset we can keep the saved messages before, 0 if the file
+    was rewritten (e.g. compacted) since we parsed it, or we never have
+    """
+    row = conn.execute(
+        "SELECT checkpoint FROM mbox_checkpoint WHERE path = ?", (str(file),)
+    ).fetchone()
+    if row is None:
+        return 0
+    try:
+        cp = checkpoint.Checkpoint(**json.loads(row[0]))
+    except (ValueError, TypeError):
+        return 0
+    if not checkpoint.is_valid(cp, file):
+        logger.debug(f"{file} was rewritten since it was last parsed, parsing again")
+        return 0
+    return cp.offset
+
+
+def indexed_mbox(
+    file: Path,
+    index_path: Path,
+    ranges: List[Range],
+    parse: Callable[[Range], Optional[ParsedEmail]],
+    workers: Optional[int] = None,
+    precheck: Optional[HeaderPrecheck] = None,
+    parser: str = "",
+    attachment_payloads: bool = True,
+) -> Iterator[AnyEmail]:
+    """
+    Since mbox files are usually only appended to, this saves the parsed messages
+    and a checkpoint of how far into the file we parsed. If the file was only
+    appended to since then, this loads the messages before the checkpoint from
+    the index and only parses the rest. Otherwise, everything is parsed again
+
+    ranges are the (start, stop) offsets of each message in the
+    file, and parse parses the message for a range
+
+    If precheck is given, messages with the same raw headers as one it's
+    already seen are skipped. Those are saved as skipped, and are parsed
+    on a later run if the message they duplicated isn't seen first
+
+    parser and attachment_payloads are the same as for indexed_mail
+    """
+    spath = str(file)
+    conn = _connect(index_path, parser)
+    decode = partial(decode_email, attachment_payloads=attachment_payloads)
+    try:
+        offset = _mbox_offset(conn, file)
+        # the last message we parsed could've been appended to, so
+        # the checkpoint is at its start, and it gets parsed again
+        conn.execute("DELETE FROM mbox WHERE path = ? AND start >= ?", (spath, offset))
+        conn.commit()
+        updated: List[Tuple[Optional[str], str, int]] = []
+        for start, stop, data, hkey, skipped in conn.execute(
+            "SELECT start, stop, fields, key, skipped FROM mbox WHERE path = ? ORDER BY start",
+            (spath,),
+        ):
+            seen = precheck is not None and precheck.seen(hkey)
+            if skipped:
+                if seen:
+                    continue
+                # whatever this duplicated wasn't seen this time, so parse it now
+                data = parse_encoded(parse, (start, stop))
+                updated.append((data, spath, start))
+            if data is not None:
+                yield decode(
+                    data, load=partial(parse, (start, stop)), mbox_range=(start, stop)
+                )
+        conn.executemany(
+            "UPDATE mbox SET fields = ?, skipped = 0 WHERE path = ? AND start = ?",
+            updated,
+        )
+
+        new = [r for r in ranges if r[0] >= offset]
+        keys = [header_key(h) for h in iter_headers(file, new)]
+        skip = [precheck is not None and precheck.seen(k) for k in keys]
+        to_parse = [r for r, s in zip(new, skip) if not s]
+        logger.debug(
+            f"Parsing {len(to_parse)} new messages from {file}, skipped {len(new) - len(to_parse)} duplicates"
+        )
+        parsed = map_ordered(
+            partial(parse_encoded, parse),
+            to_parse,
+            workers=workers,
+            min_items=MIN_PARALLEL,
+            chunksize=CHUNKSIZE,
+        )
+        pending = 0
+        for r, hkey, skipped in zip(new, keys, skip):
+            data = None if skipped else next(parsed)
+            conn.execute(
+                "INSERT OR REPLACE INTO mbox VALUES (?, ?, ?, ?, ?, ?)",
+                (spath, *r, data, hkey, int(skipped)),
+            )
+            pending += 1
+            if pending >= COMMIT_EVERY:
+                conn.commit()
+                pending = 0
+            if data is not None:
+                yield decode(data, load=partial(parse, r), mbox_range=r)
+        if new:
+            cp = checkpoint.create(file, new[-1][0])
+            conn.execute(
+                "INSERT OR REPLACE INTO mbox_checkpoint VALUES (?, ?)",
+                (spath, json.dumps(cp._asdict())),
+            )
+    finally:
+        conn.commit()
+        conn.close()
@@ -9,13 +9,35 @@ from my.config import mail as user_config  # type: ignore[attr-defined]
 
 import mailbox
 from pathlib import Path
-from typing import List, Iterator, Optional, Sequence, IO, Any
+from functools import partial
+from typing import List, Iterator, Optional, Sequence
 
 from my.core import Stats, Paths, dataclass, get_files
 from my.core import make_logger
 
-from .common import Email, unique_mail, try_decode_buf
-
+from my.utils.file_cache import cache_file
+from my.utils.parallel import get_pool, map_ordered
+from my.utils.walk import walk
+from .common import Email, LazyEmail, unique_mail, message_string
+from .stdlib_email import StdlibEmail, use_stdlib
+from .dedup import HeaderPrecheck, header_key
+from .mbox_index import (
+    Range,
+    iter_messages,
+    iter_headers,
+    message_ranges,
+    read_message,
+)
+from .index import (
+    AnyEmail,
+    indexed_mbox,
+    parse_encoded,
+    decode_email,
+    parser_key,
+    ParsedEmail,
+    MIN_PARALLEL,
+    CHUNKSIZE,
+)
 
 logger = make_logger(__name__)
 
@@ -28,6 +50,28 @@ class config(user_config.mbox):
     # any additional extensions to ignore -- by default includes .msf, .dat, .log
     exclude_extensions: Optional[Sequence[str]] = None
 
+    # save parsed messages to an index in the cache directory. Since mbox files are
+    # usually only appended to, only new messages are parsed on the next run
+    use_index: bool = True
+
+    # only parse the headers up front, the body/attachments are parsed if they're
+    # accessed. Since the index saves the body as well, this only makes a difference
+    # if use_index is False
+    header_only: bool = False
+
+    # what to parse mail with, 'mailparser' or 'stdlib'. stdlib only uses the
+    # email module, and computes each field when its accessed, see my.mail.stdlib_email
+    backend: str = "mailparser"
+
+    # include the attachment payloads (base64) when serializing mail (e.g. in
+    # hpi query). The index doesn't save those, so this parses messages with
+    # attachments again. Set to False to leave the payloads out, which is faster
+    attachment_payloads: bool = True
+
+    # number of processes to parse messages with. If None, uses the HPI_CPU_POOL
+    # process pool if that's set. 0 or 1 parses everything in this process
+    workers: Optional[int] = None
+
 
 def mailboxes() -> List[Path]:
     return list(get_files(config.mailboxes))
@@ -47,55 +91,136 @@ def files() -> Iterator[Path]:
             excluded_ext.add(ext)
 
     for box in mailboxes():
-        for path in box.rglob("*"):
-            if path.stem.startswith("."):
-                continue
-            if path.is_file():
+        for dirpath, _, filenames in walk(box):
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                path = Path(dirpath, name)
                 if path.suffix not in excluded_ext:
                     yield path
 
 
-def _decode_msg(msg: IO[Any]) -> mailbox.mboxMessage:
+def _make_message(msg_str: str) -> mailbox.mboxMessage:
+    return mailbox.mboxMessage(mailbox.Message(msg_str))
+
+
+def _parse_message(buf: bytes, file: Path) -> Optional[ParsedEmail]:
     """
-    Custom decode function
+    parses a message (without the 'From ' line) the same
+    way iterating over a mailbox.mbox would
 
-    by default this uses 'ascii' which can cause fatal errors
-    on UnicodeDecodeErrors
+    this uses message_string instead of the default 'ascii',
+    which can cause fatal errors on UnicodeDecodeErrors
     """
-    msg_str = try_decode_buf(msg.read())
-    return mailbox.mboxMessage(mailbox.Message(msg_str))
+    email: Optional[ParsedEmail]
+    if use_stdlib(config.backend):
+        email = StdlibEmail.safe_parse(buf, display_filename=file)
+        if email is not None:
+            email.filepath = file
+        return email
+    msg_str = message_string(buf)
+    if config.header_only:
+        email = LazyEmail.parse_string_headers(
+            msg_str, display_filename=file, message_factory=_make_message
+        )
+    else:
+        email = Email.safe_parse(_make_message(msg_str), display_filename=file)
+    if email is not None:
+        email.filepath = file
+    return email
+
+
+def _parse_range(file: Path, r: Range) -> Optional[ParsedEmail]:
+    buf = read_message(file, r)
+    if buf is None:
+        logger.warning(f"{file} changed while parsing, couldn't read message at {r}")
+        return None
+    email = _parse_message(buf, file)
+    if email is not None:
+        email.mbox_range = r
+    return email
+
+
+def _iter_mailbox_parallel(file: Path, ranges: List[Range]) -> Iterator[AnyEmail]:
+    for r, data in zip(
+        ranges,
+        map_ordered(
+            partial(parse_encoded, partial(_parse_range, file)),
+            ranges,
+            workers=config.workers,
+            chunksize=CHUNKSIZE,
+        ),
+    ):
+        if data is not None:
+            yield decode_email(
+                data,
+                load=partial(_parse_range, file, r),
+                mbox_range=r,
+                attachment_payloads=config.attachment_payloads,
+            )
 
 
-def _iter_mailbox(file: Path) -> Iterator[Email]:
-    mbox = mailbox.mbox(
-        str(file),
-        factory=_decode_msg,
-        create=False,
-    )
-    mbox_itr = iter(mbox)
-    while True:
+def _index_path() -> Optional[Path]:
+    return cache_file("my.mail.mbox.index.sqlite")
+
+
+def _iter_mailbox(
+    file: Path, precheck: Optional[HeaderPrecheck] = None
+) -> Iterator[AnyEmail]:
+    # if caching is disabled, this doesn't use the index
+    index_path = _index_path() if config.use_index else None
+    if index_path is not None:
+        yield from indexed_mbox(
+            file,
+            index_path,
+            ranges=message_ranges(file),
+            parse=partial(_parse_range, file),
+            workers=config.workers,
+            precheck=precheck,
+            parser=parser_key(config.backend, config.header_only),
+            attachment_payloads=config.attachment_payloads,
+        )
+        return
+    # parsing only the headers is cheap, so not worth sending everything to other processes
+    lazy = config.header_only or use_stdlib(config.backend)
+    if not lazy and get_pool(config.workers) is not None:
+        ranges = message_ranges(file)
+        if len(ranges) >= MIN_PARALLEL:
+            if precheck is not None:
+                ranges = [
+                    r
+                    for r, h in zip(ranges, iter_headers(file, ranges))
+                    if not precheck.seen(header_key(h))
+                ]
+            yield from _iter_mailbox_parallel(file, ranges)
+            return
+    for r, buf in iter_messages(file):
+        if precheck is not None and precheck.seen(header_key(buf)):
+            continue
         try:
-            mbox_message = next(mbox_itr)
-            email = Email.safe_parse(mbox_message, display_filename=file)
-            if email is not None:
-                email.filepath = file
-                yield email
-        except StopIteration:
-            break
+            email = _parse_message(buf, file)
         except Exception as ex:
             logger.warning(
-                f"Unexpected error while parsing {file}: {ex}... no way to continue parsing mbox file...",
+                f"Unexpected error while parsing message at {r} in {file}: {ex}, skipping...",
                 exc_info=ex,
             )
+            continue
+        if email is not None:
+            email.mbox_range = r
+            yield email
 
 
-def raw_mail() -> Iterator[Email]:
+def raw_mail(precheck: Optional[HeaderPrecheck] = None) -> Iterator[AnyEmail]:
+    """
+    if precheck is given, messages with the same raw Message-ID/Date/Subject
+    headers as a message it's already seen aren't parsed
+    """
     for file in files():
         assert file.exists()  # sanity check -- make sure were not creating mboxes
-        yield from _iter_mailbox(file)
+        yield from _iter_mailbox(file, precheck)
 
 
-def mail() -> Iterator[Email]:
+def mail() -> Iterator[AnyEmail]:
     yield from unique_mail(raw_mail())
 
 
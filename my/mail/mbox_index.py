@@ -0,0 +1,168 @@
+"""
+An index of where each message in an mbox file starts, saved to the cache
+directory, so large mbox files don't have to be re-scanned each time
+
+If the mbox only grew since the index was saved (which is what mail clients
+usually do, until they compact the mailbox), only the new part is scanned
+"""
+
+import os
+import mmap
+from pathlib import Path
+from typing import List, Tuple, Iterator, Optional, Union, Sequence
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+
+from my.utils import checkpoint
+from my.utils.file_cache import file_cache_path
+
+logger = make_logger(__name__)
+
+# (start, stop) byte offsets of a message, start is where the 'From ' line starts
+Range = Tuple[int, int]
+
+Buffer = Union[bytes, mmap.mmap]
+
+_state_file = file_cache_path("my.mail.mbox.offsets")
+
+
+def scan_starts(buf: Buffer, start: int = 0) -> List[int]:
+    """
+    offsets of each line which starts with 'From ', from start onwards
+    """
+    starts: List[int] = []
+    if start == 0 and buf[:5] == b"From ":
+        starts.append(0)
+    pos = buf.find(b"\nFrom ", max(start - 1, 0))
+    while pos != -1:
+        starts.append(pos + 1)
+        pos = buf.find(b"\nFrom ", pos + 1)
+    return starts
+
+
+def _stop(buf: Buffer, end: int) -> int:
+    # like mailbox.mbox, the blank line before the next 'From ' line
+    # (or the end of the file) isn't part of the message
+    if end >= 2 and buf[end - 2 : end] == b"\n\n":
+        return end - 1
+    return end
+
+
+def ranges(buf: Buffer, starts: List[int]) -> List[Range]:
+    """
+    (start, stop) for each message, the same as the table
+    of contents mailbox.mbox creates
+    """
+    ends = starts[1:] + [len(buf)]
+    return [(s, _stop(buf, e)) for s, e in zip(starts, ends)]
+
+
+def message_bytes(buf: Buffer, r: Range) -> bytes:
+    """
+    the message, without the 'From ' line
+    """
+    start, stop = r
+    line_end = buf.find(b"\n", start, stop)
+    return b"" if line_end == -1 else buf[line_end + 1 : stop]
+
+
+def header_bytes(buf: Buffer, r: Range) -> bytes:
+    """
+    the headers of the message, up to the first blank line
+    """
+    start, stop = r
+    line_end = buf.find(b"\n", start, stop)
+    if line_end == -1:
+        return b""
+    end = buf.find(b"\n\n", line_end, stop)
+    end = stop if end == -1 else end + 1
+    # or, if the message has \r\n line endings
+    crlf = buf.find(b"\n\r\n", line_end, end)
+    if crlf != -1:
+        end = crlf + 1
+    return buf[line_end + 1 : end]
+
+
+def load_starts(path: Path, buf: Buffer) -> List[int]:
+    """
+    the start of each message in the mbox, using the saved index if its
+    still valid. If the file only grew, this only scans the new part
+    """
+    state_file = _state_file(path)
+    if state_file is None:
+        # caching is disabled, so there's nothing to load or save
+        logger.debug(f"Scanning {path} for messages")
+        return scan_starts(buf)
+    st = path.stat()
+    state = checkpoint.load(state_file)
+    starts: List[int] = []
+    if state is not None:
+        if state["size"] == st.st_size and state["mtime_ns"] == st.st_mtime_ns:
+            return list(state["starts"])
+        if checkpoint.is_valid(state["checkpoint"], path):
+            starts = state["starts"]
+    if starts:
+        # the last message could have been appended to as well, so start
+        # scanning from there. this only scans the part that was appended
+        logger.debug(f"{path} grew, scanning from {starts[-1]}")
+        starts = starts[:-1] + scan_starts(buf, starts[-1])
+    else:
+        logger.debug(f"Scanning {path} for messages")
+        starts = scan_starts(buf)
+    try:
+        checkpoint.save(
+            state_file,
+            checkpoint.create(path, len(buf)),
+            # the size we scanned, in case the file grew since it was mapped
+            size=len(buf),
+            mtime_ns=st.st_mtime_ns,
+            starts=starts,
+        )
+    except OSError as e:
+        logger.warning(f"Could not save mbox index to {state_file}: {e}")
+    return starts
+
+
+def iter_messages(path: Path) -> Iterator[Tuple[Range, bytes]]:
+    """
+    memory-maps the mbox, and yields the range and bytes of each message
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for r in ranges(buf, load_starts(path, buf)):
+            yield r, message_bytes(buf, r)
+
+
+def message_ranges(path: Path) -> List[Range]:
+    if os.path.getsize(path) == 0:
+        return []
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return ranges(buf, load_starts(path, buf))
+
+
+def read_message(path: Path, r: Range) -> Optional[bytes]:
+    """
+    reads a single message (without the 'From ' line), returns
+    None if the file is now too short (e.g. it was compacted)
+    """
+    start, stop = r
+    with path.open("rb") as f:
+        f.seek(start)
+        f.readline()  # the 'From ' line
+        pos = min(f.tell(), stop)
+        buf = f.read(stop - pos)
+    if len(buf) < stop - pos:
+        return None
+    return buf
+
+
+def iter_headers(path: Path, rs: Sequence[Range]) -> Iterator[bytes]:
+    """
+    the headers of each message, without reading the rest of them
+    """
+    if not rs:
+        return
+    with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for r in rs:
+            yield header_bytes(buf, r)
@@ -0,0 +1,154 @@
+"""
+Parses the Date header of mail which isn't in RFC 2822 format
+
+dateparser can parse almost anything, but takes milliseconds per call (most
+of that detecting the language), so this first tries regexes for the formats
+seen in real mail, and only uses dateparser if none of those match. Results
+are cached on the raw header, since the same broken header is often repeated
+by the same client/mailing list
+"""
+
+import re
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone, tzinfo
+from typing import Optional, List, Dict, Pattern, Match
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+# languages for dateparser to try, pinning these skips language detection.
+# Set to None to let dateparser detect the language instead
+DATEPARSER_LANGUAGES: Optional[List[str]] = ["en"]
+
+_MONTH_NAMES = (
+    "january february march april may june july "
+    "august september october november december"
+).split()
+# only the abbreviations and full names, so something like 'Marcha'
+# isn't read as March, and goes to dateparser instead
+_MONTHS = {
+    **{m: i for i, m in enumerate(_MONTH_NAMES, start=1)},
+    **{m[:3]: i for i, m in enumerate(_MONTH_NAMES, start=1)},
+    "sept": 9,
+}
+
+# offsets in hours, the RFC 822 zones and a few others seen in mail.
+# anything else (e.g. IST, which could be a few different timezones) goes to dateparser
+_ZONES: Dict[str, float] = {
+    "z": 0,
+    "ut": 0,
+    "utc": 0,
+    "gmt": 0,
+    "est": -5,
+    "edt": -4,
+    "cst": -6,
+    "cdt": -5,
+    "mst": -7,
+    "mdt": -6,
+    "pst": -8,
+    "pdt": -7,
+    "bst": 1,
+    "cet": 1,
+    "cest": 2,
+    "eet": 2,
+    "eest": 3,
+    "jst": 9,
+    "aest": 10,
+    "aedt": 11,
+}
+
+_TIME = r"(?P<H>\d{1,2})[:.](?P<M>\d\d)(?:[:.](?P<S>\d\d)(?:\.(?P<f>\d{1,6})\d*)?)?"
+_AMPM = r"(?:\s*(?P<p>[ap])\.?m\.?)?"
+_TZ = r"(?:\s*(?P<tz>[+-]\d\d:?\d\d|[a-z]{1,5}))?"
+
+_FORMATS: List[Pattern[str]] = [
+    re.compile(p, re.I)
+    for p in (
+        # 2023-08-01T08:00:00Z, 2023-08-01 08:00:00.123 +02:00
+        rf"(?P<Y>\d{{4}})-(?P<m>\d\d)-(?P<d>\d\d)[t ]{_TIME}{_TZ}",
+        # Tue, 1 Aug 2023 08.00.00 +0200, 1 August 2023 8:00 PM GMT
+        rf"(?:\w+\.?,?\s+)?(?P<d>\d{{1,2}})\s+(?P<b>[a-z]{{3,}})\.?,?\s+(?P<Y>\d{{2}}|\d{{4}}),?\s+(?:at\s+)?{_TIME}{_AMPM}{_TZ}",
+        # Tuesday, August 1, 2023 8:00 AM
+        rf"(?:\w+\.?,?\s+)?(?P<b>[a-z]{{3,}})\.?\s+(?P<d>\d{{1,2}})(?:st|nd|rd|th)?,?\s+(?P<Y>\d{{4}}),?\s+(?:at\s+)?{_TIME}{_AMPM}{_TZ}",
+        # asctime, Tue Aug  1 08:00:00 PDT 2023
+        rf"(?:\w+\s+)?(?P<b>[a-z]{{3,}})\s+(?P<d>\d{{1,2}})\s+{_TIME}{_TZ}\s+(?P<Y>\d{{4}})",
+        # 08/01/2023 08:00:00, month first like dateparser does for english
+        rf"(?P<m>\d{{1,2}})/(?P<d>\d{{1,2}})/(?P<Y>\d{{4}}),?\s+{_TIME}{_AMPM}{_TZ}",
+    )
+]
+
+# trailing comments, e.g. (UTC) or (Coordinated Universal Time)
+_COMMENT = re.compile(r"\s*\([^)]*\)\s*$")
+# GMT+0200 means +0200
+_PREFIXED_OFFSET = re.compile(r"\b(?:gmt|utc|ut)\s*(?=[+-]\d)", re.I)
+
+
+def _tz(s: Optional[str]) -> Optional[tzinfo]:
+    """
+    returns None for naive datetimes, raises KeyError if this doesn't know the timezone
+    """
+    if s is None:
+        return None
+    if s[0] in "+-":
+        digits = s[1:].replace(":", "")
+        offset = timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+        return timezone(-offset if s[0] == "-" else offset)
+    return timezone(timedelta(hours=_ZONES[s.lower()]))
+
+
+def _build(m: Match[str]) -> Optional[datetime]:
+    g = m.groupdict()
+    try:
+        if g.get("b") is not None:
+            month = _MONTHS[g["b"].lower()]
+        else:
+            month = int(g["m"])
+        year = int(g["Y"])
+        if year < 100:
+            # like RFC 2822 obsolete years
+            year += 2000 if year < 50 else 1900
+        hour = int(g["H"])
+        if g.get("p") is not None:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if g["p"].lower() == "p" else 0)
+        return datetime(
+            year,
+            month,
+            int(g["d"]),
+            hour,
+            int(g["M"]),
+            int(g["S"] or 0),
+            int((g["f"] or "0").ljust(6, "0")),
+            tzinfo=_tz(g["tz"]),
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _parse_formats(date: str) -> Optional[datetime]:
+    s = _PREFIXED_OFFSET.sub("", _COMMENT.sub("", date.strip()))
+    for fmt in _FORMATS:
+        m = fmt.fullmatch(s)
+        if m is not None:
+            dt = _build(m)
+            if dt is not None:
+                return dt
+    return None
+
+
+def _parse_dateparser(date: str) -> Optional[datetime]:
+    import dateparser
+
+    dt: Optional[datetime] = dateparser.parse(date, languages=DATEPARSER_LANGUAGES)
+    return dt
+
+
+@lru_cache(maxsize=4096)
+def parse_mail_date(date: str) -> Optional[datetime]:
+    """
+    Parses a Date header, returns None if it can't be parsed
+    """
+    dt = _parse_formats(date)
+    if dt is not None:
+        return dt
+    return _parse_dateparser(date)
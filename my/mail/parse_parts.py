@@ -2,7 +2,7 @@
 Some helper functions/constants for parsing message subparts/ignoring certain content types
 """
 
-from typing import Iterator, Tuple, Set, Union, Any, Literal
+from typing import Iterator, Tuple, Set, Union, Any, Literal, Optional, Collection
 from email.message import Message
 
 # explicitly ignored types, anything else sends a warning
@@ -32,6 +32,9 @@ IGNORED_CONTENT_PREFIXES: Set[str] = {
     "video",
 }
 
+# the parts filter_message_subparts returns by default
+TEXT_CONTENT_TYPES = frozenset({"text/plain", "text/html"})
+
 
 def get_message_parts(m: Message) -> Iterator[Message]:
     # since walk returns both multiparts and their children
@@ -49,26 +52,68 @@ EmailText = Literal["html", "text"]
 EmailTextOrContentType = Union[EmailText, str]
 
 
+def is_ignored(content_type: str) -> bool:
+    return content_type in IGNORED_CONTENT_TYPES or content_type.startswith(
+        tuple(IGNORED_CONTENT_PREFIXES)
+    )
+
+
+def tag_content_type(content_type: str) -> EmailTextOrContentType:
+    if content_type.startswith("text") and "html" in content_type:
+        return "html"
+    elif content_type == "text/plain":
+        return "text"
+    else:
+        # ignored, or unknown content types
+        return content_type
+
+
 def tag_message_subparts(
     msg: Message,
 ) -> Iterator[Tuple[Any, EmailTextOrContentType]]:
     for message_part in get_message_parts(msg):
         content_type = message_part.get_content_type()
-        payload = message_part.get_payload()
+        yield message_part.get_payload(), tag_content_type(content_type)
+
 
-        # known ignored content types
-        if content_type in IGNORED_CONTENT_TYPES:
-            yield payload, content_type
+def decode_payload(part: Message) -> Union[str, bytes]:
+    """
+    the payload without the transfer encoding (base64/quoted-printable), text
+    parts are decoded using their charset, anything else is returned as bytes
+    """
+    raw = part.get_payload(decode=True)
+    if not isinstance(raw, bytes):
+        return b""
+    if part.get_content_maintype() != "text":
+        return raw
+    try:
+        return raw.decode(part.get_content_charset() or "utf-8", "replace")
+    except LookupError:
+        return raw.decode("latin-1")
 
-        if any(
-            [content_type.startswith(prefix) for prefix in IGNORED_CONTENT_PREFIXES]
+
+def filter_message_subparts(
+    msg: Message,
+    content_types: Optional[Collection[str]] = TEXT_CONTENT_TYPES,
+    decode: bool = True,
+) -> Iterator[Tuple[Any, EmailTextOrContentType]]:
+    """
+    Like tag_message_subparts, but only for parts whose content type (e.g. 'text/plain')
+    or main type (e.g. 'image') is in content_types. If content_types is None, returns
+    every part which isn't ignored (see IGNORED_CONTENT_TYPES/IGNORED_CONTENT_PREFIXES)
+
+    The payloads of any other parts aren't accessed at all. If decode is True,
+    payloads are decoded with decode_payload, instead of the raw payload
+    """
+    for message_part in get_message_parts(msg):
+        content_type = message_part.get_content_type()
+        if content_types is None:
+            if is_ignored(content_type):
+                continue
+        elif (
+            content_type not in content_types
+            and message_part.get_content_maintype() not in content_types
         ):
-            yield payload, content_type
-
-        if content_type.startswith("text") and "html" in content_type:
-            yield payload, "html"
-        elif content_type == "text/plain":
-            yield payload, "text"
-        else:
-            # unknown ignored content types
-            yield payload, content_type
+            continue
+        payload = decode_payload(message_part) if decode else message_part.get_payload()
+        yield payload, tag_content_type(content_type)
@@ -0,0 +1,192 @@
+"""
+A full-text search index (sqlite FTS5) over the subject, from/to and
+body of your mail, so finding a message doesn't mean parsing everything again
+
+update_index only adds messages which aren't in the index already, and
+search only parses the messages which match:
+
+from my.mail.search import update_index, search
+update_index()
+for m in search('subject:invoice AND "order number"'):
+    print(m.filepath, m.subject)
+
+The columns are subject, sender, recipients and body. See
+https://www.sqlite.org/fts5.html#full_text_query_syntax for the query syntax
+"""
+
+REQUIRES = ["mail-parser", "dateparser"]
+
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Set, Tuple
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+
+from my.utils.file_cache import cache_file
+from .common import describe_persons
+from .dedup import mail_key
+from .index import AnyEmail, ParsedEmail
+from .mbox_index import Range
+
+logger = make_logger(__name__)
+
+# commit every so often, so the work done isn't lost if this is interrupted
+COMMIT_EVERY = 1000
+
+
+def _index_path() -> Path:
+    index_path = cache_file("my.mail.search.sqlite")
+    if index_path is None:
+        raise ValueError("Caching is disabled, pass index_path to use the search index")
+    return index_path
+
+
+def _connect(index_path: Path) -> sqlite3.Connection:
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(index_path))
+    # where each message is, the rowid of the message in the fts table is the id
+    conn.execute("""CREATE TABLE IF NOT EXISTS docs (
+            id INTEGER PRIMARY KEY,
+            key BLOB NOT NULL UNIQUE,
+            path TEXT NOT NULL,
+            start INTEGER,
+            stop INTEGER
+        )""")
+    try:
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS mail_fts USING fts5(
+                subject, sender, recipients, body, tokenize = 'unicode61 remove_diacritics 2'
+            )""")
+    except sqlite3.OperationalError as e:
+        conn.close()
+        raise RuntimeError(
+            f"Could not create the search index, your sqlite may not support FTS5: {e}"
+        ) from e
+    conn.commit()
+    return conn
+
+
+def _location(m: AnyEmail) -> Tuple[str, Optional[int], Optional[int]]:
+    start, stop = m.mbox_range if m.mbox_range is not None else (None, None)
+    return str(m.filepath), start, stop
+
+
+def update_index(
+    emails: Optional[Iterable[AnyEmail]] = None,
+    index_path: Optional[Path] = None,
+    remove_missing: bool = True,
+) -> int:
+    """
+    Adds any messages which aren't in the index yet, returns how many were added
+
+    emails defaults to my.mail.all.mail(). Messages are keyed the same way unique_mail
+    removes duplicates, so for messages which are already in the index this only
+    updates where they are (e.g. if a maildir file was renamed)
+
+    If remove_missing is True, messages which weren't in emails are removed
+    """
+    if emails is None:
+        from .all import mail
+
+        emails = mail()
+    conn = _connect(index_path or _index_path())
+    seen: Set[int] = set()
+    added = 0
+    try:
+        known = {
+            key: (id_, (path, start, stop))
+            for id_, key, path, start, stop in conn.execute(
+                "SELECT id, key, path, start, stop FROM docs"
+            )
+        }
+        pending = 0
+        for m in emails:
+            if m.filepath is None:
+                continue
+            key = mail_key(m.subject, m.message_id, m.dt)
+            location = _location(m)
+            if key in known:
+                id_, saved = known[key]
+                seen.add(id_)
+                if saved != location:
+                    conn.execute(
+                        "UPDATE docs SET path = ?, start = ?, stop = ? WHERE id = ?",
+                        (*location, id_),
+                    )
+                continue
+            cur = conn.execute(
+                "INSERT INTO docs (key, path, start, stop) VALUES (?, ?, ?, ?)",
+                (key, *location),
+            )
+            id_ = cur.lastrowid
+            assert id_ is not None
+            conn.execute(
+                "INSERT INTO mail_fts (rowid, subject, sender, recipients, body) VALUES (?, ?, ?, ?, ?)",
+                (
+                    id_,
+                    m.subject,
+                    describe_persons(m.from_),
+                    describe_persons(m.to),
+                    # body_plain isn't a mailparser property, so that looks
+                    # up a 'Body-Plain' header. body has all the text parts
+                    m.body,
+                ),
+            )
+            known[key] = (id_, location)
+            seen.add(id_)
+            added += 1
+            pending += 1
+            if pending >= COMMIT_EVERY:
+                conn.commit()
+                pending = 0
+        if remove_missing:
+            removed = [(id_,) for id_, _ in known.values() if id_ not in seen]
+            conn.executemany("DELETE FROM docs WHERE id = ?", removed)
+            conn.executemany("DELETE FROM mail_fts WHERE rowid = ?", removed)
+            logger.debug(f"Removed {len(removed)} messages from the search index")
+        logger.debug(f"Added {added} messages to the search index")
+    finally:
+        conn.commit()
+        conn.close()
+    return added
+
+
+def _load(path: Path, r: Optional[Range]) -> Optional[ParsedEmail]:
+    # parse with the backend configured for the source, like when it was indexed
+    if r is None:
+        from .imap import _parse
+
+        return _parse(path)
+    from .mbox import _parse_range
+
+    return _parse_range(path, r)
+
+
+def search(
+    query: str, limit: Optional[int] = None, index_path: Optional[Path] = None
+) -> Iterator[ParsedEmail]:
+    """
+    Parses and returns the messages which match the FTS5 query, best matches first
+
+    Run update_index first, messages which were removed (or changed)
+    since the index was last updated are skipped
+    """
+    conn = _connect(index_path or _index_path())
+    try:
+        rows = conn.execute(
+            """SELECT docs.key, docs.path, docs.start, docs.stop FROM mail_fts
+            JOIN docs ON docs.id = mail_fts.rowid
+            WHERE mail_fts MATCH ? ORDER BY rank LIMIT ?""",
+            (query, -1 if limit is None else limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    for key, path, start, stop in rows:
+        r = None if start is None else (start, stop)
+        try:
+            m = _load(Path(path), r)
+        except OSError as e:
+            logger.debug(f"Could not read {path}, skipping: {e}")
+            continue
+        # e.g. if the mbox was compacted, this could be another message now
+        if m is not None and mail_key(m.subject, m.message_id, m.dt) == key:
+            yield m
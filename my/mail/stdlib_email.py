@@ -0,0 +1,535 @@
+"""
+An Email backend which only uses the stdlib email module (email.parser.BytesParser)
+
+mailparser computes everything up front when it parses a message: it walks
+every part to collect defects, decodes every text part, re-encodes attachments
+to base64 and parses the Received headers. StdlibEmail keeps the raw message,
+only parses the headers the first time one is accessed, the whole message the
+first time the body/parts are, and computes each field when it's accessed
+
+It has the fields from Email._serialize, and description, dt, subparts and
+filtered_subparts, so it can be used anywhere an Email is. To use it, set
+backend = 'stdlib' in the imap/mbox config, see doc/MAIL_SETUP.md
+
+The values are meant to match mailparser for well-formed mail, but the
+Received headers are parsed more simply, and attachments/body parts are
+told apart by their Content-Disposition/filename, without mailparser's
+handling of defects (e.g. recovering parts from a broken epilogue)
+"""
+
+REQUIRES = ["mail-parser", "dateparser"]
+
+import re
+import json
+import base64
+from pathlib import Path
+from email.message import Message
+from email.parser import BytesParser
+from email.policy import compat32
+from email.header import decode_header
+from email.errors import HeaderParseError
+from email.utils import getaddresses, parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Union, Dict, List, Tuple, Any, Collection
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+
+from .common import (
+    MessagePart,
+    describe_persons,
+    declared_charset,
+    try_decode_buf,
+    _header_end,
+)
+from .parse_date import parse_mail_date
+from .parse_parts import (
+    tag_message_subparts,
+    filter_message_subparts,
+    get_message_parts,
+    TEXT_CONTENT_TYPES,
+)
+
+logger = make_logger(__name__)
+
+# the values for the 'backend' option in my.mail.imap/my.mail.mbox
+BACKENDS = ("mailparser", "stdlib")
+
+# headers mailparser returns as a list of (name, address) tuples
+ADDRESS_HEADERS = {"bcc", "cc", "delivered-to", "from", "reply-to", "to"}
+
+_FOLDING = re.compile(r"\r?\n(?=[ \t])")
+_COMMENTS = re.compile(r"\([^()]*\)")
+_AMPM = re.compile(r"\d\s*[ap]\.?m\b", re.I)
+_RECEIVED_CLAUSE = re.compile(r"(?:^|\s)(from|by|via|with|id|for)\s", re.I)
+
+
+def use_stdlib(backend: str) -> bool:
+    """
+    validates the backend option, True if its 'stdlib'
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown mail backend {backend!r}, expected one of {BACKENDS}"
+        )
+    return backend == "stdlib"
+
+
+def _parser() -> BytesParser:
+    # compat32 is what email.message_from_bytes (and mailparser) use, the
+    # newer policies parse every header into an object when its accessed
+    return BytesParser(policy=compat32)
+
+
+def decode_header_value(
+    value: str, charset: Optional[str] = None, unfold: bool = True
+) -> str:
+    """
+    decodes a raw header value. Raw 8-bit values are decoded with try_decode_buf,
+    and RFC 2047 encoded words (=?utf-8?q?...?=) after that, the same way mailparser does
+
+    Like mailparser, header values aren't unfolded unless unfold is True, so
+    a folded Subject keeps its newline (unless its made of encoded words)
+    """
+    if not value.isascii():
+        value = try_decode_buf(value.encode("ascii", "surrogateescape"), charset)
+    if unfold:
+        value = _FOLDING.sub("", value)
+    if "=?" in value:
+        try:
+            value = "".join(
+                part.decode(c or "utf-8", "ignore") if isinstance(part, bytes) else part
+                for part, c in decode_header(value)
+            )
+        except (HeaderParseError, LookupError, UnicodeError):
+            pass
+    return value.strip()
+
+
+def _parse_received(value: str) -> Dict[str, Any]:
+    """
+    splits a Received header into its from/by/with/id/for/via clauses and its date
+    """
+    clauses, _, date = value.rpartition(";")
+    if not clauses:
+        clauses, date = date, ""
+    # so keywords in comments, e.g. '(using TLS with cipher ...)' aren't matched
+    masked = clauses
+    while True:
+        replaced = _COMMENTS.sub(lambda m: " " * len(m.group(0)), masked)
+        if replaced == masked:
+            break
+        masked = replaced
+    matches = list(_RECEIVED_CLAUSE.finditer(masked))
+    hop: Dict[str, Any] = {}
+    date = date.strip()
+    if date:
+        hop["date"] = date
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(clauses)
+        key = m.group(1).lower()
+        if key not in hop:
+            hop[key] = " ".join(clauses[m.end() : end].split())
+    return hop
+
+
+class StdlibEmail:
+    """
+    A message parsed with the stdlib email module, see the module docstring
+
+    Like mailparser, any other attribute is looked up as a header, with
+    underscores replaced by dashes (e.g. .x_mailer is the X-Mailer header),
+    and is an empty string if the message doesn't have that header
+    """
+
+    def __init__(self, buf: bytes) -> None:
+        # the raw message, dropped once its been parsed
+        self._buf: Optional[bytes] = buf
+        self._headers_msg: Optional[Message] = None
+        self._message: Optional[Message] = None
+        self._charset: Optional[str] = None
+        self._fields: Dict[str, Any] = {}
+        self.filepath: Optional[Path] = None
+        # (start, stop) offsets of the message, if its from an mbox file
+        self.mbox_range: Optional[Tuple[int, int]] = None
+
+    @classmethod
+    def safe_parse(cls, buf: bytes, display_filename: Path) -> Optional["StdlibEmail"]:
+        """
+        Nothing is parsed here, so this only fails if the headers can't be parsed
+        """
+        m = cls(buf)
+        try:
+            m._header_message()
+        except Exception as e:
+            logger.warning(
+                f"Unknown error while parsing {display_filename}: {e}, skipping...",
+                exc_info=e,
+            )
+            return None
+        return m
+
+    @classmethod
+    def safe_parse_path(cls, path: Path) -> Optional["StdlibEmail"]:
+        with path.open("rb") as bf:
+            m = cls.safe_parse(bf.read(), display_filename=path)
+        if m is None:
+            return None
+        m.filepath = path
+        return m
+
+    def _header_message(self) -> Message:
+        if self._message is not None:
+            return self._message
+        if self._headers_msg is None:
+            assert self._buf is not None
+            end = _header_end(self._buf)
+            headers = self._buf if end is None else self._buf[:end]
+            self._charset = declared_charset(headers)
+            self._headers_msg = _parser().parsebytes(headers, headersonly=True)
+        return self._headers_msg
+
+    @property
+    def message(self) -> Message:
+        """
+        the whole message, parsed with email.parser.BytesParser
+        """
+        if self._message is None:
+            self._header_message()
+            assert self._buf is not None
+            self._message = _parser().parsebytes(self._buf)
+            self._buf = None
+            self._headers_msg = None
+        return self._message
+
+    def _cached(self, name: str, compute: Any) -> Any:
+        try:
+            return self._fields[name]
+        except KeyError:
+            value = self._fields[name] = compute()
+            return value
+
+    def _raw_headers(self, name: str) -> List[str]:
+        return [
+            v if isinstance(v, str) else str(v)
+            for k, v in self._header_message().raw_items()
+            if k.lower() == name
+        ]
+
+    def _addresses(self, name: str) -> List[Tuple[str, str]]:
+        # decode the raw bytes but not the encoded words yet, since
+        # those could decode to commas, e.g. =?utf-8?q?Doe=2C_John?=
+        values = []
+        for v in self._raw_headers(name):
+            if not v.isascii():
+                v = try_decode_buf(v.encode("ascii", "surrogateescape"), self._charset)
+            values.append(_FOLDING.sub("", v))
+        addresses = []
+        for display, addr in getaddresses(values):
+            if not addr:
+                continue
+            display = decode_header_value(display)
+            addresses.append(("" if display == addr else display, addr))
+        return addresses
+
+    def header(self, name: str) -> Any:
+        """
+        like mailparser, address headers are a list of (name, address) tuples, other
+        headers are the decoded value (a list if its repeated), or '' if its missing
+        """
+        name = name.lower()
+
+        def _compute() -> Any:
+            if name in ADDRESS_HEADERS:
+                return self._addresses(name)
+            self._header_message()
+            values = [
+                decode_header_value(v, self._charset, unfold=False)
+                for v in self._raw_headers(name)
+            ]
+            if not values:
+                return ""
+            return values[0] if len(values) == 1 else values
+
+        return self._cached(f"header:{name}", _compute)
+
+    def _first(self, name: str) -> str:
+        value = self.header(name)
+        return str(value[0] if isinstance(value, list) else value)
+
+    @property
+    def headers(self) -> Dict[str, Any]:
+        names: Dict[str, str] = {}
+        for k in self._header_message().keys():
+            names.setdefault(k.lower(), k)
+        return {k: self.header(lower) for lower, k in names.items()}
+
+    @property
+    def subject(self) -> str:
+        return self._first("subject")
+
+    @property
+    def message_id(self) -> str:
+        return self._first("message-id")
+
+    @property
+    def from_(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("from")
+
+    @property
+    def to(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("to")
+
+    @property
+    def cc(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("cc")
+
+    @property
+    def bcc(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("bcc")
+
+    @property
+    def reply_to(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("reply-to")
+
+    @property
+    def delivered_to(self) -> List[Tuple[str, str]]:
+        return self._addresses_header("delivered-to")
+
+    def _addresses_header(self, name: str) -> List[Tuple[str, str]]:
+        value: List[Tuple[str, str]] = self.header(name)
+        return value
+
+    @property
+    def to_domains(self) -> List[str]:
+        domains: List[str] = []
+        for _, addr in self.to + self.reply_to:
+            domain = addr.rpartition("@")[2].strip().lower()
+            if domain and domain not in domains:
+                domains.append(domain)
+        return domains
+
+    @property
+    def date(self) -> Optional[datetime]:
+        """
+        the Date header in UTC, None if its not in RFC 2822 format
+        """
+
+        def _compute() -> Optional[datetime]:
+            date = self._first("date")
+            if not date:
+                return None
+            # parsedate ignores AM/PM, leave those to parse_mail_date
+            if _AMPM.search(date):
+                return None
+            try:
+                d = parsedate_to_datetime(date)
+            except (TypeError, ValueError, IndexError):
+                return None
+            # no timezone (or -0000), like mailparser dt falls back to parse_mail_date
+            if d.tzinfo is None:
+                return None
+            return d.astimezone(timezone.utc)
+
+        value: Optional[datetime] = self._cached("date", _compute)
+        return value
+
+    @property
+    def dt(self) -> Optional[datetime]:
+        """
+        Try to parse datetime if mail date wasn't in RFC 2822 format
+        """
+        d = self.date
+        if d is not None:
+            return d
+        date = self._first("date")
+        return parse_mail_date(date) if date else None
+
+    @property
+    def received(self) -> List[Dict[str, Any]]:
+        """
+        The parsed Received headers, the first hop first. date_utc and delay
+        (seconds since the previous hop) are set if the date could be parsed
+        """
+
+        def _compute() -> List[Dict[str, Any]]:
+            hops = []
+            last: Optional[datetime] = None
+            for i, raw in enumerate(reversed(self._raw_headers("received")), start=1):
+                hop = _parse_received(decode_header_value(raw))
+                hop["hop"] = i
+                try:
+                    d = parsedate_to_datetime(hop["date"]).astimezone(timezone.utc)
+                except (KeyError, TypeError, ValueError, IndexError):
+                    pass
+                else:
+                    hop["date_utc"] = d.isoformat()
+                    hop["delay"] = 0 if last is None else (d - last).total_seconds()
+                    last = d
+                hops.append(hop)
+            return hops
+
+        value: List[Dict[str, Any]] = self._cached("received", _compute)
+        return value
+
+    def _parts(self) -> Dict[str, List[Any]]:
+        """
+        sorts the parts into the text/html/other parts of the body, and attachments
+        """
+
+        def _compute() -> Dict[str, List[Any]]:
+            parts: Dict[str, List[Any]] = {
+                "plain": [],
+                "html": [],
+                "not_managed": [],
+                "attachments": [],
+            }
+            for part in get_message_parts(self.message):
+                filename = part.get_filename()
+                subtype = part.get_content_subtype()
+                # like mailparser, parts with a content id (e.g. inline images) are attachments
+                if (
+                    filename is not None
+                    or part.get_content_disposition() == "attachment"
+                    or (part.get("content-id") and subtype not in ("plain", "html"))
+                ):
+                    parts["attachments"].append(_attachment(part, filename))
+                    continue
+                payload = _body_text(part)
+                if not payload:
+                    continue
+                parts[
+                    subtype if subtype in ("plain", "html") else "not_managed"
+                ].append(payload)
+            return parts
+
+        value: Dict[str, List[Any]] = self._cached("parts", _compute)
+        return value
+
+    @property
+    def text_plain(self) -> List[str]:
+        return self._parts()["plain"]
+
+    @property
+    def text_html(self) -> List[str]:
+        return self._parts()["html"]
+
+    @property
+    def text_not_managed(self) -> List[str]:
+        return self._parts()["not_managed"]
+
+    @property
+    def body(self) -> str:
+        return "\n--- mail_boundary ---\n".join(
+            self.text_plain + self.text_html + self.text_not_managed
+        )
+
+    @property
+    def attachments(self) -> List[Dict[str, Any]]:
+        return self._parts()["attachments"]
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        name = name.rstrip("_").lower()
+        if name.endswith("_json"):
+            return json.dumps(getattr(self, name[:-5]), ensure_ascii=False)
+        return self.header(name.replace("_", "-"))
+
+    def _serialize(self) -> Dict[str, Any]:
+        return {
+            "filepath": self.filepath,
+            "bcc": self.bcc,
+            "cc": self.cc,
+            "date": self.dt,
+            "date_utc": self.date_utc,
+            "delivered_to": self.delivered_to,
+            "from": self.from_,
+            "message_id": self.message_id,
+            "received": self.received,
+            "reply_to": self.reply_to,
+            "subject": self.subject,
+            "to": self.to,
+            "by": self.by,
+            "envelope_from": self.envelope_from,
+            "envelope_sender": self.envelope_sender,
+            "for": getattr(self, "for"),
+            "hop": self.hop,
+            "with": getattr(self, "with"),
+            "body": self.body,
+            "body_html": self.body_html,
+            "body_plain": self.body_plain,
+            "attachments": self.attachments,
+            "sender_ip_address": self.sender_ip_address,
+            "to_domains": self.to_domains,
+        }
+
+    @property
+    def description(self) -> str:
+        return f"""From: {describe_persons(self.from_)}
+To: {describe_persons(self.to)}
+Subject: {self.subject}"""
+
+    @property
+    def subparts(self) -> Iterator[MessagePart]:
+        for payload, content_type in tag_message_subparts(self.message):
+            yield MessagePart(
+                content_type=content_type,
+                payload=payload,
+                _email=self,
+            )
+
+    def filtered_subparts(
+        self,
+        content_types: Optional[Collection[str]] = TEXT_CONTENT_TYPES,
+        decode: bool = True,
+    ) -> Iterator[MessagePart]:
+        """
+        only the parts with these content types, see filter_message_subparts
+        """
+        for payload, content_type in filter_message_subparts(
+            self.message, content_types, decode
+        ):
+            yield MessagePart(
+                content_type=content_type,
+                payload=payload,
+                _email=self,
+            )
+
+
+def _body_text(part: Message) -> str:
+    """
+    decodes the part with its charset, or utf-8 if that fails, like mailparser
+    """
+    payload = part.get_payload(decode=True)
+    if not isinstance(payload, bytes) or not payload:
+        return ""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8")
+    except (LookupError, UnicodeError):
+        return payload.decode("utf-8", "replace")
+
+
+def _attachment(part: Message, filename: Optional[str]) -> Dict[str, Any]:
+    """
+    the same fields as mailparser, binary payloads are base64 encoded
+    """
+    if filename is not None:
+        filename = decode_header_value(filename)
+    cte = str(part.get("content-transfer-encoding", "")).strip().lower()
+    payload: Union[str, bytes]
+    if cte == "base64":
+        payload = "".join(str(part.get_payload()).split())
+    else:
+        raw = part.get_payload(decode=True)
+        payload = base64.b64encode(raw if isinstance(raw, bytes) else b"").decode()
+    return {
+        "filename": filename,
+        "safe_filename": Path(filename).name or None if filename else None,
+        "payload": payload,
+        "binary": True,
+        "mail_content_type": part.get_content_type(),
+        "content-id": str(part.get("content-id", "")),
+        "content-disposition": str(part.get("content-disposition", "")),
+        "charset": part.get_content_charset(),
+        "content_transfer_encoding": "base64",
+    }
@@ -34,6 +34,7 @@ from more_itertools import unique_everseen
 
 from my.core import get_files, Stats
 from my.utils.input_source import InputSource
+from my.utils.parallel import parse_files
 
 
 class Solution(NamedTuple):
@@ -49,7 +50,7 @@ def history(from_paths: InputSource = project_euler_inputs) -> Iterator[Solution
     # hmm: maybe someone has multiple accounts and wants to keep track of multiple accounts?
     # If so feel free to make an issue, just doesn't seem like a common use case
     yield from unique_everseen(
-        chain(*map(_parse_file, from_paths())), key=lambda s: s.problem
+        chain(*parse_files(_parse_file, from_paths())), key=lambda s: s.problem
     )
 
 
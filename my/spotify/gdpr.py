@@ -20,6 +20,7 @@ from pathlib import Path
 from typing import Iterator, Any, NamedTuple, List, Set, Tuple, Sequence, Optional
 
 from my.core import Res, get_files, make_logger, Json
+from my.utils.dispatch import PrefixDispatch
 
 logger = make_logger(__name__)
 
@@ -58,22 +59,18 @@ def playlists() -> Playlists:
         "Userdata": None,
         "YourLibrary": None,
     }
+    dispatch: PrefixDispatch[Any] = PrefixDispatch(handler_map)
     for f in files:
-        handler: Any
-        for prefix, h in handler_map.items():
-            if not str(f).startswith(os.path.join(gdpr_dir, prefix)):
-                continue
-            handler = h
-            break
-        else:
-            if f.is_dir():
-                continue
-            else:
-                e = RuntimeError(f"Unhandled file: {f}")
-                logger.debug(str(e))
-                yield e
-                continue
+        if f.is_dir():
+            continue
+        match = dispatch.lookup(os.path.relpath(f, gdpr_dir))
+        if match is None:
+            e = RuntimeError(f"Unhandled file: {f}")
+            logger.debug(str(e))
+            yield e
+            continue
 
+        _, handler = match
         if handler is None:
             # explicitly ignored
             continue
@@ -8,14 +8,15 @@ from my.config import ttt as user_config  # type: ignore[attr-defined]
 import csv
 from pathlib import Path
 from datetime import datetime
-from typing import NamedTuple, Iterator, Sequence, Optional
-from itertools import chain
-
-from more_itertools import unique_everseen
+from typing import Iterator, Sequence, Optional, Tuple, Union
 
 from my.core import get_files, Stats, Paths, dataclass
-from my.utils.time import parse_datetime_sec
 from my.utils.input_source import InputSource
+from my.utils.parallel import parse_files
+from my.utils.merge import merge_unique
+from my.utils.file_cache import file_depends_on
+from my.utils.columnar import HistoryColumns, ColumnsBuilder, cached_columns
+from my.utils.lazy_dt import LazyDtRecord
 
 
 @dataclass
@@ -30,26 +31,77 @@ def inputs() -> Sequence[Path]:
 
 
 # represents one history entry (command)
-class Entry(NamedTuple):
-    dt: datetime
+# this only creates the datetime when dt is accessed, see my.utils.lazy_dt
+class Entry(LazyDtRecord):
+    __slots__ = ("command", "directory")
+    _fields = ("dt", "command", "directory")
+
     command: str
     directory: Optional[str]
 
+    def __init__(
+        self, dt: Union[datetime, int], command: str, directory: Optional[str]
+    ) -> None:
+        self._set_dt(dt)
+        self.command = command
+        self.directory = directory
+
 
 Results = Iterator[Entry]
 
 
 def history(from_paths: InputSource = inputs) -> Results:
-    yield from unique_everseen(
-        chain(*map(_parse_file, from_paths())),
+    yield from merge_unique(
+        *parse_files(_parse_file, from_paths()),
         key=lambda e: (
-            e.dt,
+            e.epoch,
             e.command,
         ),
+        dt=lambda e: e.epoch,
+    )
+
+
+def history_columns(from_paths: InputSource = inputs) -> HistoryColumns:
+    """
+    The same entries as history() (without the directory), stored column-wise.
+    This doesn't create a datetime/Entry for each entry, and the columns
+    are cached to disk. See my.utils.columnar
+    """
+
+    def _build() -> HistoryColumns:
+        builder = ColumnsBuilder()
+        for epoch, command, _ in merge_unique(
+            *parse_files(_parse_file_rows, from_paths()),
+            key=lambda r: (r[0], r[1]),
+            dt=lambda r: r[0],
+        ):
+            builder.add(epoch, command)
+        return builder.columns
+
+    # if user has specified some other function as input
+    if hash(from_paths) != hash(inputs):
+        return _build()
+    return cached_columns(
+        "my.ttt.history_columns",
+        str([file_depends_on(p) for p in from_paths()]),
+        _build,
     )
 
 
 def _parse_file(histfile: Path) -> Results:
+    for epoch, command, directory in _parse_file_rows(histfile):
+        yield Entry(
+            dt=epoch,
+            command=command,
+            directory=directory,
+        )
+
+
+# (epoch, command, directory)
+Row = Tuple[int, str, Optional[str]]
+
+
+def _parse_file_rows(histfile: Path) -> Iterator[Row]:
     # TODO: helper function to read 'regular' QUOTE_MINIMAL csv files
     # without failing due to encoding errors?
     with histfile.open("r", encoding="utf-8", newline="") as f:
@@ -58,11 +110,7 @@ def _parse_file(histfile: Path) -> Results:
         )
         try:
             for row in csv_reader:
-                yield Entry(
-                    dt=parse_datetime_sec(row[0]),
-                    command=row[2],
-                    directory=None if row[1] == "-" else row[1],
-                )
+                yield int(row[0]), row[2], None if row[1] == "-" else row[1]
         except csv.Error as e:
             print(f"While parsing {histfile}... {e}")
 
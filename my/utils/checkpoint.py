@@ -0,0 +1,90 @@
+"""
+Helpers to remember how far into an append-only file (e.g. a live
+shell history or an mbox) we've parsed, and to detect whether the
+file was rewritten since then
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import NamedTuple, Optional, Dict, Any
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+# how many bytes at the start/end of the already-parsed
+# region to hash when checking if the file was rewritten
+WINDOW = 64 * 1024
+
+
+class Checkpoint(NamedTuple):
+    path: str
+    inode: int
+    offset: int
+    digest: str
+
+
+def _digest(path: Path, offset: int) -> str:
+    """
+    hash the first and last WINDOW bytes before offset. Reading the whole
+    prefix would defeat the point, and a rewrite (e.g. zsh trimming its
+    history, or thunderbird compacting a mailbox) almost always changes
+    one of the two ends
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(offset).encode())
+    with path.open("rb") as f:
+        h.update(f.read(min(offset, WINDOW)))
+        tail_start = max(WINDOW, offset - WINDOW)
+        if tail_start < offset:
+            f.seek(tail_start)
+            h.update(f.read(offset - tail_start))
+    return h.hexdigest()
+
+
+def create(path: Path, offset: int) -> Checkpoint:
+    return Checkpoint(
+        path=str(path),
+        inode=path.stat().st_ino,
+        offset=offset,
+        digest=_digest(path, offset),
+    )
+
+
+def is_valid(cp: Checkpoint, path: Path) -> bool:
+    """
+    whether the bytes before cp.offset are still the same as when
+    the checkpoint was created, i.e. the file was only appended to
+    """
+    if cp.path != str(path):
+        return False
+    try:
+        st = path.stat()
+    except OSError:
+        return False
+    if st.st_ino != cp.inode or st.st_size < cp.offset:
+        return False
+    return _digest(path, cp.offset) == cp.digest
+
+
+def load(state_file: Path) -> Optional[Dict[str, Any]]:
+    """
+    load some JSON state saved alongside a checkpoint, returns None if
+    it doesn't exist or couldn't be read
+    """
+    try:
+        data = json.loads(state_file.read_text())
+        data["checkpoint"] = Checkpoint(**data["checkpoint"])
+        return data  # type: ignore[no-any-return]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save(state_file: Path, cp: Checkpoint, **extra: Any) -> None:
+    """
+    atomically write the checkpoint (and any extra JSON-compatible data) to state_file
+    """
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp = state_file.with_name(state_file.name + ".tmp")
+    tmp.write_text(json.dumps({"checkpoint": cp._asdict(), **extra}))
+    os.replace(tmp, state_file)
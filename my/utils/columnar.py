@@ -0,0 +1,140 @@
+"""
+Column-oriented storage for large histories (e.g. shell history)
+
+For aggregate queries (e.g. top commands per month), creating a NamedTuple
+and a datetime for each of millions of entries is most of the work. This
+stores each field as a compact array instead, with each unique command
+stored once in a string table
+
+To run vectorised queries, use HistoryColumns.as_numpy (requires numpy)
+"""
+
+import pickle
+from array import array
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Dict, List, Iterator, Optional, Tuple, Callable, Any
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+from my.core.warnings import low
+from my.utils.file_cache import cache_file
+
+# to be able to change the format of the cache files
+VERSION = 1
+
+
+def _int64_array() -> "array[int]":
+    return array("q")
+
+
+@dataclass
+class HistoryColumns:
+    # epoch seconds for each entry
+    epoch: "array[int]" = field(default_factory=_int64_array)
+    # index into 'commands' for each entry
+    command_id: "array[int]" = field(default_factory=_int64_array)
+    # string table, each unique command is stored once
+    commands: List[str] = field(default_factory=list)
+    # duration in seconds for each entry, if the source has one
+    duration: Optional["array[int]"] = None
+
+    def __len__(self) -> int:
+        return len(self.epoch)
+
+    def rows(self) -> Iterator[Tuple[int, int, str]]:
+        """
+        (epoch, duration, command) for each entry, duration is 0 if the source doesn't have one
+        """
+        durations = self.duration if self.duration is not None else [0] * len(self)
+        commands = self.commands
+        for epoch, dur, cid in zip(self.epoch, durations, self.command_id):
+            yield epoch, dur, commands[cid]
+
+    def as_numpy(self) -> Dict[str, Any]:
+        """
+        Returns the columns as numpy arrays, without copying them. 'commands'
+        is an object array, so commands[command_id] gives the command for each row
+        """
+        import numpy as np  # type: ignore[import]
+
+        d: Dict[str, Any] = {
+            "epoch": np.frombuffer(self.epoch, dtype=np.int64),
+            "command_id": np.frombuffer(self.command_id, dtype=np.int64),
+            "commands": np.array(self.commands, dtype=object),
+        }
+        if self.duration is not None:
+            d["duration"] = np.frombuffer(self.duration, dtype=np.int64)
+        return d
+
+
+class ColumnsBuilder:
+    """
+    appends entries to columns, either new ones or (to add to
+    columns loaded from the cache) the columns passed
+    """
+
+    def __init__(
+        self, with_duration: bool = False, columns: Optional[HistoryColumns] = None
+    ) -> None:
+        if columns is None:
+            columns = HistoryColumns(duration=_int64_array() if with_duration else None)
+        self.columns = columns
+        self._ids: Dict[str, int] = {c: i for i, c in enumerate(columns.commands)}
+
+    def add(self, epoch: int, command: str, duration: int = 0) -> None:
+        cols = self.columns
+        cid = self._ids.get(command)
+        if cid is None:
+            cid = self._ids[command] = len(cols.commands)
+            cols.commands.append(command)
+        cols.epoch.append(epoch)
+        cols.command_id.append(cid)
+        if cols.duration is not None:
+            cols.duration.append(duration)
+
+
+def load_columns(path: Path, key: str) -> Optional[HistoryColumns]:
+    """
+    load columns saved with save_columns, if they were saved with the same key
+    """
+    try:
+        with path.open("rb") as f:
+            data = pickle.load(f)
+        if data["version"] != VERSION or data["key"] != key:
+            return None
+        return HistoryColumns(**data["columns"])
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        return None
+
+
+def save_columns(path: Path, key: str, cols: HistoryColumns) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        pickle.dump(
+            {"version": VERSION, "key": key, "columns": cols.__dict__},
+            f,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    tmp.replace(path)
+
+
+def cached_columns(
+    name: str, key: str, build: Callable[[], HistoryColumns]
+) -> HistoryColumns:
+    """
+    load columns from the cache directory if they were saved
+    with the same key, else build and save them. If caching
+    is disabled, this always builds them
+    """
+    path = cache_file(f"{name}.pickle")
+    if path is None:
+        return build()
+    cols = load_columns(path, key)
+    if cols is None:
+        cols = build()
+        try:
+            save_columns(path, key, cols)
+        except OSError as e:
+            low(f"Could not save columns to {path}: {e}")
+    return cols
@@ -0,0 +1,126 @@
+"""
+Dispatches the files in an export (e.g. a GDPR export) to a handler, based on
+the prefix of their path relative to the export directory. The handlers are a
+dict of {prefix: handler}, with None as the handler for files to ignore
+
+Like checking str.startswith for each prefix in order, the first prefix (in
+the order of the dict) which matches wins, so more specific prefixes go
+before general ones. The prefixes are compiled into a trie, so matching a path
+only looks at each of its characters once, and while walking the export,
+directories which would only have ignored files in them aren't listed
+"""
+
+import os
+from pathlib import Path
+from typing import (
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+from .walk import walk
+
+H = TypeVar("H")
+
+
+class _Node:
+    __slots__ = ("children", "index", "min_handled")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        # index of the prefix which ends here, if any
+        self.index: Optional[int] = None
+        # lowest index of a prefix with a handler, which ends here or below
+        self.min_handled: Optional[int] = None
+
+
+class PrefixDispatch(Generic[H]):
+    """
+    handlers maps prefixes of paths (relative to the export, with '/' as the
+    separator) to a handler, or None to ignore files with that prefix
+    """
+
+    def __init__(self, handlers: Mapping[str, Optional[H]]) -> None:
+        self.prefixes: List[str] = list(handlers)
+        self.handlers: List[Optional[H]] = list(handlers.values())
+        self._root = _Node()
+        for i, prefix in enumerate(self.prefixes):
+            node = self._root
+            path = [node]
+            for c in prefix:
+                node = node.children.setdefault(c, _Node())
+                path.append(node)
+            # if a prefix is repeated the first one wins, like a dict lookup would
+            if node.index is None:
+                node.index = i
+            if self.handlers[i] is not None:
+                for n in path:
+                    if n.min_handled is None or i < n.min_handled:
+                        n.min_handled = i
+
+    def _match(self, relpath: str) -> Tuple[Optional[int], Optional[_Node]]:
+        """
+        returns the index of the first prefix which matches, and the
+        node relpath ends at (None if no prefix starts with relpath)
+        """
+        best: Optional[int] = None
+        node: Optional[_Node] = self._root
+        for c in relpath:
+            assert node is not None
+            if node.index is not None and (best is None or node.index < best):
+                best = node.index
+            node = node.children.get(c)
+            if node is None:
+                return best, None
+        assert node is not None
+        if node.index is not None and (best is None or node.index < best):
+            best = node.index
+        return best, node
+
+    def lookup(self, relpath: str) -> Optional[Tuple[str, Optional[H]]]:
+        """
+        returns the (prefix, handler) which matches relpath, None if nothing matches
+        """
+        i, _ = self._match(relpath)
+        if i is None:
+            return None
+        return self.prefixes[i], self.handlers[i]
+
+    def ignored_dir(self, reldir: str) -> bool:
+        """
+        whether every file in this directory would match an ignored prefix
+        """
+        i, node = self._match(reldir + "/")
+        if i is None or self.handlers[i] is not None:
+            return False
+        # unless a longer prefix with a handler comes before the one that matched
+        return node is None or node.min_handled is None or node.min_handled > i
+
+    def files(self, root: Union[str, Path]) -> Iterator[Tuple[Path, Optional[H]]]:
+        """
+        walks root, yielding (path, handler) for each file which has a handler and
+        (path, None) for files which don't match any prefix. Files which match an
+        ignored prefix are skipped, and directories with only those aren't walked
+        """
+        top = str(Path(root))
+        for dirpath, dirs, filenames in walk(top):
+            rel = dirpath[len(top) + 1 :]
+            if os.sep != "/":
+                rel = rel.replace(os.sep, "/")
+            if rel:
+                rel += "/"
+            dirs[:] = [d for d in dirs if not self.ignored_dir(rel + d)]
+            for name in filenames:
+                match = self.lookup(rel + name)
+                if match is None:
+                    yield Path(dirpath, name), None
+                elif match[1] is not None:
+                    yield Path(dirpath, name), match[1]
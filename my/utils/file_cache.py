@@ -0,0 +1,45 @@
+"""
+Helpers to cache the results of parsing each input file separately with cachew,
+so adding one new file to an export directory doesn't invalidate the
+cache for (and re-parse) every other file
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Callable, Optional
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+
+def cache_file(name: str) -> Optional[Path]:
+    """
+    path to 'name' in the cache directory, or None if the
+    user disabled caching (by setting cache_dir to None)
+    """
+    from my.core.core_config import config
+
+    cache_dir = config.get_cache_dir()
+    if cache_dir is None:
+        return None
+    return Path(cache_dir) / name
+
+
+def file_cache_path(name: str) -> Callable[[Path], Optional[Path]]:
+    """
+    returns a cache_path function for cachew, which creates
+    one cache file per input file in a directory called 'name'.
+    If caching is disabled this returns None, which cachew skips caching for
+    """
+
+    def _cache_path(p: Path) -> Optional[Path]:
+        cache_dir = cache_file(name)
+        if cache_dir is None:
+            return None
+        return cache_dir / hashlib.md5(str(p.absolute()).encode()).hexdigest()
+
+    return _cache_path
+
+
+def file_depends_on(p: Path) -> str:
+    st = p.stat()
+    return f"{p.absolute()}:{st.st_mtime_ns}:{st.st_size}"
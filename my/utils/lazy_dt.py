@@ -0,0 +1,109 @@
+"""
+A base class for records from large histories (e.g. shell history), which
+stores the epoch seconds and only creates the datetime when 'dt' is accessed
+
+Most queries against those only filter/count by the other fields, and creating a
+tz-aware datetime is most of the time/memory it takes to create each entry
+"""
+
+from datetime import datetime
+from functools import total_ordering
+from typing import Any, Dict, Iterator, Optional, Tuple, Union
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+from my.utils.time import parse_datetime_sec
+
+
+@total_ordering
+class LazyDtRecord:
+    """
+    Behaves like a NamedTuple whose first field is 'dt', so it can be used in place
+    of one: field access, iterating/unpacking, indexing, comparisons (with other
+    records and with tuples), hash, _asdict and _replace all work the same, and
+    my.core.serialize (i.e. hpi query) uses _asdict to serialize it, so the JSON
+    is the same as well
+
+    Records of the same type compare and hash on the epoch instead of dt (which
+    is created from it), so sorting/deduping them doesn't create the datetimes.
+    Comparing with a tuple uses dt, but records don't hash the same as the
+    equal tuple, so don't mix the two in a set or as dict keys
+
+    It isn't a tuple subclass either (a tuple would have to store the datetime),
+    so isinstance(e, tuple) is False, use tuple(e) if you need an actual tuple
+
+    Subclasses set _fields and __slots__ for the other fields, and define an __init__
+    which accepts either a datetime or epoch seconds (an int) for 'dt'
+    """
+
+    __slots__ = ("epoch", "_dt")
+
+    _fields: Tuple[str, ...] = ("dt",)
+
+    epoch: int
+    _dt: Optional[datetime]
+
+    def _set_dt(self, dt: Union[datetime, int]) -> None:
+        if isinstance(dt, datetime):
+            self.epoch = int(dt.timestamp())
+            self._dt = dt
+        else:
+            self.epoch = dt
+            self._dt = None
+
+    @property
+    def dt(self) -> datetime:
+        if self._dt is None:
+            self._dt = parse_datetime_sec(self.epoch)
+        return self._dt
+
+    def _rest(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, f) for f in self._fields[1:])
+
+    def _asdict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self._fields}
+
+    def _replace(self, **kwargs: Any) -> Any:
+        return type(self)(**{**self._asdict(), **kwargs})
+
+    def __iter__(self) -> Iterator[Any]:
+        yield self.dt
+        yield from self._rest()
+
+    def __getitem__(self, i: Any) -> Any:
+        return tuple(self)[i]
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    # compared the same way as tuples, so these sort by dt and then the other fields
+
+    def _key(self) -> Tuple[Any, ...]:
+        return (self.epoch, *self._rest())
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is type(self):
+            return self._key() == other._key()
+        if not isinstance(other, (tuple, LazyDtRecord)):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __lt__(self, other: Any) -> bool:
+        if type(other) is type(self):
+            return self._key() < other._key()
+        if not isinstance(other, (tuple, LazyDtRecord)):
+            return NotImplemented
+        return tuple(self) < tuple(other)
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # for pickling (e.g. to send entries back from a process pool),
+        # keeps the datetime if it was already created
+        dt = self.epoch if self._dt is None else self._dt
+        return (type(self), (dt, *self._rest()))
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{f}={v!r}" for f, v in zip(self._fields, self))
+        return f"{type(self).__name__}({fields})"
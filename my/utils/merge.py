@@ -0,0 +1,75 @@
+"""
+Helpers to merge and remove duplicates from histories spread across multiple files
+"""
+
+import heapq
+from collections import deque
+from datetime import datetime, timedelta
+from typing import (
+    Iterable,
+    Iterator,
+    Callable,
+    Hashable,
+    TypeVar,
+    Set,
+    Deque,
+    Tuple,
+    Optional,
+    Union,
+)
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+T = TypeVar("T")
+
+# a datetime, or an epoch timestamp in seconds
+When = Union[datetime, int]
+
+# how far back (from the newest item we've seen) to remember keys
+DEFAULT_WINDOW = timedelta(days=30)
+
+
+def merge_unique(
+    *sources: Iterable[T],
+    key: Callable[[T], Hashable],
+    dt: Callable[[T], When],
+    window: Optional[timedelta] = DEFAULT_WINDOW,
+) -> Iterator[T]:
+    """
+    Merges sources which are (roughly) sorted by datetime, and removes duplicates
+
+    Instead of remembering every key (like more_itertools.unique_everseen), this
+    merges the sources by datetime so duplicates across files end up close
+    to each other, and then only remembers keys for items within 'window' of the
+    newest item, so memory is bounded by the overlap instead of the whole history
+
+    Keys are forgotten in the order they were emitted, so something that's
+    slightly out of order is remembered as long as the items emitted before it.
+    If some file is out of order by more than 'window', a duplicate could
+    slip through. Pass window=None to remember everything
+
+    dt can return either datetimes or epoch seconds, so rows
+    can be merged without creating datetimes for each one
+    """
+    seen: Set[Hashable] = set()
+    recent: Deque[Tuple[When, Hashable]] = deque()
+    newest: Optional[When] = None
+    for item in heapq.merge(*sources, key=dt):
+        k = key(item)
+        if k in seen:
+            continue
+        seen.add(k)
+        yield item
+        if window is None:
+            continue
+        d = dt(item)
+        recent.append((d, k))
+        if newest is None or d > newest:  # type: ignore[operator]
+            newest = d
+            cutoff: When
+            if isinstance(newest, datetime):
+                cutoff = newest - window
+            else:
+                cutoff = newest - int(window.total_seconds())
+            while recent[0][0] < cutoff:  # type: ignore[operator]
+                seen.discard(recent.popleft()[1])
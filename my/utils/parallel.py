@@ -0,0 +1,128 @@
+"""
+Helpers to parse multiple input files in parallel
+
+This is opt-in, using the process pool managed by HPI core, which
+is enabled by setting the HPI_CPU_POOL environment variable
+to the number of processes to use, e.g.:
+
+HPI_CPU_POOL=8 hpi query my.bash.history
+"""
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# how many chunks map_ordered submits to the pool ahead of the one being consumed
+MAX_PENDING = 16
+
+
+def get_pool(workers: Optional[int] = None) -> Optional[Executor]:
+    """
+    workers is the number of processes to use, if None this uses the pool
+    from HPI core (if HPI_CPU_POOL is set). 0 or 1 means don't use a pool
+    """
+    if workers is not None:
+        return _pool(workers) if workers > 1 else None
+    try:
+        from my.core._cpu_pool import get_cpu_pool
+    except ImportError:
+        # older versions of HPI core
+        return None
+    return get_cpu_pool()
+
+
+@lru_cache(maxsize=None)
+def _pool(workers: int) -> Executor:
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def _parse_all(func: Callable[[Path], Iterable[T]], path: Path) -> List[T]:
+    return list(func(path))
+
+
+def _wait(fut: "Future[List[T]]") -> Iterator[T]:
+    yield from fut.result()
+
+
+def parse_files(
+    func: Callable[[Path], Iterable[T]], paths: Iterable[Path]
+) -> List[Iterator[T]]:
+    """
+    Returns func(path) for each path, in the same order
+
+    If there's a process pool, each file is parsed in a worker process
+    and the returned iterators block till the result for that file is
+    ready. func and the items it returns have to be picklable (e.g. a
+    top-level function returning NamedTuples)
+    """
+    ps = list(paths)
+    pool = get_pool()
+    if pool is None or len(ps) < 2:
+        return [iter(func(p)) for p in ps]
+    return [_wait(pool.submit(_parse_all, func, p)) for p in ps]
+
+
+def _map_chunk(func: Callable[[T], R], chunk: Sequence[T]) -> List[R]:
+    return [func(item) for item in chunk]
+
+
+def _map_bounded(
+    pool: Executor,
+    func: Callable[[T], R],
+    items: Sequence[T],
+    chunksize: int,
+    max_pending: int,
+) -> Iterator[R]:
+    pending: Deque["Future[List[R]]"] = deque()
+    try:
+        for i in range(0, len(items), chunksize):
+            pending.append(pool.submit(_map_chunk, func, items[i : i + chunksize]))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # if the consumer stopped early
+        for fut in pending:
+            fut.cancel()
+
+
+def map_ordered(
+    func: Callable[[T], R],
+    items: Sequence[T],
+    workers: Optional[int] = None,
+    min_items: int = 2,
+    chunksize: int = 1,
+    max_pending: int = MAX_PENDING,
+) -> Iterator[R]:
+    """
+    Like map(func, items), but runs in a process pool if there is one (see get_pool)
+    and there are at least min_items items. Results are in the same order as items
+
+    Unlike Executor.map, only max_pending chunks are submitted ahead of the
+    results being consumed, so results don't pile up in memory if the consumer
+    is slower than the workers
+
+    func, the items and results have to be picklable, so
+    keep the results small (e.g. strings instead of objects)
+    """
+    pool = get_pool(workers)
+    if pool is None or len(items) < min_items:
+        return map(func, items)
+    return _map_bounded(pool, func, items, max(chunksize, 1), max(max_pending, 1))
@@ -0,0 +1,87 @@
+"""
+Helpers for export directories full of snapshots of some file that only
+ever grows (e.g. daily backups of a shell history), where each snapshot
+is usually a prefix of the next one
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Iterable, List, Dict
+
+from my.core import __NOT_HPI_MODULE__  # noqa: F401
+
+HEAD = 4096
+CHUNK = 1024 * 1024
+
+
+def _head_digest(p: Path, size: int) -> bytes:
+    with p.open("rb") as f:
+        return hashlib.blake2b(f.read(min(size, HEAD)), digest_size=16).digest()
+
+
+def _is_prefix_of(small: Path, small_size: int, big: Path) -> bool:
+    with small.open("rb") as sf, big.open("rb") as bf:
+        # cheap check first, compare the bytes right before where the smaller file ends
+        start = max(0, small_size - HEAD)
+        sf.seek(start)
+        bf.seek(start)
+        if sf.read(HEAD) != bf.read(small_size - start):
+            return False
+        # then compare everything
+        sf.seek(0)
+        bf.seek(0)
+        remaining = small_size
+        while remaining > 0:
+            n = min(CHUNK, remaining)
+            if sf.read(n) != bf.read(n):
+                return False
+            remaining -= n
+    return True
+
+
+def _ends_with_newline(p: Path, size: int) -> bool:
+    with p.open("rb") as f:
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+def remove_prefix_snapshots(paths: Iterable[Path]) -> List[Path]:
+    """
+    Removes any file whose contents are a prefix of (or identical to)
+    some other file, since parsing it would only produce duplicates.
+    This only reads/compares bytes, which is much cheaper than
+    parsing each file and removing duplicates afterwards
+
+    Only removes files which end with a newline, so we don't drop a
+    file whose last line was cut off (a partial write) which
+    would parse differently from the larger file
+    """
+    ps = list(paths)
+    sizes: Dict[Path, int] = {p: p.stat().st_size for p in ps}
+    heads: Dict[Path, bytes] = {}
+    kept: List[Path] = []
+    # go from largest to smallest, the largest file can't be a prefix of anything
+    for p in sorted(ps, key=lambda p: sizes[p], reverse=True):
+        size = sizes[p]
+        if size > 0 and _ends_with_newline(p, size):
+            head = _head_digest(p, size)
+            contained = False
+            for k in kept:
+                # compare the first few KB of the larger file, up to the size of this one
+                if size < HEAD:
+                    if _head_digest(k, size) != head:
+                        continue
+                else:
+                    if k not in heads:
+                        heads[k] = _head_digest(k, HEAD)
+                    if heads[k] != head:
+                        continue
+                if _is_prefix_of(p, size, k):
+                    contained = True
+                    break
+            if contained:
+                continue
+        kept.append(p)
+    keep = set(kept)
+    # keep the original order
+    return [p for p in ps if p in keep]
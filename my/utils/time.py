@@ -6,10 +6,15 @@ from my.core import __NOT_HPI_MODULE__  # noqa: F401
 # TODO: maybe this should be PR'd to master/put into
 # my.time.tz/utils?
 
+Epoch = Union[str, float, int]
 
-def parse_datetime_sec(d: Union[str, float, int]) -> datetime:
-    return datetime.fromtimestamp(int(d), tz=timezone.utc)
+_UTC = timezone.utc
 
 
-def parse_datetime_millis(d: Union[str, float, int]) -> datetime:
+def parse_datetime_sec(d: Epoch) -> datetime:
+    # passing tz positionally is a lot faster than tz=, this is called for every entry in most histories
+    return datetime.fromtimestamp(int(d), _UTC)
+
+
+def parse_datetime_millis(d: Epoch) -> datetime:
     return parse_datetime_sec(int(d) / 1000)
@@ -0,0 +1,114 @@
+"""
+A directory walk like os.walk, which can remember the listing of each directory
+
+Path.rglob("*") followed by is_file() stats every file, os.scandir already
+knows which entries are directories from the listing. Like os.walk, you can
+remove names from the list of directories to skip walking into them
+
+If given a DirSnapshot, directories whose mtime hasn't changed since the
+last walk aren't listed again. Adding, removing or renaming a file in a
+directory changes its mtime, so that's enough to know the listing is the same
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from typing import Iterator, Tuple, List, Dict, Any, Optional, Union
+
+from my.core import make_logger, __NOT_HPI_MODULE__  # noqa: F401
+
+logger = make_logger(__name__)
+
+# don't trust listings of directories modified this recently (in nanoseconds),
+# since a file could be added after we list it without changing the mtime
+RACY_NS = 2 * 10**9
+
+
+def _scan(path: str) -> Tuple[List[str], List[str]]:
+    dirs: List[str] = []
+    files: List[str] = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                # like Path.rglob, doesn't follow symlinks to directories
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        dirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                continue
+    dirs.sort()
+    files.sort()
+    return dirs, files
+
+
+class DirSnapshot:
+    """
+    The mtime and listing of each directory from the last walk, saved
+    to a JSON file. Only the directories listed since this was loaded are
+    saved, so directories which were removed (or pruned) are forgotten
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._old: Dict[str, Any] = {}
+        self._new: Dict[str, Any] = {}
+        try:
+            self._old = json.loads(path.read_text())
+        except (OSError, ValueError):
+            pass
+        self.reused = 0
+
+    def listdir(self, path: str) -> Tuple[List[str], List[str]]:
+        """
+        returns the (directories, files) in path
+        """
+        mtime = os.stat(path).st_mtime_ns
+        saved = self._old.get(path)
+        if saved is not None and saved[0] == mtime:
+            self.reused += 1
+            dirs, files = saved[1], saved[2]
+        else:
+            dirs, files = _scan(path)
+        if time.time_ns() - mtime < RACY_NS:
+            # list it again next time
+            mtime = -1
+        self._new[path] = [mtime, dirs, files]
+        return list(dirs), list(files)
+
+    def save(self) -> None:
+        logger.debug(f"Reused {self.reused} of {len(self._new)} directory listings")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(self._new))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save directory snapshot to {self.path}: {e}")
+
+
+def walk(
+    top: Union[str, Path], snapshot: Optional[DirSnapshot] = None
+) -> Iterator[Tuple[str, List[str], List[str]]]:
+    """
+    Like os.walk (top down), yields (dirpath, dirnames, filenames), and you can
+    remove items from dirnames to skip those. Names are sorted, and only
+    regular files (or symlinks to them) are included in filenames
+
+    If a snapshot is given, call its save method once you've finished walking
+    """
+    stack = [str(top)]
+    while stack:
+        path = stack.pop()
+        try:
+            if snapshot is not None:
+                dirs, files = snapshot.listdir(path)
+            else:
+                dirs, files = _scan(path)
+        except OSError as e:
+            logger.debug(f"Could not list {path}: {e}")
+            continue
+        yield path, dirs, files
+        stack.extend(os.path.join(path, d) for d in reversed(dirs))
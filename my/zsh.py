@@ -25,7 +25,7 @@ setopt EXTENDED_HISTORY   # save time/duration to history file
 from my.config import zsh as user_config  # type: ignore[attr-defined]
 
 from pathlib import Path
-from typing import Sequence, Optional
+from typing import Sequence, Optional, List, TypeVar
 from functools import lru_cache
 
 from my.core import (
@@ -39,10 +39,20 @@ from my.core import (
 )
 from my.core.common import mcachew
 from my.core.warnings import low
-from my.utils.time import parse_datetime_sec
 from my.utils.input_source import InputSource
-
-from more_itertools import unique_everseen
+from my.utils.parallel import parse_files
+from my.utils import checkpoint
+from my.utils.file_cache import cache_file, file_cache_path, file_depends_on
+from my.utils.snapshots import remove_prefix_snapshots
+
+from my.utils.merge import merge_unique
+from my.utils.columnar import (
+    HistoryColumns,
+    ColumnsBuilder,
+    cached_columns,
+    load_columns,
+    save_columns,
+)
 
 
 @dataclass
@@ -53,6 +63,10 @@ class config(user_config):
     # path to current zsh history (i.e. the live file)
     live_file: Optional[PathIsh]
 
+    # parse files as bytes, splitting the whole file into entries at once
+    # instead of line by line. Set to False to use the line by line parser
+    fast_parser: bool = True
+
 
 logger = make_logger(__name__)
 
@@ -76,13 +90,30 @@ def _live_file() -> Optional[Path]:
 import re
 
 from datetime import datetime
-from typing import NamedTuple, Iterator, Tuple
-from itertools import chain
+from typing import NamedTuple, Iterator, Iterable, Tuple, Union
+from itertools import islice
+
+from my.utils.lazy_dt import LazyDtRecord
 
 
 # represents one history entry (command)
-class Entry(NamedTuple):
-    dt: datetime
+# this only creates the datetime when dt is accessed, see my.utils.lazy_dt
+class Entry(LazyDtRecord):
+    __slots__ = ("duration", "command")
+    _fields = ("dt", "duration", "command")
+
+    duration: int
+    command: str
+
+    def __init__(self, dt: Union[datetime, int], duration: int, command: str) -> None:
+        self._set_dt(dt)
+        self.duration = duration
+        self.command = command
+
+
+# cachew can only store NamedTuples/dataclasses, so the caches store these
+class _CachedEntry(NamedTuple):
+    epoch: int
     duration: int
     command: str
 
@@ -93,44 +124,296 @@ Results = Iterator[Entry]
 def history(from_paths: InputSource = backup_inputs) -> Results:
     # if user has specified some other function as input
     if hash(from_paths) != hash(backup_inputs):
-        yield from _merge_histories(*map(_parse_file, from_paths()))
+        yield from _merge_histories(
+            *parse_files(_parse_file, remove_prefix_snapshots(from_paths()))
+        )
         return
+    backups = (Entry(*r) for r in _history_from_backups(from_paths))
     lf = _live_file()
     if lf is not None:
-        yield from _merge_histories(_history_from_backups(from_paths), _parse_file(lf))
+        yield from _merge_histories(backups, _live_history(lf))
     else:
         # if we're not merging the live history file
         # dont need to spend the time doing the additional _merge_histories
-        yield from _history_from_backups(from_paths)
+        yield from backups
 
 
-def _depends_on(p: InputSource) -> Sequence[Path]:
-    return sorted(p())
+# (epoch, duration, command)
+Row = Tuple[int, int, str]
+
+
+def history_columns(from_paths: InputSource = backup_inputs) -> HistoryColumns:
+    """
+    The same entries as history(), stored column-wise. This doesn't create a
+    datetime/Entry for each entry, and the columns for the backups
+    are cached to disk. See my.utils.columnar
+    """
+    if hash(from_paths) != hash(backup_inputs):
+        return _build_columns(
+            *parse_files(_parse_file_rows, remove_prefix_snapshots(from_paths()))
+        )
+    backups = cached_columns(
+        "my.zsh.history_columns",
+        str(_depends_on(from_paths)),
+        lambda: _build_columns(
+            *parse_files(_parse_file_rows, remove_prefix_snapshots(from_paths()))
+        ),
+    )
+    lf = _live_file()
+    if lf is None:
+        return backups
+    # the live file is checkpointed the same way as for history()
+    return _build_columns(backups.rows(), _live_columns(lf).rows())
+
+
+def _build_columns(*sources: Iterator[Row]) -> HistoryColumns:
+    builder = ColumnsBuilder(with_duration=True)
+    for epoch, dur, command in merge_unique(
+        *sources, key=lambda r: (r[0], r[2]), dt=lambda r: r[0]
+    ):
+        builder.add(epoch, command, dur)
+    return builder.columns
+
+
+def _parse_file_rows(histfile: Path) -> Iterator[Row]:
+    for _, row in _parse_row_offsets(histfile):
+        yield row
+
+
+def _parse_row_offsets(histfile: Path, offset: int = 0) -> Iterator[Tuple[int, Row]]:
+    """
+    yields each row from offset onwards, along with the byte offset it started at
+    """
+    if config.fast_parser:
+        for start, epoch, dur, command in _parse_bytes_rows(histfile, offset):
+            yield start, (epoch, dur, command)
+    else:
+        for start, e in _parse_lines(_iter_lines(histfile, offset)):
+            yield start, (e.epoch, e.duration, e.command)
+
+
+def _depends_on(p: InputSource) -> List[str]:
+    return [file_depends_on(f) for f in sorted(p())]
 
 
 @mcachew(depends_on=_depends_on, logger=logger)
-def _history_from_backups(from_paths: InputSource) -> Results:
-    yield from _merge_histories(*map(_parse_file, from_paths()))
+def _history_from_backups(from_paths: InputSource) -> Iterator[_CachedEntry]:
+    # backups which are a prefix of a later backup wouldn't add any new entries
+    yield from _merge_histories(
+        *parse_files(_parse_file_cached, remove_prefix_snapshots(from_paths()))
+    )
+
+
+# cache each backup separately, so a new backup only means parsing that file
+@mcachew(
+    cache_path=file_cache_path("my.zsh._parse_file_cached"),
+    depends_on=file_depends_on,
+    logger=logger,
+)
+def _parse_file_cached(histfile: Path) -> Iterator[_CachedEntry]:
+    for row in _parse_file_rows(histfile):
+        yield _CachedEntry(*row)
+
+
+E = TypeVar("E", Entry, _CachedEntry)
 
 
 @warn_if_empty
-def _merge_histories(*sources: Results) -> Results:
-    yield from unique_everseen(
-        chain(*sources),
+def _merge_histories(*sources: Iterator[E]) -> Iterator[E]:
+    yield from merge_unique(
+        *sources,
         key=lambda e: (
-            e.dt,
+            e.epoch,
             e.command,
         ),
+        dt=lambda e: e.epoch,
     )
 
 
+def _live_state_file() -> Optional[Path]:
+    return cache_file("my.zsh.live_file.json")
+
+
+def _columns_key(cp: checkpoint.Checkpoint) -> str:
+    # the columns are saved before the checkpoint, so this
+    # makes sure they're from the same run
+    return f"{cp.inode}:{cp.offset}:{cp.digest}"
+
+
+def _live_columns(lf: Path) -> HistoryColumns:
+    """
+    With a large HISTSIZE, the live file is the largest file we parse and
+    zsh only appends to it, so this saves the entries we've already parsed
+    as columns (see my.utils.columnar, which load a lot faster than parsing
+    the file again) and a checkpoint of how far we got to the cache directory,
+    and only parses whatever was appended since the last call
+
+    If the file was rewritten (e.g. zsh trimmed it), or caching is
+    disabled, this parses the whole thing
+    """
+    state_file = _live_state_file()
+    if state_file is None:
+        builder = ColumnsBuilder(with_duration=True)
+        for epoch, dur, command in _parse_file_rows(lf):
+            builder.add(epoch, command, dur)
+        return builder.columns
+    columns_file = state_file.with_suffix(".pickle")
+
+    offset = 0
+    cached: Optional[HistoryColumns] = None
+    state = checkpoint.load(state_file)
+    if state is not None and checkpoint.is_valid(state["checkpoint"], lf):
+        cached = load_columns(columns_file, _columns_key(state["checkpoint"]))
+        if cached is not None:
+            offset = state["checkpoint"].offset
+    if offset == 0:
+        logger.debug(f"Parsing entire live file {lf}")
+
+    builder = ColumnsBuilder(with_duration=True, columns=cached)
+    parsed = list(_parse_row_offsets(lf, offset))
+    for _, (epoch, dur, command) in parsed[:-1]:
+        builder.add(epoch, command, dur)
+    # the last entry could be a multiline command which is still being
+    # written, so leave it to be parsed again the next time
+    if len(parsed) > 1:
+        cp = checkpoint.create(lf, parsed[-1][0])
+        try:
+            save_columns(columns_file, _columns_key(cp), builder.columns)
+            checkpoint.save(state_file, cp)
+        except OSError as e:
+            logger.warning(f"Could not save live file checkpoint to {state_file}: {e}")
+    if parsed:
+        _, (epoch, dur, command) = parsed[-1]
+        builder.add(epoch, command, dur)
+    return builder.columns
+
+
+def _live_history(lf: Path) -> Results:
+    for epoch, dur, command in _live_columns(lf).rows():
+        yield Entry(epoch, dur, command)
+
+
+def _iter_lines(histfile: Path, offset: int = 0) -> Iterator[Tuple[int, str]]:
+    """
+    yields each line from offset onwards, along with the byte offset it starts at
+
+    this reads bytes so we can keep track of offsets -- latin-1 maps each byte to
+    one character, and splitting/translating '\r' matches what universal newlines
+    does when opening the file in text mode
+    """
+    with histfile.open("rb") as bf:
+        bf.seek(offset)
+        for raw in bf:
+            if b"\r" not in raw:
+                yield offset, raw.decode("latin-1")
+                offset += len(raw)
+                continue
+            for part in raw.splitlines(keepends=True):
+                yield offset, part.rstrip(b"\r\n").decode("latin-1") + "\n"
+                offset += len(part)
+
+
 def _parse_file(histfile: Path) -> Results:
-    dt: Optional[datetime] = None
+    for _, e in _parse_file_offsets(histfile):
+        yield e
+
+
+def _parse_file_offsets(histfile: Path, offset: int = 0) -> Iterator[Tuple[int, Entry]]:
+    """
+    yields each entry from offset onwards, along with the byte offset it started at
+    """
+    if config.fast_parser:
+        yield from _parse_bytes(histfile, offset)
+    else:
+        yield from _parse_lines(_iter_lines(histfile, offset))
+
+
+def _parse_bytes(histfile: Path, offset: int = 0) -> Iterator[Tuple[int, Entry]]:
+    for start, epoch, dur, command in _parse_bytes_rows(histfile, offset):
+        yield start, Entry(epoch, dur, command)
+
+
+def _parse_bytes_rows(
+    histfile: Path, offset: int = 0
+) -> Iterator[Tuple[int, int, int, str]]:
+    """
+    Parses the same format as _parse_lines, but reads the whole file as
+    bytes, splits it into entries in bulk and only decodes the commands
+
+    Produces the same entries as _parse_lines, except for a file with
+    no entries at all (which this ignores, instead of yielding junk)
+
+    yields (start offset, epoch, duration, command) for each entry
+    """
+    with histfile.open("rb") as f:
+        f.seek(offset)
+        data = f.read()
+    # universal newlines would split on '\r' as well, so let the
+    # line by line parser handle it. zsh never writes those anyways
+    if b"\r" in data:
+        for line_start, entry in _parse_lines(_iter_lines(histfile, offset)):
+            yield line_start, entry.epoch, entry.duration, entry.command
+        return
+    # prepend a newline so the first entry is split off as well. chunks[0]
+    # is whatever is before the first entry, which the line parser ignores
+    chunks = (b"\n" + data).split(b"\n: ")
+    # offset of the ': ' for the current chunk
+    pos = offset + len(chunks[0])
+    # start offset, epoch, duration, command for the entry we're building
+    start: int = -1
+    epoch = dur = body = b""
+    for chunk in islice(chunks, 1, None):
+        head, sep, rest = chunk.partition(b";")
+        e, colon, d = head.partition(b":")
+        if sep and colon and e.isdigit() and d.isdigit():
+            if start != -1:
+                yield start, int(epoch), int(dur), _bytes_command(body, True)
+            start, epoch, dur, body = pos, e, d, rest
+        elif start != -1:
+            # a line in a multiline command which happened to start with ': '
+            body += b"\n: " + chunk
+        pos += len(chunk) + 3
+    del chunks
+    if start != -1:
+        # the line parser only yields the last entry if it has a command
+        command = _bytes_command(body, False)
+        if command:
+            yield start, int(epoch), int(dur), command
+
+
+def _bytes_command(body: bytes, newline: bool) -> str:
+    """
+    newline is whether the entry ended with a newline (which
+    was removed when splitting), the last one in the file may not
+    """
+    if b"\n" in body or not newline:
+        # the line parser joins lines from multiline commands with
+        # "\n" + line, and each line still has its newline
+        if newline:
+            body += b"\n"
+        first, _, rest = body.partition(b"\n")
+        if rest:
+            if rest.endswith(b"\n"):
+                rest = rest[:-1].replace(b"\n", b"\n\n") + b"\n"
+            else:
+                rest = rest.replace(b"\n", b"\n\n")
+            body = first + b"\n" + rest
+        else:
+            body = first
+    return body.decode("latin-1")
+
+
+def _parse_lines(lines: Iterable[Tuple[int, str]]) -> Iterator[Tuple[int, Entry]]:
+    """
+    yields each entry, along with the offset of the line it started on
+    """
+    start: int = 0
+    epoch: Optional[int] = None
     dur: Optional[int] = None
     command: str = ""
     # can't parse line by line since some commands are multiline
     # sort of structured like a do-while loop
-    for line in histfile.open(encoding="latin-1"):
+    for offset, line in lines:
         r = _parse_metadata(line)
         # if regex didn't match, this is a multi line command string
         if r is None:
@@ -138,18 +421,19 @@ def _parse_file(histfile: Path) -> Results:
         else:
             # this 'if' is needed for the first item (since its not set on the first loop)
             # yield the last command
-            if dt is not None and dur is not None:
-                yield Entry(
-                    dt=dt,
+            if epoch is not None and dur is not None:
+                yield start, Entry(
+                    dt=epoch,
                     duration=dur,
                     command=command,
                 )
-            # set 'current' dt, dur, command to matched groups
-            dt, dur, command = r
+            # set 'current' epoch, dur, command to matched groups
+            epoch, dur, command = r
+            start = offset
     # yield the last entry
     if command:
-        yield Entry(
-            dt=dt,  # type: ignore[arg-type]
+        yield start, Entry(
+            dt=epoch,  # type: ignore[arg-type]
             duration=dur,  # type: ignore[arg-type]
             command=command,
         )
@@ -158,14 +442,14 @@ def _parse_file(histfile: Path) -> Results:
 PATTERN = re.compile(r"^: (\d+):(\d+);(.*)$")
 
 
-def _parse_metadata(histline: str) -> Optional[Tuple[datetime, int, str]]:
+def _parse_metadata(histline: str) -> Optional[Tuple[int, int, str]]:
     """
-    parse the date, duration, and command from a line
+    parse the epoch, duration, and command from a line
     """
     matches = PATTERN.match(histline)
     if matches:
         g = matches.groups()
-        return (parse_datetime_sec(g[0]), int(g[1]), g[2])
+        return (int(g[0]), int(g[1]), g[2])
     return None
 
 
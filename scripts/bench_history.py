@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the shell history parsers, on synthetic histories
+
+Needs some config to import the modules, can use the one for tests:
+MY_CONFIG=./tests/my python3 ./scripts/bench_history.py zsh
+MY_CONFIG=./tests/my python3 ./scripts/bench_history.py live
+MY_CONFIG=./tests/my python3 ./scripts/bench_history.py bash
+MY_CONFIG=./tests/my python3 ./scripts/bench_history.py time
+"""
+
+import time
+import random
+import logging
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Iterator, Any, NamedTuple, Optional, Union
+
+import click
+
+logger = logging.getLogger(__name__)
+
+WORDS = ["ls", "git", "status", "cd", "..", "python3", "-m", "pytest", "grep", "-r"]
+
+
+def _command(rand: random.Random) -> str:
+    return " ".join(rand.choices(WORDS, k=rand.randint(1, 8)))
+
+
+def generate_zsh_history(path: Path, entries: int, seed: int = 0) -> None:
+    rand = random.Random(seed)
+    epoch = 1_500_000_000
+    with path.open("w", encoding="latin-1") as f:
+        for _ in range(entries):
+            epoch += rand.randint(0, 120)
+            cmd = _command(rand)
+            # some multiline commands
+            if rand.random() < 0.02:
+                cmd = "\\\n".join(_command(rand) for _ in range(rand.randint(2, 5)))
+            f.write(f": {epoch}:{rand.randint(0, 10)};{cmd}\n")
+
+
+def generate_bash_history(path: Path, entries: int, seed: int = 0) -> None:
+    rand = random.Random(seed)
+    epoch = 1_500_000_000
+    with path.open("w", encoding="latin-1") as f:
+        for _ in range(entries):
+            epoch += rand.randint(0, 120)
+            f.write(f"#{epoch}\n")
+            r = rand.random()
+            if r < 0.02:
+                # heredoc, with some lines which look like comments/timestamps
+                f.write("cat <<EOF >file\n")
+                for _ in range(rand.randint(2, 20)):
+                    f.write(
+                        f"# {_command(rand)}\n" if rand.random() < 0.5 else "#123abc\n"
+                    )
+                    f.write(_command(rand) + "\n")
+                f.write("EOF\n")
+            elif r < 0.05:
+                f.write(f"{_command(rand)}  # {_command(rand)}\n")
+            else:
+                f.write(_command(rand) + "\n")
+
+
+def _timeit(desc: str, func: Callable[[], Iterator[Any]], repeat: int = 3) -> float:
+    # best of a few runs, to reduce noise
+    took = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in func())
+        took = min(took, time.perf_counter() - start)
+    click.echo(f"{desc:<20} {count:>10} entries {took:>8.3f}s")
+    return took
+
+
+@click.group()
+def main() -> None:
+    pass
+
+
+@main.command(short_help="compare zsh parsers")
+@click.option("--entries", default=1_000_000, show_default=True)
+def zsh(entries: int) -> None:
+    """
+    Compare the line by line zsh parser to the bytes parser
+    """
+    from my.zsh import _parse_bytes, _parse_lines, _iter_lines
+
+    with tempfile.TemporaryDirectory() as td:
+        hist = Path(td) / "zsh_history"
+        generate_zsh_history(hist, entries)
+        click.echo(f"Generated {hist.stat().st_size / 1e6:.1f}MB history")
+        slow = _timeit("line parser", lambda: _parse_lines(_iter_lines(hist)))
+        fast = _timeit("bytes parser", lambda: _parse_bytes(hist))
+        click.echo(f"bytes parser is {slow / fast:.2f}x faster")
+
+
+@main.command(short_help="benchmark the zsh live file checkpoint")
+@click.option("--entries", default=500_000, show_default=True)
+def live(entries: int) -> None:
+    """
+    Compare parsing the whole zsh live file to the checkpointed
+    parser, when nothing (warm) or a few entries (appended) were added
+    """
+    import my.zsh as zsh
+
+    with tempfile.TemporaryDirectory() as td:
+        hist = Path(td) / "zsh_history"
+        generate_zsh_history(hist, entries)
+        click.echo(f"Generated {hist.stat().st_size / 1e6:.1f}MB history")
+        state_file = Path(td) / "state" / "live.json"
+        zsh._live_state_file = lambda: state_file  # type: ignore[assignment]
+
+        def _cold() -> Iterator[zsh.Entry]:
+            for f in state_file.parent.glob("*"):
+                f.unlink()
+            return zsh._live_history(hist)
+
+        def _appended() -> Iterator[zsh.Entry]:
+            with hist.open("a") as f:
+                f.write(": 1600000000:0;echo appended\n")
+            return zsh._live_history(hist)
+
+        full = _timeit("whole file", lambda: zsh._parse_file(hist))
+        _timeit("cold", _cold, repeat=1)
+        assert list(zsh._live_history(hist)) == list(zsh._parse_file(hist))
+        warm = _timeit("warm", lambda: zsh._live_history(hist))
+        click.echo(f"warm is {full / warm:.2f}x faster")
+        _timeit("appended", _appended)
+
+
+# the parser (and parse_datetime_sec) before they were rewritten, copied
+# verbatim from my/bash.py and my/utils/time.py, for comparison
+
+
+class _PreviousEntry(NamedTuple):
+    dt: datetime
+    command: str
+
+
+def _previous_parse_datetime_sec(d: Union[str, float, int]) -> datetime:
+    return datetime.fromtimestamp(int(d), tz=timezone.utc)
+
+
+def _bash_parse_previous(histfile: Path) -> Iterator[_PreviousEntry]:
+    dt: Optional[datetime] = None
+    command_buf = ""  # current command
+    for line in histfile.open(encoding="latin-1"):
+        if line.startswith("#"):
+            # parse lines like '#1620931766'
+            # possible string datetime
+            sdt = line[1:].strip()  # remove newline
+            try:
+                newdt = _previous_parse_datetime_sec(sdt)
+            except Exception as e:
+                logger.debug(f"Error while parsing datetime {e}")
+            else:
+                # this case happens when we successfully parse a datetime line
+                # yield old data, then set newly parsed data to next items datetime
+                if dt is not None:
+                    # rstrip \n gets rid of the last newline for each command
+                    yield _PreviousEntry(dt=dt, command=command_buf.rstrip("\n"))
+                # set new datetime for next entry
+                dt = newdt
+                # overwrite command buffer
+                command_buf = ""
+                continue
+        # otherwise, append. this already includes newline
+        command_buf += line
+    # yield final command
+    if dt is not None and command_buf.strip():
+        yield _PreviousEntry(dt=dt, command=command_buf.rstrip("\n"))
+
+
+@main.command(short_help="benchmark the bash parser")
+@click.option("--entries", default=1_000_000, show_default=True)
+def bash(entries: int) -> None:
+    """
+    Compare the bash parser to the previous implementation, on a history
+    with multi-line commands (heredocs) and comments
+    """
+    from my.bash import _parse_file_rows, _parse_file
+
+    def _with_dt() -> Iterator[Any]:
+        # the previous parser created every datetime up front
+        return ((e.dt, e.command) for e in _parse_file(hist))
+
+    with tempfile.TemporaryDirectory() as td:
+        hist = Path(td) / "bash_history"
+        generate_bash_history(hist, entries)
+        click.echo(f"Generated {hist.stat().st_size / 1e6:.1f}MB history")
+        assert list(_parse_file(hist)) == list(_bash_parse_previous(hist))
+        slow = _timeit("previous parser", lambda: _bash_parse_previous(hist))
+        fast = _timeit("entries", lambda: _parse_file(hist))
+        click.echo(f"entries are {slow / fast:.2f}x faster")
+        with_dt = _timeit("entries, with dt", _with_dt)
+        click.echo(f"entries, with dt are {slow / with_dt:.2f}x faster")
+        _timeit("rows", lambda: _parse_file_rows(hist))
+
+
+@main.command(name="time", short_help="benchmark creating datetimes")
+@click.option("--entries", default=1_000_000, show_default=True)
+def time_(entries: int) -> None:
+    """
+    Compare creating a datetime for each entry in zsh/bash histories
+    to the previous parse_datetime_sec
+    """
+    from my.utils.time import parse_datetime_sec
+    from my.zsh import _parse_bytes_rows
+    from my.bash import _parse_file_rows
+
+    with tempfile.TemporaryDirectory() as td:
+        zsh_hist = Path(td) / "zsh_history"
+        generate_zsh_history(zsh_hist, entries)
+        bash_hist = Path(td) / "bash_history"
+        generate_bash_history(bash_hist, entries)
+        workloads = (
+            ("zsh", [r[1] for r in _parse_bytes_rows(zsh_hist)]),
+            ("bash", [r[0] for r in _parse_file_rows(bash_hist)]),
+        )
+        for name, epochs in workloads:
+            click.echo(f"{name}: {len(epochs)} timestamps")
+            slow = _timeit(
+                "previous", lambda: map(_previous_parse_datetime_sec, epochs)
+            )
+            fast = _timeit(
+                "parse_datetime_sec", lambda: map(parse_datetime_sec, epochs)
+            )
+            click.echo(f"parse_datetime_sec is {slow / fast:.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
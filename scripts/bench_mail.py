@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for parsing mail
+
+Needs some config to import the modules, can use the one for tests:
+MY_CONFIG=./tests/my python3 ./scripts/bench_mail.py dates
+MY_CONFIG=./tests/my python3 ./scripts/bench_mail.py pipeline --messages 5000
+
+The pipeline benchmark generates a synthetic maildir and mbox (the same messages
+in both, like syncing a mailbox and exporting it), and times each stage
+"""
+
+import sys
+import time
+import base64
+import random
+import resource
+import tempfile
+from pathlib import Path
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, Any, List, Dict, Optional, Sequence
+
+import click
+
+# Date headers that aren't RFC 2822, which mailparser can't parse
+DATE_FORMATS = [
+    "%a, %d %b %Y %H:%M:%S GMT%z",
+    "%Y-%m-%dT%H:%M:%SZ",
+    "%Y-%m-%d %H:%M:%S %z",
+    "%a %b %d %H:%M:%S %Y",
+    "%m/%d/%Y %H:%M:%S",
+    "%A, %B %d, %Y %I:%M %p",
+    "%d %B %Y %H:%M:%S %z",
+    "%a, %d %b %Y %I:%M:%S %p %z",
+    "%a, %d %b %Y %H.%M.%S %z",
+    "%a, %d %b %Y %H:%M:%S %z (Coordinated Universal Time)",
+    "%a %b %d %H:%M:%S PDT %Y",
+    # these go to dateparser
+    "%d.%m.%Y %H:%M",
+    "%a, %d %b %Y %H:%M:%S IST",
+]
+
+
+def generate_dates(count: int, repeat: float = 0.0, seed: int = 0) -> List[str]:
+    """
+    Date headers in the formats above, repeat is the fraction of
+    headers which are a copy of one earlier in the list
+    """
+    rand = random.Random(seed)
+    start = datetime(2015, 1, 1, tzinfo=timezone(timedelta(hours=2)))
+    dates: List[str] = []
+    for _ in range(count):
+        if dates and rand.random() < repeat:
+            dates.append(rand.choice(dates))
+            continue
+        dt = start + timedelta(seconds=rand.randint(0, 10 * 365 * 86400))
+        dates.append(dt.strftime(rand.choice(DATE_FORMATS)))
+    return dates
+
+
+WORDS = ["hello", "invoice", "meeting", "tomorrow", "café", "über", "naïve", "zürich"]
+
+# charset and transfer encoding for text parts, utf-8 is the most common
+CHARSETS = [
+    ("utf-8", "8bit"),
+    ("utf-8", "quoted-printable"),
+    ("iso-8859-1", "8bit"),
+    ("windows-1252", "quoted-printable"),
+    ("us-ascii", "7bit"),
+]
+
+
+def _text(rand: random.Random, words: int) -> str:
+    return " ".join(rand.choices(WORDS, k=words))
+
+
+def _encode_part(text: str, charset: str, cte: str) -> bytes:
+    import quopri
+
+    raw = text.encode(charset, errors="replace")
+    if cte == "quoted-printable":
+        raw = quopri.encodestring(raw)
+    return (
+        f"Content-Type: text/plain; charset={charset}\nContent-Transfer-Encoding: {cte}\n\n".encode()
+        + raw
+        + b"\n"
+    )
+
+
+def generate_message(
+    rand: random.Random,
+    i: int,
+    multipart: float = 0.3,
+    charset_mix: float = 0.3,
+    broken_dates: float = 0.05,
+    attachment_size: int = 50_000,
+) -> bytes:
+    """
+    a message with a random body. multipart is the fraction of messages with an
+    attachment, charset_mix the fraction not in utf-8, broken_dates the fraction
+    with a Date header mailparser can't parse
+    """
+    dt = datetime(2015, 1, 1, tzinfo=timezone.utc) + timedelta(
+        seconds=rand.randint(0, 10 * 365 * 86400)
+    )
+    if rand.random() < broken_dates:
+        date = dt.strftime(rand.choice(DATE_FORMATS))
+    else:
+        date = format_datetime(dt)
+    charset, cte = (
+        rand.choice(CHARSETS[1:]) if rand.random() < charset_mix else CHARSETS[0]
+    )
+    if charset == "us-ascii":
+        body = " ".join(rand.choices(WORDS[:4], k=rand.randint(20, 200)))
+    else:
+        body = _text(rand, rand.randint(20, 200))
+    headers = (
+        f"From: Sender {i % 50} <sender{i % 50}@example.com>\n"
+        f"To: Me <me@example.com>\n"
+        f"Subject: {_text(rand, 4)} {i}\n"
+        f"Date: {date}\n"
+        f"Message-ID: <{i}.{rand.randint(0, 10**9)}@example.com>\n"
+        "MIME-Version: 1.0\n"
+    ).encode("utf-8")
+    if rand.random() >= multipart:
+        return headers + _encode_part(body, charset, cte)
+    # Random.randbytes is 3.9+, and getrandbits(0) raises on 3.8
+    payload = (
+        rand.getrandbits(8 * attachment_size).to_bytes(attachment_size, "little")
+        if attachment_size > 0
+        else b""
+    )
+    attachment = base64.encodebytes(payload)
+    return (
+        headers
+        + b"Content-Type: multipart/mixed; boundary=BOUNDARY\n\n--BOUNDARY\n"
+        + _encode_part(body, charset, cte)
+        + b"--BOUNDARY\nContent-Type: application/pdf\nContent-Transfer-Encoding: base64\n\n"
+        + attachment
+        + b"--BOUNDARY--\n"
+    )
+
+
+def generate_messages(
+    count: int, duplicates: float = 0.1, seed: int = 0, **kwargs: Any
+) -> List[bytes]:
+    """
+    duplicates is the fraction of messages which are a copy of an earlier
+    one (e.g. the same message in the inbox and a label/folder)
+    """
+    rand = random.Random(seed)
+    messages: List[bytes] = []
+    for i in range(count):
+        if messages and rand.random() < duplicates:
+            messages.append(rand.choice(messages))
+        else:
+            messages.append(generate_message(rand, i, **kwargs))
+    return messages
+
+
+def generate_maildir(path: Path, messages: Sequence[bytes], boxes: int = 4) -> None:
+    for i, msg in enumerate(messages):
+        d = path / f"box{i % boxes}" / "cur"
+        d.mkdir(parents=True, exist_ok=True)
+        (d / f"{1_500_000_000 + i}.{i}_1.host:2,S").write_bytes(msg)
+    for b in range(boxes):
+        for sub in ("new", "tmp"):
+            (path / f"box{b}" / sub).mkdir(parents=True, exist_ok=True)
+
+
+def generate_mbox(path: Path, messages: Sequence[bytes]) -> None:
+    with path.open("wb") as f:
+        for msg in messages:
+            f.write(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2015\n")
+            for line in msg.splitlines(keepends=True):
+                # mboxrd quoting
+                if line.lstrip(b">").startswith(b"From "):
+                    line = b">" + line
+                f.write(line)
+            f.write(b"\n")
+
+
+def _timeit(desc: str, func: Callable[[], Iterator[Any]], repeat: int = 3) -> float:
+    # best of a few runs, to reduce noise
+    took = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = sum(1 for _ in func())
+        took = min(took, time.perf_counter() - start)
+    click.echo(f"{desc:<20} {count:>10} entries {took:>8.3f}s")
+    return took
+
+
+@click.group()
+def main() -> None:
+    pass
+
+
+@main.command(short_help="benchmark parsing Date headers")
+@click.option("--entries", default=500, show_default=True)
+@click.option("--repeat", default=0.5, show_default=True, help="fraction of repeats")
+def dates(entries: int, repeat: float) -> None:
+    """
+    Compare dateparser (what Email.dt used to fall back to) to
+    my.mail.parse_date, on Date headers mailparser can't parse
+    """
+    import dateparser
+    from my.mail.parse_date import parse_mail_date, _parse_formats
+
+    headers = generate_dates(entries, repeat=repeat)
+    click.echo(f"{len(headers)} headers, {len(set(headers))} unique")
+
+    def _cached() -> Iterator[Any]:
+        parse_mail_date.cache_clear()
+        return map(parse_mail_date, headers)
+
+    slow = _timeit("dateparser", lambda: map(dateparser.parse, headers), repeat=1)
+    for desc, func in (
+        ("uncached", lambda: map(parse_mail_date.__wrapped__, headers)),
+        ("cached", _cached),
+    ):
+        took = _timeit(desc, func, repeat=1)
+        click.echo(f"{desc} is {slow / took:.2f}x faster")
+    took = _timeit("formats only", lambda: map(_parse_formats, headers))
+    matched = sum(_parse_formats(h) is not None for h in headers)
+    click.echo(f"{matched} of {len(headers)} matched a format, the rest use dateparser")
+    differ = [
+        h
+        for h in set(headers)
+        if dateparser.parse(h) is not None and dateparser.parse(h) != parse_mail_date(h)
+    ]
+    click.echo(
+        f"{len(differ)} headers parsed differently than dateparser: {differ[:5]}"
+    )
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in KB on linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(usage, children) * scale / 1e6
+
+
+class Stages:
+    """
+    times each stage, and reports messages/sec and the peak RSS so far. The peak
+    only goes up, so if a stage doesn't increase it, it used less than earlier stages
+    """
+
+    def __init__(self) -> None:
+        self.results: List[Dict[str, Any]] = []
+
+    def run(self, name: str, func: Callable[[], Iterator[Any]]) -> List[Any]:
+        start = time.perf_counter()
+        items = list(func())
+        took = time.perf_counter() - start
+        rss = _max_rss_mb()
+        rate = len(items) / took if took else float("inf")
+        click.echo(
+            f"{name:<28} {len(items):>8} items {took:>8.3f}s {rate:>10.0f}/s  peak RSS {rss:>7.1f}MB"
+        )
+        self.results.append({"stage": name, "items": len(items), "seconds": took})
+        return items
+
+
+def _configure(tmp: Path, maildir: Path, mbox_dir: Path, **config: Any) -> None:
+    """
+    points my.mail.imap/my.mail.mbox at the generated mail, and keeps their caches in tmp
+    """
+    from my.mail import imap, mbox, mbox_index
+
+    imap.mailboxes = lambda: [maildir]  # type: ignore[assignment]
+    mbox.mailboxes = lambda: [mbox_dir]  # type: ignore[assignment]
+    imap._index_path = lambda: tmp / "imap.sqlite"  # type: ignore[assignment]
+    mbox._index_path = lambda: tmp / "mbox.sqlite"  # type: ignore[assignment]
+    imap._snapshot_path = lambda: tmp / "dirs.json"  # type: ignore[assignment]
+    mbox_index._state_file = lambda p: tmp / "offsets" / p.name
+    for conf in (imap.config, mbox.config):
+        for k, v in config.items():
+            setattr(conf, k, v)
+
+
+@main.command(short_help="benchmark the mail pipeline")
+@click.option("--messages", default=2000, show_default=True)
+@click.option("--multipart", default=0.3, show_default=True)
+@click.option("--charset-mix", default=0.3, show_default=True)
+@click.option("--duplicates", default=0.1, show_default=True)
+@click.option("--broken-dates", default=0.05, show_default=True)
+@click.option("--attachment-size", default=50_000, show_default=True)
+@click.option("--workers", type=int, default=None, help="processes to parse with")
+@click.option(
+    "--backend",
+    type=click.Choice(["mailparser", "stdlib"]),
+    default="mailparser",
+    show_default=True,
+)
+@click.option("--seed", default=0, show_default=True)
+def pipeline(
+    messages: int,
+    multipart: float,
+    charset_mix: float,
+    duplicates: float,
+    broken_dates: float,
+    attachment_size: int,
+    workers: Optional[int],
+    backend: str,
+    seed: int,
+) -> None:
+    """
+    Generate a maildir and an mbox with the same messages, and time my.mail.imap,
+    my.mail.mbox (with and without the index), unique_mail, Email.dt and my.mail.all
+    """
+    msgs = generate_messages(
+        messages,
+        duplicates=duplicates,
+        seed=seed,
+        multipart=multipart,
+        charset_mix=charset_mix,
+        broken_dates=broken_dates,
+        attachment_size=attachment_size,
+    )
+    with tempfile.TemporaryDirectory() as td:
+        tmp = Path(td)
+        maildir, mbox_dir = tmp / "maildir", tmp / "mbox"
+        mbox_dir.mkdir()
+        generate_maildir(maildir, msgs)
+        generate_mbox(mbox_dir / "inbox.mbox", msgs)
+        size = sum(len(m) for m in msgs) / 1e6
+        click.echo(f"Generated {len(msgs)} messages ({size:.1f}MB) in {tmp}")
+
+        from my.mail import imap, mbox, all as mail_all
+        from my.mail.common import unique_mail
+        from my.mail.parse_date import parse_mail_date
+        from my.mail.stdlib_email import StdlibEmail
+
+        _configure(
+            tmp, maildir, mbox_dir, workers=workers, use_index=False, backend=backend
+        )
+        st = Stages()
+        st.run("imap: find files", lambda: imap.files())
+        parsed = st.run("imap: parse", imap.raw_mail)
+        st.run("mbox: parse", mbox.raw_mail)
+        st.run("unique_mail", lambda: unique_mail(iter(parsed)))
+
+        def _dts() -> Iterator[Any]:
+            parse_mail_date.cache_clear()
+            for m in parsed:
+                if isinstance(m, StdlibEmail):
+                    m._fields.pop("date", None)
+                else:
+                    m._dt, m._dateparser_failed = None, False
+                yield m.dt
+
+        st.run("Email.dt", _dts)
+        parsed.clear()
+
+        _configure(tmp, maildir, mbox_dir, use_index=True)
+        st.run("imap: build index", imap.raw_mail)
+        st.run("imap: from index", imap.raw_mail)
+        st.run("mbox: build index", mbox.raw_mail)
+        st.run("mbox: from index", mbox.raw_mail)
+        # appending to the mbox only parses the new messages
+        with (mbox_dir / "inbox.mbox").open("ab") as f:
+            f.write(b"From MAILER-DAEMON Thu Jan  1 00:00:00 2015\n" + msgs[0] + b"\n")
+        st.run("mbox: appended", mbox.raw_mail)
+        (tmp / "imap.sqlite").unlink()
+        (tmp / "mbox.sqlite").unlink()
+        st.run("all: build indexes", mail_all.mail)
+        st.run("all: from indexes", mail_all.mail)
+
+
+@main.command(short_help="compare the mailparser and stdlib backends")
+@click.option("--messages", default=2000, show_default=True)
+@click.option("--multipart", default=0.3, show_default=True)
+@click.option("--charset-mix", default=0.3, show_default=True)
+@click.option("--broken-dates", default=0.05, show_default=True)
+@click.option("--attachment-size", default=50_000, show_default=True)
+@click.option("--seed", default=0, show_default=True)
+def backends(
+    messages: int,
+    multipart: float,
+    charset_mix: float,
+    broken_dates: float,
+    attachment_size: int,
+    seed: int,
+) -> None:
+    """
+    Parse the same messages with Email (mailparser) and StdlibEmail, and time
+    parsing, accessing the fields used to dedup/describe a message, and
+    serializing everything (which is what the index saves)
+    """
+    from my.mail.common import Email
+    from my.mail.stdlib_email import StdlibEmail
+
+    msgs = generate_messages(
+        messages,
+        duplicates=0,
+        seed=seed,
+        multipart=multipart,
+        charset_mix=charset_mix,
+        broken_dates=broken_dates,
+        attachment_size=attachment_size,
+    )
+    name = Path("bench")
+    for cls in (Email, StdlibEmail):
+        click.echo(cls.__name__)
+        st = Stages()
+
+        def _parse() -> Iterator[Any]:
+            return (cls.safe_parse(b, display_filename=name) for b in msgs)  # type: ignore[attr-defined]
+
+        st.run("parse", _parse)
+        st.run(
+            "parse, headers",
+            lambda: ((m.subject, m.message_id, m.dt, m.description) for m in _parse()),
+        )
+        st.run(
+            "parse, text parts", lambda: (list(m.filtered_subparts()) for m in _parse())
+        )
+        st.run("parse, _serialize", lambda: (m._serialize() for m in _parse()))
+
+
+if __name__ == "__main__":
+    main()
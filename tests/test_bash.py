@@ -1,3 +1,7 @@
+from pathlib import Path
+
+import pytest
+
 from my.bash import _parse_file
 
 from .common import data
@@ -18,3 +22,39 @@ uname
     )
 
     assert history[3].command == "ls"
+
+
+def test_history_columns() -> None:
+    from my.bash import history, history_columns
+
+    def inputs():
+        yield data("bash/history")
+
+    cols = history_columns(from_paths=inputs)
+    assert [(epoch, command) for epoch, _, command in cols.rows()] == [
+        (int(e.dt.timestamp()), e.command) for e in history(from_paths=inputs)
+    ]
+
+
+def test_comments(tmp_path: Path) -> None:
+    from my.bash import _parse_file_rows
+
+    hist = tmp_path / "history"
+    hist.write_text(
+        "#1616723205\ncat <<EOF\n# comment\n#123abc\nEOF\n#1616723206\nls\n"
+    )
+    assert list(_parse_file_rows(hist)) == [
+        (1616723205, "cat <<EOF\n# comment\n#123abc\nEOF"),
+        (1616723206, "ls"),
+    ]
+
+
+def test_cache_disabled(monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.core.core_config import config
+    from my.utils.file_cache import file_cache_path
+
+    cache_path = file_cache_path("my.bash._parse_file_cached")
+    assert cache_path(data("bash/history")) is not None
+    # cache_dir = None disables caching, so cachew gets None
+    monkeypatch.setattr(config, "cache_dir", None)
+    assert cache_path(data("bash/history")) is None
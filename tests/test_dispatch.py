@@ -0,0 +1,96 @@
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+from my.utils.dispatch import PrefixDispatch
+
+HANDLERS: Dict[str, Optional[str]] = {
+    "messages/stickers_used": None,
+    "messages/": "conversation",
+    "photos_and_videos/album": "album",
+    "photos_and_videos/": None,
+    "friends/removed_": "removed",
+    "friends/sent_friend": None,
+    "friends/friends": "friends",
+    "ads": None,
+}
+
+
+def _linear(relpath: str) -> Optional[str]:
+    for prefix in HANDLERS:
+        if relpath.startswith(prefix):
+            return prefix
+    return None
+
+
+def test_lookup() -> None:
+    dispatch = PrefixDispatch(HANDLERS)
+    paths = [
+        "messages/stickers_used/a.json",
+        "messages/inbox/bob/message_1.json",
+        "messages",
+        "photos_and_videos/album/1.json",
+        "photos_and_videos/your_videos/a.mp4",
+        "friends/removed_friends.json",
+        "friends/friends.json",
+        "friends/received_friend_requests.json",
+        "ads_and_businesses/x.json",
+        "",
+    ]
+    for p in paths:
+        match = dispatch.lookup(p)
+        prefix = _linear(p)
+        if prefix is None:
+            assert match is None, p
+        else:
+            assert match == (prefix, HANDLERS[prefix]), p
+
+
+def test_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.utils import dispatch as dispatch_module
+
+    for p in (
+        "messages/stickers_used/a.json",
+        "messages/inbox/bob/message_1.json",
+        "photos_and_videos/album/1.json",
+        "photos_and_videos/your_videos/a.mp4",
+        "friends/removed_friends.json",
+        "friends/sent_friend_requests.json",
+        "ads_and_businesses/x/y.json",
+        "unknown.json",
+    ):
+        (tmp_path / p).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / p).write_text("{}")
+
+    dispatch = PrefixDispatch(HANDLERS)
+    assert dispatch.ignored_dir("photos_and_videos/your_videos")
+    assert not dispatch.ignored_dir("photos_and_videos")
+    assert not dispatch.ignored_dir("friends")
+    assert not dispatch.ignored_dir("unknown_dir")
+
+    listed: List[str] = []
+    walk = dispatch_module.walk
+
+    def _walk(top: str) -> Iterator[Tuple[str, List[str], List[str]]]:
+        for dirpath, dirs, files in walk(top):
+            listed.append(Path(dirpath).relative_to(tmp_path).as_posix())
+            yield dirpath, dirs, files
+
+    monkeypatch.setattr(dispatch_module, "walk", _walk)
+    assert sorted(
+        (f.relative_to(tmp_path).as_posix(), h) for f, h in dispatch.files(tmp_path)
+    ) == [
+        ("friends/removed_friends.json", "removed"),
+        ("messages/inbox/bob/message_1.json", "conversation"),
+        ("photos_and_videos/album/1.json", "album"),
+        ("unknown.json", None),
+    ]
+    # directories with only ignored files aren't listed
+    for d in (
+        "messages/stickers_used",
+        "photos_and_videos/your_videos",
+        "ads_and_businesses",
+    ):
+        assert d not in listed
+    assert "photos_and_videos/album" in listed
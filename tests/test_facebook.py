@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+
+import pytest
+
+
+def test_events(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.facebook import gdpr
+
+    def write(name: str, data: object) -> None:
+        p = tmp_path / name
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(json.dumps(data))
+
+    write(
+        "friends/friends.json", {"friends": [{"name": "Bob", "timestamp": 1600000000}]}
+    )
+    write(
+        "friends/removed_friends.json",
+        {"deleted_friends": [{"name": "Carol", "timestamp": 1600000001}]},
+    )
+    # explicitly ignored
+    write("friends/sent_friend_requests.json", {})
+    write("photos_and_videos/your_videos/a.json", {})
+    write("unknown/file.json", {})
+    # files at the top of the export are skipped, even if they match a prefix
+    write("index.html", {})
+    write("search_history.json", {})
+
+    monkeypatch.setattr(gdpr.config, "gdpr_dir", str(tmp_path))
+    events = list(gdpr.events())
+    friends = [e for e in events if isinstance(e, gdpr.Friend)]
+    assert sorted((f.name, f.added) for f in friends) == [
+        ("Bob", True),
+        ("Carol", False),
+    ]
+    errors = [e for e in events if isinstance(e, Exception)]
+    assert len(errors) == 1
+    assert "unknown/file.json" in str(errors[0])
@@ -0,0 +1,612 @@
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from my.core.serialize import dumps
+from my.mail.common import Email, declared_charset
+from my.mail.index import indexed_mail, IndexedEmail, ParsedEmail
+from my.utils.parallel import map_ordered
+
+from .common import data
+
+
+@pytest.fixture(autouse=True)
+def mbox_index_in_tmp(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import mbox, mbox_index
+
+    monkeypatch.setattr(
+        mbox_index, "_state_file", lambda p: tmp_path / "mbox_offsets" / p.name
+    )
+    # tests which parse mbox files use the index explicitly
+    monkeypatch.setattr(mbox.config, "use_index", False)
+
+
+def _indexed_dumps(m: Any) -> str:
+    """
+    dumps, without attachment payloads, which the index doesn't save
+    """
+    fields = m._serialize()
+    fields["attachments"] = [
+        {k: v for k, v in a.items() if k != "payload"} for a in fields["attachments"]
+    ]
+    return dumps(fields)
+
+
+def _mail_files() -> List[Path]:
+    return sorted(p for p in data("mail/imap").rglob("*") if p.is_file())
+
+
+def test_index(tmp_path: Path) -> None:
+    index = tmp_path / "index.sqlite"
+    first = [Email.safe_parse_path(p) for p in _mail_files()]
+    assert list(map(dumps, indexed_mail(_mail_files(), index))) == list(
+        map(dumps, first)
+    )
+
+    # nothing changed, so everything is loaded from the index
+    second = list(indexed_mail(_mail_files(), index))
+    assert all(isinstance(m, IndexedEmail) for m in second)
+    for a, b in zip(first, second):
+        assert a is not None
+        assert dumps(a) == dumps(b)
+        # the attachments (with their payloads) are parsed from the file
+        assert a.attachments == b.attachments
+        assert (a.dt, a.subject_json, a.message_id_json) == (
+            b.dt,
+            b.subject_json,
+            b.message_id_json,
+        )
+    # anything else is parsed from the file
+    parsed = first[1]
+    assert parsed is not None
+    assert [p.content_type for p in second[1].subparts] == [
+        p.content_type for p in parsed.subparts
+    ]
+
+    # the index doesn't save attachment payloads, these leave them out
+    lite = indexed_mail(_mail_files(), index, attachment_payloads=False)
+    assert list(map(dumps, lite)) == list(map(_indexed_dumps, first))
+
+    # parsed with some other config, so everything is parsed again
+    parsed_paths: List[Path] = []
+
+    def _parse(path: Path) -> Optional[Email]:
+        parsed_paths.append(path)
+        return Email.safe_parse_path(path)
+
+    for _ in range(2):
+        list(indexed_mail(_mail_files(), index, parse=_parse, parser="other"))
+    assert parsed_paths == _mail_files()
+
+    # a changed file is parsed again
+    changed = tmp_path / "changed"
+    changed.write_bytes(_mail_files()[0].read_bytes())
+    third = list(indexed_mail([changed, *_mail_files()[1:]], index))
+    assert third[0].filepath == changed
+
+
+def test_header_only(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail.common import LazyEmail
+    from my.mail.mbox import _iter_mailbox, config as mbox_config
+
+    for path in _mail_files():
+        full = Email.safe_parse_path(path)
+        lazy = Email.safe_parse_path(path, header_only=True)
+        assert isinstance(lazy, LazyEmail) and full is not None
+        assert lazy._load is not None
+        assert (lazy.subject, lazy.from_, lazy.to, lazy.dt) == (
+            full.subject,
+            full.from_,
+            full.to,
+            full.dt,
+        )
+        # accessing the body parses the rest of the message
+        assert dumps(lazy) == dumps(full)
+        assert lazy._load is None
+
+    # a Date which isn't RFC 2822, and the headers, don't need the body either
+    from datetime import datetime
+
+    nonrfc = tmp_path / "nonrfc"
+    nonrfc.write_bytes(b"Subject: x\nDate: Tuesday, August 1, 2023 8:00 AM\n\nbody\n")
+    lazy = Email.safe_parse_path(nonrfc, header_only=True)
+    assert isinstance(lazy, LazyEmail)
+    assert lazy.date is None and lazy.dt == datetime(2023, 8, 1, 8)
+    assert lazy.headers["Subject"] == "x"
+
+    def loaded(e: LazyEmail) -> bool:
+        return e._load is None
+
+    assert not loaded(lazy)
+    assert lazy.body == "body\n" and loaded(lazy)
+
+    mbox = data("mail/mbox/inbox.mbox")
+    full_mbox = list(_iter_mailbox(mbox))
+    monkeypatch.setattr(mbox_config, "header_only", True)
+    lazy_mbox = list(_iter_mailbox(mbox))
+    assert len(full_mbox) == len(lazy_mbox) == 2
+    assert all(isinstance(m, LazyEmail) for m in lazy_mbox)
+    assert [dumps(m) for m in full_mbox] == [dumps(m) for m in lazy_mbox]
+
+
+def test_parallel(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import index, mbox
+
+    monkeypatch.setattr(index, "MIN_PARALLEL", 1)
+    monkeypatch.setattr(mbox, "MIN_PARALLEL", 1)
+
+    serial = list(indexed_mail(_mail_files(), tmp_path / "serial.sqlite", workers=0))
+    parallel = list(
+        indexed_mail(_mail_files(), tmp_path / "parallel.sqlite", workers=2)
+    )
+    assert list(map(_indexed_dumps, serial)) == list(map(_indexed_dumps, parallel))
+    # only a few chunks are submitted at a time, and results stay in order
+    assert list(map_ordered(str, range(20), workers=2, max_pending=2)) == [
+        str(i) for i in range(20)
+    ]
+
+    file = data("mail/mbox/inbox.mbox")
+    serial_mbox = list(mbox._iter_mailbox(file))
+    monkeypatch.setattr(mbox.config, "workers", 2)
+    parallel_mbox = list(mbox._iter_mailbox(file))
+    assert all(isinstance(m, IndexedEmail) for m in parallel_mbox)
+    assert list(map(_indexed_dumps, serial_mbox)) == list(
+        map(_indexed_dumps, parallel_mbox)
+    )
+    # accessing other attributes parses that message from the mbox again
+    assert isinstance(parallel_mbox[1], IndexedEmail)
+    email = parallel_mbox[1].email
+    assert email is not None
+    assert email.message_id == serial_mbox[1].message_id
+
+
+def test_mbox_offsets(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import mailbox
+    from my.mail import mbox_index
+
+    monkeypatch.setattr(mbox_index, "_state_file", lambda p: tmp_path / "state.json")
+
+    def _expected(path: Path) -> List[bytes]:
+        mb = mailbox.mbox(str(path), create=False)
+        try:
+            return [mb.get_bytes(k) for k in mb.keys()]
+        finally:
+            mb.close()
+
+    def _indexed(path: Path) -> List[bytes]:
+        buf = path.read_bytes()
+        return [
+            mbox_index.message_bytes(buf, r) for r in mbox_index.message_ranges(path)
+        ]
+
+    file = tmp_path / "inbox.mbox"
+    msgs = [
+        b"From a\nSubject: 1\n\nbody\n\n",
+        # no blank line before the next message, and lines starting with From in the
+        # body (which is treated as the start of another message, like mailbox.mbox)
+        b"From b\nSubject: 2\n\nFrom here\n>From there\n",
+        b"From c\nSubject: 3\n\n\n\n",
+    ]
+    file.write_bytes(b"junk before the first message\n" + b"".join(msgs[:2]))
+    assert _indexed(file) == _expected(file)
+    saved = (tmp_path / "state.json").read_text()
+    # unchanged, uses the saved index
+    assert _indexed(file) == _expected(file)
+    assert (tmp_path / "state.json").read_text() == saved
+
+    # appended to, only scans from the last message
+    last = mbox_index.message_ranges(file)[-1][0]
+    with file.open("ab") as f:
+        f.write(msgs[2])
+    scanned: List[int] = []
+    scan = mbox_index.scan_starts
+
+    def _scan_starts(buf: mbox_index.Buffer, start: int = 0) -> List[int]:
+        scanned.append(start)
+        return scan(buf, start)
+
+    monkeypatch.setattr(mbox_index, "scan_starts", _scan_starts)
+    assert _indexed(file) == _expected(file)
+    assert scanned == [last]
+    assert [b for _, b in mbox_index.iter_messages(file)] == _expected(file)
+
+    # rewritten, scans everything again
+    file.write_bytes(msgs[2] + msgs[0])
+    assert _indexed(file) == _expected(file)
+    assert scanned[-1] == 0
+
+    # with caching disabled, scans everything each time
+    monkeypatch.setattr(mbox_index, "_state_file", lambda p: None)
+    scanned.clear()
+    for _ in range(2):
+        assert _indexed(file) == _expected(file)
+    assert scanned == [0, 0]
+
+
+def test_incremental_mbox(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import mbox
+
+    monkeypatch.setattr(mbox, "_index_path", lambda: tmp_path / "index.sqlite")
+    # otherwise serializing parses messages with attachments again
+    monkeypatch.setattr(mbox.config, "attachment_payloads", False)
+    parsed: List[Tuple[int, int]] = []
+    parse_range = mbox._parse_range
+
+    def _parse_range(file: Path, r: Tuple[int, int]) -> Optional[ParsedEmail]:
+        parsed.append(r)
+        return parse_range(file, r)
+
+    monkeypatch.setattr(mbox, "_parse_range", _parse_range)
+
+    def _parse(file: Path, use_index: bool) -> List[str]:
+        parsed.clear()
+        monkeypatch.setattr(mbox.config, "use_index", use_index)
+        return [_indexed_dumps(m) for m in mbox._iter_mailbox(file)]
+
+    file = tmp_path / "inbox.mbox"
+    messages = data("mail/mbox/inbox.mbox").read_bytes()
+    file.write_bytes(messages)
+    expected = _parse(file, use_index=False)
+    assert _parse(file, use_index=True) == expected
+    assert len(parsed) == 2
+    # only the last message is parsed again, in case it was appended to
+    assert _parse(file, use_index=True) == expected
+    assert len(parsed) == 1
+
+    # new messages
+    with file.open("ab") as f:
+        f.write(messages)
+    expected = _parse(file, use_index=False)
+    assert len(expected) == 4
+    assert _parse(file, use_index=True) == expected
+    assert len(parsed) == 3
+
+    # compacted, so everything is parsed again
+    file.write_bytes(messages[messages.index(b"From ", 1) :])
+    expected = _parse(file, use_index=False)
+    assert len(expected) == 1
+    assert _parse(file, use_index=True) == expected
+    assert len(parsed) == 1
+
+    # with caching disabled, this doesn't use the index
+    monkeypatch.setattr(mbox, "_index_path", lambda: None)
+    assert _parse(file, use_index=True) == expected
+    assert parsed == []
+
+
+def test_unique_mail() -> None:
+    from datetime import datetime, timedelta, timezone
+    from my.mail.common import unique_mail
+
+    emails = [m for m in map(Email.safe_parse_path, _mail_files()) if m is not None]
+    assert len(list(unique_mail(iter(emails * 3)))) == 2
+    # once the keys are moved to a temporary database, still removes duplicates
+    assert list(unique_mail(iter(emails * 3), max_in_memory=1)) == emails
+
+    from my.mail.dedup import mail_key
+
+    dt = datetime(2023, 8, 1, 12, tzinfo=timezone.utc)
+    # the same time in a different timezone is the same message
+    assert mail_key("s", "id", dt) == mail_key(
+        "s", "id", dt.astimezone(timezone(timedelta(hours=2)))
+    )
+    assert mail_key("s", "id", dt) != mail_key("s", "id", dt.replace(tzinfo=None))
+    assert mail_key("s", "id", None) != mail_key("s", "", None)
+
+
+def test_header_key() -> None:
+    from my.mail.dedup import header_key
+
+    headers = b"Subject: a\n folded\nMessage-ID: <x>\n"
+    key = header_key(headers)
+    assert key is not None
+    # only the header block is used, with either line ending
+    assert header_key(headers + b"\nSubject: b\n\nDate: c\n") == key
+    crlf = headers.replace(b"\n", b"\r\n")
+    assert header_key(crlf + b"\r\nSubject: b\r\n") == header_key(crlf) == key
+    assert header_key(b"\nSubject: a\n") is None
+
+
+def test_header_precheck(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import mbox
+    from my.mail.common import unique_mail
+    from my.mail.dedup import HeaderPrecheck
+
+    monkeypatch.setattr(mbox, "_index_path", lambda: tmp_path / "mbox.sqlite")
+    monkeypatch.setattr(mbox.config, "use_index", True)
+    parsed: List[Path] = []
+
+    def _parse(path: Path) -> Optional[Email]:
+        parsed.append(path)
+        return Email.safe_parse_path(path)
+
+    file = data("mail/mbox/inbox.mbox")
+    index = tmp_path / "imap.sqlite"
+    expected = [dumps(m) for m in unique_mail(mbox._iter_mailbox(file))]
+
+    # the same messages are in the mbox, so the imap files aren't parsed
+    precheck = HeaderPrecheck()
+    from_mbox = list(mbox._iter_mailbox(file, precheck))
+    assert (
+        list(indexed_mail(_mail_files(), index, parse=_parse, precheck=precheck)) == []
+    )
+    assert parsed == [] and precheck.skipped == 2
+    assert [dumps(m) for m in unique_mail(iter(from_mbox))] == expected
+
+    # the messages in the mbox are loaded from the index, and still count as seen
+    precheck = HeaderPrecheck()
+    assert len(list(mbox._iter_mailbox(file, precheck))) == 2
+    assert (
+        list(indexed_mail(_mail_files(), index, parse=_parse, precheck=precheck)) == []
+    )
+    assert parsed == []
+
+    # skipped messages are parsed if we didn't see a copy first
+    precheck = HeaderPrecheck()
+    assert (
+        len(list(indexed_mail(_mail_files(), index, parse=_parse, precheck=precheck)))
+        == 2
+    )
+    monkeypatch.setattr(mbox, "_index_path", lambda: tmp_path / "mbox2.sqlite")
+    assert list(mbox._iter_mailbox(file, precheck)) == []
+    assert [dumps(m) for m in mbox._iter_mailbox(file)] == expected
+
+
+def test_declared_charsets() -> None:
+    headers = "From: Jos\xe9 <j@x.com>\nSubject: caf\xe9\nMessage-ID: <1@x>\n"
+    latin1 = (
+        headers
+        + "Content-Type: text/plain; charset=iso-8859-1\nContent-Transfer-Encoding: 8bit\n\nol\xe9\n"
+    ).encode("latin-1")
+    m = Email.safe_parse(latin1, display_filename=Path("latin1"))
+    assert m is not None
+    assert (m.subject, m.from_, m.body) == (
+        "caf\xe9",
+        [("Jos\xe9", "j@x.com")],
+        "ol\xe9\n",
+    )
+
+    # each part is decoded with its own charset
+    mixed = (
+        b"Subject: mixed\nMIME-Version: 1.0\nContent-Type: multipart/mixed; boundary=XX\n\n"
+        b"--XX\nContent-Type: text/plain; charset=utf-8\nContent-Transfer-Encoding: 8bit\n\n"
+        + "日本\n".encode("utf-8")
+        + b"--XX\nContent-Type: text/plain; charset=windows-1252\nContent-Transfer-Encoding: 8bit\n\n"
+        + "“quoted”\n".encode("cp1252")
+        + b"--XX--\n"
+    )
+    m = Email.safe_parse(mixed, display_filename=Path("mixed"))
+    assert m is not None
+    assert [p.payload for p in m.subparts] == ["日本", "“quoted”"]
+
+    # charset on a folded line
+    folded = (
+        "Subject: Привет\nContent-Type: text/plain;\n\tcharset=koi8-r\n\nтекст\n"
+    ).encode("koi8-r")
+    assert declared_charset(folded) == "koi8-r"
+    m = Email.safe_parse(folded, display_filename=Path("folded"))
+    assert m is not None
+    assert (m.subject, m.body) == ("Привет", "текст\n")
+    # but not from another header
+    assert (
+        declared_charset(b"Content-Type: text/plain\nX-Note: charset=koi8-r\n") is None
+    )
+
+
+def test_parse_mail_date() -> None:
+    from datetime import datetime, timedelta, timezone
+    from my.mail.parse_date import parse_mail_date, _parse_formats
+
+    cest = timezone(timedelta(hours=2))
+    for header, expected in (
+        ("Tue, 1 Aug 2023 08:00:00 GMT+0200", datetime(2023, 8, 1, 8, tzinfo=cest)),
+        ("Tue, 1 Aug 2023 08.00.00 CEST", datetime(2023, 8, 1, 8, tzinfo=cest)),
+        ("2023-08-01T08:00:00Z", datetime(2023, 8, 1, 8, tzinfo=timezone.utc)),
+        ("Tuesday, August 1, 2023 8:00 PM", datetime(2023, 8, 1, 20)),
+        ("Tue Aug  1 08:00:00 2023", datetime(2023, 8, 1, 8)),
+        # falls back to dateparser
+        ("Tue, 1 Aug 2023 08:00:00 IST", datetime(2023, 8, 1, 8, tzinfo=cest)),
+        ("not a date", None),
+    ):
+        assert parse_mail_date(header) == expected, header
+    # only actual month names, anything else goes to dateparser
+    assert _parse_formats("Sept 1, 2023 8:00 AM") == datetime(2023, 9, 1, 8)
+    assert _parse_formats("Marcha 1, 2023 8:00 AM") is None
+
+    m = Email.safe_parse(
+        b"Subject: x\nDate: 08/01/2023 08:00:00\n\nbody\n", display_filename=Path("x")
+    )
+    assert m is not None and m.date is None
+    assert m.dt == datetime(2023, 8, 1, 8)
+
+
+def test_filtered_subparts(tmp_path: Path) -> None:
+    from my.mail.parse_parts import tag_message_subparts
+
+    first, second = [Email.safe_parse_path(p) for p in _mail_files()]
+    assert first is not None and second is not None
+    # each part is only returned once
+    assert [t for _, t in tag_message_subparts(first.message)] == [
+        "text",
+        "application/pdf",
+    ]
+    assert [(p.content_type, p.payload) for p in first.filtered_subparts()] == [
+        ("text", "hi there")
+    ]
+    assert [p.payload for p in first.filtered_subparts({"application"})] == [b"hello"]
+    # decoded from quoted-printable, with the parts charset
+    assert [
+        (p.content_type, p.payload.strip()) for p in second.filtered_subparts()
+    ] == [("text", "caf\xe9"), ("html", "<p>caf&eacute;</p>")]
+
+    # from the index, this doesn't parse the whole Email
+    indexed = list(indexed_mail(_mail_files(), tmp_path / "index.sqlite"))
+    assert isinstance(indexed[1], IndexedEmail)
+    assert [p.payload for p in indexed[1].filtered_subparts()] == [
+        p.payload for p in second.filtered_subparts()
+    ]
+    assert indexed[1]._email is None
+
+
+def test_maildir_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    import os
+    from my.mail import imap
+
+    box = tmp_path / "mail"
+    for d in ("cur", "new", "tmp", ".Sent/cur", ".Sent/tmp", ".notmuch/xapian"):
+        (box / d).mkdir(parents=True)
+    for f in (
+        "cur/1",
+        "new/2",
+        "tmp/3",
+        ".Sent/cur/4",
+        ".Sent/tmp/5",
+        ".notmuch/xapian/6",
+    ):
+        (box / f).write_text("")
+    (box / ".mbsyncstate").write_text("")
+    monkeypatch.setattr(imap, "mailboxes", lambda: [box])
+    monkeypatch.setattr(imap, "_snapshot_path", lambda: tmp_path / "dirs.json")
+
+    def _old(d: Path) -> None:
+        # so the listing isn't too recent to be trusted
+        os.utime(d, ns=(10**18, 10**18 + len(list(d.iterdir()))))
+
+    for path in [box, *box.rglob("*")]:
+        if path.is_dir():
+            _old(path)
+    expected = [box / "cur/1", box / "new/2", box / ".Sent/cur/4"]
+    assert sorted(imap._files()) == sorted(expected)
+
+    # unchanged directories aren't listed again
+    scanned: List[str] = []
+    from my.utils import walk
+
+    scan = walk._scan
+
+    def _scan(path: str) -> Tuple[List[str], List[str]]:
+        scanned.append(path)
+        return scan(path)
+
+    monkeypatch.setattr(walk, "_scan", _scan)
+    assert sorted(imap._files()) == sorted(expected)
+    assert scanned == []
+    (box / "new/7").write_text("")
+    _old(box / "new")
+    assert sorted(imap._files()) == sorted(expected + [box / "new/7"])
+    assert scanned == [str(box / "new")]
+
+    # with caching disabled, every directory is listed each time
+    monkeypatch.setattr(imap, "_snapshot_path", lambda: None)
+    scanned.clear()
+    assert sorted(imap._files()) == sorted(expected + [box / "new/7"])
+    assert len(scanned) > 1
+
+
+def test_search(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import mbox
+    from my.mail.search import update_index, search
+
+    index = tmp_path / "search.sqlite"
+    files = [m for m in map(Email.safe_parse_path, _mail_files()) if m is not None]
+    assert update_index(files[:1], index_path=index, remove_missing=False) == 1
+    assert update_index(files, index_path=index) == 1
+    assert update_index(files, index_path=index) == 0
+
+    def _subjects(query: str) -> List[str]:
+        return [m.subject for m in search(query, index_path=index)]
+
+    subjects = [m.subject for m in files]
+    assert _subjects("hi") == subjects[:1]
+    # accents are removed, and matches the body
+    assert _subjects("cafe") == subjects[1:]
+    assert _subjects("nothing") == []
+
+    # the default index is in the cache directory, so needs caching enabled
+    from my.mail import search as search_module
+
+    monkeypatch.setattr(search_module, "cache_file", lambda name: None)
+    with pytest.raises(ValueError):
+        list(search("hi"))
+
+    # messages from an mbox are found by their offset in the file
+    monkeypatch.setattr(mbox, "_index_path", lambda: tmp_path / "mbox.sqlite")
+    monkeypatch.setattr(mbox.config, "use_index", True)
+    file = data("mail/mbox/inbox.mbox")
+    assert update_index(mbox._iter_mailbox(file), index_path=index) == 0
+    assert [(m.filepath, m.subject) for m in search("cafe", index_path=index)] == [
+        (file, subjects[1])
+    ]
+
+
+def test_stdlib_backend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail.stdlib_email import StdlibEmail
+    from my.mail.mbox import _iter_mailbox, config as mbox_config
+
+    for path in _mail_files():
+        full = Email.safe_parse_path(path)
+        lite = StdlibEmail.safe_parse_path(path)
+        assert full is not None and lite is not None
+        assert (lite.subject, lite.from_, lite.to, lite.dt) == (
+            full.subject,
+            full.from_,
+            full.to,
+            full.dt,
+        )
+        # only the headers are parsed till the body is accessed
+        assert lite._message is None
+        assert dumps(lite) == dumps(full)
+        assert lite._buf is None
+        assert [(p.content_type, p.payload) for p in lite.subparts] == [
+            (p.content_type, p.payload) for p in full.subparts
+        ]
+
+    # messages from the index are parsed again with the parser that indexed them
+    index = tmp_path / "index.sqlite"
+    for _ in range(2):
+        indexed = list(
+            indexed_mail(_mail_files(), index, parse=StdlibEmail.safe_parse_path)
+        )
+        assert [type(m.email).__name__ for m in indexed] == ["StdlibEmail"] * 2
+
+    mbox = data("mail/mbox/inbox.mbox")
+    full_mbox = list(_iter_mailbox(mbox))
+    monkeypatch.setattr(mbox_config, "backend", "stdlib")
+    lite_mbox = list(_iter_mailbox(mbox))
+    assert all(isinstance(m, StdlibEmail) for m in lite_mbox)
+    assert [dumps(m) for m in full_mbox] == [dumps(m) for m in lite_mbox]
+
+    monkeypatch.setattr(mbox_config, "backend", "other")
+    with pytest.raises(ValueError):
+        list(_iter_mailbox(mbox))
+
+
+def test_folded_subject(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.mail import imap
+    from my.mail.common import unique_mail
+    from my.mail.search import update_index, search
+
+    headers = "Subject: a very\n long subject\nMessage-ID: <folded@x>\nDate: Tue, 1 Aug 2023 10:00:00 +0200\n"
+    lf = tmp_path / "lf"
+    lf.write_bytes(f"{headers}\nbody\n".encode())
+    crlf = tmp_path / "crlf"
+    crlf.write_bytes(f"{headers}\nbody\n".replace("\n", "\r\n").encode())
+
+    parsed: List[Any] = []
+    for backend in ("mailparser", "stdlib"):
+        monkeypatch.setattr(imap.config, "backend", backend)
+        for path in (lf, crlf):
+            m = imap._parse(path)
+            assert m is not None
+            parsed.append(m)
+    # both backends keep the folding, like mailparser
+    assert [m.subject for m in parsed[::2]] == ["a very\n long subject"] * 2
+    # but its the same message, however it was folded or parsed
+    assert len(list(unique_mail(iter(parsed)))) == 1
+
+    # search parses hits with the configured backend, and finds them
+    index = tmp_path / "search.sqlite"
+    assert update_index(parsed[2:3], index_path=index) == 1
+    hits = list(search("long", index_path=index))
+    assert [type(m).__name__ for m in hits] == ["StdlibEmail"]
@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from my.utils.merge import merge_unique
+
+
+def _dt(day: int) -> datetime:
+    return datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(days=day)
+
+
+def test_merge_unique() -> None:
+    Item = Tuple[datetime, str]
+    # two snapshots of the same history, and one from another computer
+    history: List[Item] = [(_dt(d), f"cmd {d}") for d in range(100)]
+    # an old shell which wrote its history when it exited
+    history.insert(50, (_dt(5), "written late"))
+    other: List[Item] = [(_dt(d), "other") for d in range(0, 100, 10)]
+
+    merged = list(
+        merge_unique(
+            history[:70],
+            history,
+            other,
+            key=lambda x: x,
+            dt=lambda x: x[0],
+            window=timedelta(days=7),
+        )
+    )
+    assert len(merged) == len(set(history) | set(other))
+    assert len(set(merged)) == len(merged)
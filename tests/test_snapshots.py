@@ -0,0 +1,51 @@
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from my.utils.snapshots import remove_prefix_snapshots
+
+
+def test_remove_prefix_snapshots(tmp_path: Path) -> None:
+    lines = [f": 16000000{i:02d}:0;echo {i}\n".encode() for i in range(50)]
+
+    def write(name: str, data: bytes) -> Path:
+        p = tmp_path / name
+        p.write_bytes(data)
+        return p
+
+    day1 = write("day1", b"".join(lines[:10]))
+    day2 = write("day2", b"".join(lines[:30]))
+    day2_copy = write("day2_copy", b"".join(lines[:30]))
+    day3 = write("day3", b"".join(lines))
+    # cut off in the middle of a line, should be kept
+    partial = write("partial", b"".join(lines)[:-3])
+    # another computer, shares no history
+    other = write("other", b"".join(lines[::-1]))
+
+    kept = remove_prefix_snapshots([day1, day2, day2_copy, day3, partial, other])
+    assert kept == [day3, partial, other]
+
+
+def test_head_digests_memoized(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    from my.utils import snapshots
+
+    lines = [f": 16000{i:05d}:0;echo {i}\n".encode() for i in range(2000)]
+    # unrelated histories larger than HEAD, so each is compared to every kept file
+    ps = []
+    for i in range(5):
+        p = tmp_path / f"computer{i}"
+        p.write_bytes(f"# {i}\n".encode() + b"".join(lines))
+        ps.append(p)
+
+    calls: List[Tuple[Path, int]] = []
+    head_digest = snapshots._head_digest
+
+    def _head_digest(p: Path, size: int) -> bytes:
+        calls.append((p, size))
+        return head_digest(p, size)
+
+    monkeypatch.setattr(snapshots, "_head_digest", _head_digest)
+    assert sorted(remove_prefix_snapshots(ps)) == ps
+    # once for each file, and the HEAD of each kept file is only hashed once
+    assert len(calls) == len(set(calls)) == 2 * len(ps) - 1
@@ -1,6 +1,9 @@
 from pathlib import Path
+from typing import Iterator, List, Tuple
 
-from my.zsh import history, Entry
+import pytest
+
+from my.zsh import history, Entry, Row
 
 from .common import data
 
@@ -49,3 +52,149 @@ def test_overlap() -> None:
 
     items = list(history(from_paths=zsh_multiple_tests))
     assert len(items) == 11
+
+
+def test_live_file_checkpoint(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    make sure parsing the live file incrementally matches parsing the whole file
+    """
+    import my.zsh as zsh
+
+    monkeypatch.setattr(zsh, "_live_state_file", lambda: tmp_path / "state.json")
+    live = tmp_path / "zsh_history"
+    lines = history_file.read_bytes().splitlines(keepends=True)
+    live.write_bytes(b"".join(lines[:10]))
+    assert list(zsh._live_history(live)) == list(zsh._parse_file(live))
+
+    # append to the file, should only parse the new lines
+    with live.open("ab") as f:
+        f.write(b"".join(lines[10:]))
+    offsets: List[int] = []
+    parse_row_offsets = zsh._parse_row_offsets
+
+    def _parse_row_offsets(lf: Path, offset: int = 0) -> Iterator[Tuple[int, Row]]:
+        offsets.append(offset)
+        return parse_row_offsets(lf, offset)
+
+    monkeypatch.setattr(zsh, "_parse_row_offsets", _parse_row_offsets)
+    assert list(zsh._live_history(live)) == list(zsh._parse_file(live))
+    assert list(zsh._live_history(live)) == list(zsh._parse_file(live))
+    # the entries before the last one are loaded from the cached columns
+    assert len(offsets) == 2 and 0 < offsets[0] < offsets[1]
+
+    # rewrite the start of the file, should notice and parse everything again
+    live.write_bytes(b": 1594693000:0;echo rewritten\n" + b"".join(lines[:3]))
+    items = list(zsh._live_history(live))
+    assert items[0].command == "echo rewritten"
+    assert items == list(zsh._parse_file(live))
+
+    # caching disabled, nothing is saved
+    monkeypatch.setattr(zsh, "_live_state_file", lambda: None)
+    assert list(zsh._live_history(live)) == list(zsh._parse_file(live))
+
+
+def test_fast_parser(tmp_path: Path) -> None:
+    """
+    the bytes parser should produce the same entries as the line parser
+    """
+    from my.zsh import _parse_bytes, _parse_lines, _iter_lines
+
+    weird = tmp_path / "weird_history"
+    weird.write_bytes(
+        b"junk before the first entry\n"
+        + b": 1594693071:0;ls\n"
+        + b": 1594693072:1;echo one\\\n"
+        + b"\n"
+        + b"two\\\n"
+        + b"  three\n"
+        + b": 1594693073:0;\n"
+        + b": 1594693074:0;caf\xe9\n"
+        + b": 1594693075:3;multi\\\n"
+        + b"no trailing newline"
+    )
+    empty_last = tmp_path / "empty_last"
+    empty_last.write_bytes(b": 1594693071:0;ls\n: 1594693072:0;\n")
+    carriage = tmp_path / "carriage"
+    carriage.write_bytes(b": 1594693071:0;ls\r\n: 1594693072:0;echo\rx\n")
+
+    for f in (history_file, overlap_file, weird, empty_last, carriage):
+        assert list(_parse_bytes(f)) == list(_parse_lines(_iter_lines(f)))
+
+
+def test_history_columns() -> None:
+    from my.zsh import history_columns
+
+    def zsh_multiple_tests():
+        yield Path(history_file)
+        yield Path(overlap_file)
+
+    cols = history_columns(from_paths=zsh_multiple_tests)
+    items = list(history(from_paths=zsh_multiple_tests))
+    assert len(cols) == len(items)
+    assert len(cols.commands) < len(cols)
+    assert list(cols.rows()) == [
+        (int(e.dt.timestamp()), e.duration, e.command) for e in items
+    ]
+
+
+def test_history_columns_live_file(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    import my.zsh as zsh
+    from my.core.core_config import config as core_config
+
+    live = tmp_path / "zsh_history"
+    live.write_bytes(history_file.read_bytes())
+    monkeypatch.setattr(core_config, "cache_dir", tmp_path / "cache")
+    monkeypatch.setattr(zsh.config, "export_path", str(overlap_file))
+    monkeypatch.setattr(zsh, "_live_file", lambda: live)
+    items = list(zsh.history())
+    # the live file is parsed once, then loaded from the checkpoint
+    offsets: List[Tuple[Path, int]] = []
+    parse_row_offsets = zsh._parse_row_offsets
+
+    def _parse_row_offsets(lf: Path, offset: int = 0) -> Iterator[Tuple[int, Row]]:
+        offsets.append((lf, offset))
+        return parse_row_offsets(lf, offset)
+
+    monkeypatch.setattr(zsh, "_parse_row_offsets", _parse_row_offsets)
+    cols = zsh.history_columns()
+    assert list(cols.rows()) == [(e.epoch, e.duration, e.command) for e in items]
+    live_offsets = [o for p, o in offsets if p == live]
+    assert len(live_offsets) == 1 and live_offsets[0] > 0
+
+
+def test_entry_like_namedtuple() -> None:
+    import pickle
+    from typing import NamedTuple
+    from datetime import datetime
+
+    from my.core.serialize import dumps
+    from my.utils.time import parse_datetime_sec
+
+    class Expected(NamedTuple):
+        dt: datetime
+        duration: int
+        command: str
+
+    e = Entry(1594693071, 5, "ls")
+    expected = Expected(parse_datetime_sec(1594693071), 5, "ls")
+    assert tuple(e) == tuple(expected)
+    assert e[2] == "ls" and len(e) == 3
+    assert e == Entry(expected.dt, 5, "ls")
+    # compares and sorts like the tuple would
+    assert e == expected
+    later = Entry(1594693072, 1, "cd")
+    assert sorted([later, e]) == [e, later]
+    assert e < later and later > expected and e <= expected
+    # without creating the datetimes
+    lazy = [Entry(1594693072, 1, "cd"), Entry(1594693071, 5, "ls")]
+    assert sorted(lazy) == lazy[::-1] and len(set(lazy + lazy)) == 2
+    assert all(x._dt is None for x in lazy)
+    # pickling keeps the datetime, if it was created
+    assert pickle.loads(pickle.dumps(e))._dt == expected.dt
+    assert pickle.loads(pickle.dumps(lazy[0]))._dt is None
+    # but it isn't a tuple subclass
+    assert tuple not in type(e).__mro__
+    assert e._replace(command="cd").command == "cd"
+    assert dumps(e) == dumps(expected)